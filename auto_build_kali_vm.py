@@ -5,14 +5,26 @@
 import os
 import re
 import subprocess
-import requests
 import argparse
-import json
-import time
 import shutil
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from vm_id_allocator import PVE_CONFIG_ROOT, reserve_vm_ids, release_vm_ids, snapshot_used_ids
+from kali_release import KALI_BASE_URL, DEFAULT_TTL, get_latest_release
+from template_registry import TemplateRegistry, TEMPLATE_SLOTS
+from pve_backend import configure_backend, get_backend
+from clone_planner import plan_clones, print_clone_plan, template_disk
+from cluster_placement import POLICIES, plan_placement, print_placement
+from vm_config_plan import ConfigPlan
+from vm_manifest import load_manifest, expand_manifest, expand_names, existing_vm_names
+from vm_inventory import VmRecord, load_inventory
+from pve_storage import convert_to_gb
+from run_metrics import start_run, current_run, stage as measure
+from host_capacity import AdmissionController, MIB
 
-TEMPLATE_ID = 9000  # 固定的黃金映像 VM ID
+TEMPLATE_ID = 9000  # 黃金映像模板的起始 VM ID（版本化模板使用 9000 起的槽位）
 
 # 確保必要套件已安裝
 def ensure_installed(package_name):
@@ -24,106 +36,88 @@ def ensure_installed(package_name):
         print(f"[SKIP] 已安裝 {package_name}，跳過安裝")
 
 # 從 Kali 官方網站取得最新版本的 QEMU 映像資訊
-def get_latest_kali_url(base_url: str):
-    response = requests.get(base_url)
-    dirs = sorted(set(re.findall(r'kali-\d+\.\d+[a-z]?/', response.text)), reverse=True)
-    if not dirs:
-        raise RuntimeError("無法取得 Kali 最新版本目錄")
-    kali_dir = dirs[0].strip('/')
-    version = kali_dir.replace("kali-", "")
-    filename = f"kali-linux-{version}-qemu-amd64.7z"
-    return kali_dir, version, filename, f"{base_url}{kali_dir}/{filename}"
-
-# 檢查 VM ID 是否已經在使用中
+def get_latest_kali_url(base_url: str, cache_dir=None, ttl: int = DEFAULT_TTL, offline: bool = False):
+    with measure("get_latest_kali_url"):
+        return get_latest_release(base_url, cache_dir, ttl, offline)
+
+# 檢查 VM ID 是否已經在使用中（涵蓋叢集所有節點的 /etc/pve/nodes/*）
 def id_in_use(vm_id: int) -> bool:
-    vm_conf = Path(f"/etc/pve/qemu-server/{vm_id}.conf")
-    ct_conf = Path(f"/etc/pve/lxc/{vm_id}.conf")
-    return (
-        subprocess.run(["qm", "status", str(vm_id)], stdout=subprocess.DEVNULL).returncode == 0 or
-        subprocess.run(["pct", "status", str(vm_id)], stdout=subprocess.DEVNULL).returncode == 0 or
-        vm_conf.exists() or
-        ct_conf.exists()
-    )
-
-# 找出尚未使用的 VM ID
+    return vm_id in snapshot_used_ids()
+
+# 找出尚未使用的 VM ID（以單次目錄快照判斷，不逐一呼叫 qm / pct）
 def find_available_vm_id(start: int = 100):
-    while id_in_use(start):
+    used = snapshot_used_ids()
+    while start in used:
         start += 1
     return start
 
-# 從 qm config 解析磁碟容量大小
+# 從 VM 清單快取取得磁碟容量大小（/etc/pve 不在本機時才向後端查詢）
 def get_disk_size_gb(vm_id: int, storage: str) -> str:
-    result = subprocess.run(["qm", "config", str(vm_id)], stdout=subprocess.PIPE, text=True)
-    for line in result.stdout.splitlines():
-        if "scsi0:" in line and f"{storage}:" in line:
-            for part in line.split(","):
-                if part.startswith("size="):
-                    return part.split("=")[1]
+    with measure("get_disk_size_gb", vm_id):
+        record = load_inventory(refresh=False).reload(vm_id)
+        if record is None:
+            record = VmRecord(vm_id, "qemu", None, get_backend().get_config(vm_id))
+    disk = record.disk("scsi0")
+    if disk and disk.storage == storage and disk.size_text:
+        return disk.size_text
     return "未知"
 
-# 將容量格式轉換為 GiB 表示
-def convert_to_gb(size_str: str) -> str:
-    if size_str.endswith("G"):
-        return size_str
-    elif size_str.endswith("M"):
-        return f"{float(size_str[:-1]) / 1024:.1f}G"
-    elif size_str.endswith("K"):
-        return f"{float(size_str[:-1]) / (1024 * 1024):.2f}G"
-    return size_str
-
-# 等待 guest agent 傳回 VM IP 地址（eth0 或常見名稱）
-def wait_for_ip(vm_id, retries=50, delay=1):
-    for _ in range(retries):
-        try:
-            result = subprocess.run(
-                ["qm", "guest", "cmd", str(vm_id), "network-get-interfaces"],
-                capture_output=True, text=True, timeout=5
-            )
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                for iface in data:
-                    if iface.get("name") not in ["eth0", "ens18", "ens3", "enp0s3"]:
-                        continue
-                    for ip in iface.get("ip-addresses", []):
-                        if ip.get("ip-address-type") == "ipv4" and ip.get("ip-address") != "127.0.0.1":
-                            return ip.get("ip-address")
-        except Exception:
-            pass
-        time.sleep(delay)
-    return "未知"
+# 等待 guest agent 傳回 VM IP 地址（eth0 或常見名稱），VM 一取得 IP 即返回
+def wait_for_ip(vm_id, timeout=120):
+    from qga_readiness import wait_for_ips
+    return wait_for_ips([vm_id], timeout).get(vm_id) or "未知"
+
+# 找出壓縮檔中的 qcow2 成員名稱（lsar 隨 unar 一併安裝）
+def archive_qcow2_member(archive: Path) -> str:
+    result = subprocess.run(["lsar", str(archive)], stdout=subprocess.PIPE, text=True, check=True)
+    for line in result.stdout.splitlines()[1:]:
+        if line.strip().endswith(".qcow2"):
+            return line.strip()
+    raise RuntimeError("找不到壓縮檔中的 qcow2 映像")
 
-# 建立 Kali 模板（黃金映像）
-def create_template(args, version):
-    vm_id = TEMPLATE_ID
+# 建立 Kali 模板（黃金映像），映像存放於 <workdir>/<版本>/，回傳 (qcow2 或 None, 映像 SHA256)
+def create_template(args, version, release=None, vm_id=TEMPLATE_ID, expected_sha256=None):
+    # 下載（requests）與解壓縮相關模組及 unar 檢查只在實際建置模板時才載入，一般 clone 流程不需要
+    from kali_download import download_image, fetch_expected_sha256, make_session
+    from stream_import import stream_import_disk
+    if not args.stream_import:
+        ensure_installed("unar")
     working_dir = Path(args.workdir).resolve()
-    kali_dir, _, filename, kali_url = get_latest_kali_url("https://cdimage.kali.org/")
-    iso_path = working_dir / filename
+    release = release or get_latest_kali_url(KALI_BASE_URL, working_dir, args.release_ttl, args.offline)
+    kali_dir, _, filename, kali_url = release
+    image_dir = working_dir / version
+    iso_path = image_dir / filename
     version_file = working_dir / ".kali_version"
 
-    working_dir.mkdir(parents=True, exist_ok=True)
+    image_dir.mkdir(parents=True, exist_ok=True)
 
-    # 檢查是否已存在 qcow2 檔案
-    qcow2file = next(working_dir.glob("*.qcow2"), None)
-    if qcow2file:
-        print(f"[INFO] 發現現有的 qcow2 檔案：{qcow2file}，跳過下載與解壓縮")
-    else:
-        print(f"[INFO] 下載 Kali 映像：{kali_url}")
-        subprocess.run(["wget", "-c", "--retry-connrefused", "--tries=5", "--show-progress", kali_url],
-                       check=True, cwd=working_dir)
-
-        print("[INFO] 清空工作目錄中其他檔案 ...")
-        for f in working_dir.glob("*"):
-            if f.name != filename:
-                f.unlink()
+    print(f"[INFO] 下載 Kali 映像：{kali_url}")
+    session = make_session(args.download_segments)
+    if expected_sha256 is None:
+        expected_sha256 = fetch_expected_sha256(kali_url, session)
+        if not expected_sha256:
+            print("[WARN] SHA256SUMS 中找不到對應檔案，將略過雜湊驗證")
+    with measure("download") as record:
+        stats = download_image(kali_url, iso_path, args.download_segments, expected_sha256, session)
+        record["bytes"] = stats.downloaded - stats.resumed
+        record["retries"] = stats.retries
+    image_sha256 = stats.sha256
 
-        print("[INFO] 解壓縮 Kali QEMU 映像 ...")
-        subprocess.run(["unar", "-f", filename], check=True, cwd=working_dir)
+    # 串流匯入模式不使用中間 qcow2 檔
+    qcow2file = None
+    if not args.stream_import:
+        qcow2file = image_dir / archive_qcow2_member(iso_path)
+        if qcow2file.exists():
+            print(f"[INFO] 發現現有的 qcow2 檔案：{qcow2file}，跳過解壓縮")
+        else:
+            print("[INFO] 解壓縮 Kali QEMU 映像 ...")
+            with measure("extract") as record:
+                subprocess.run(["unar", "-f", "-D", "-o", str(image_dir), str(iso_path)], check=True)
+                if not qcow2file.exists():
+                    raise RuntimeError("找不到解壓後的 qcow2 映像")
+                record["bytes"] = qcow2file.stat().st_size
 
-        qcow2file = next(working_dir.glob("*.qcow2"), None)
-        if not qcow2file:
-            raise RuntimeError("找不到解壓後的 qcow2 映像")
-
-    if Path(f"/etc/pve/qemu-server/{vm_id}.conf").exists():
+    if (PVE_CONFIG_ROOT / "qemu-server" / f"{vm_id}.conf").exists():
         print(f"[INFO] 刪除舊的黃金映像 VM（ID {vm_id}）")
         subprocess.run(["qm", "destroy", str(vm_id)], check=True)
 
@@ -132,45 +126,130 @@ def create_template(args, version):
                     "--memory", str(args.max_mem),
                     "--balloon", str(args.min_mem),
                     "--cores", str(args.cpu),
-                    "--name", "kali-template",
-                    "--description", "Kali Golden Image Template",
+                    "--name", f"kali-template-{version}",
+                    "--description", f"Kali Golden Image Template {version}",
                     "--net0", f"model=virtio,bridge={args.bridge}",
                     "--ostype", "l26",
                     "--machine", "q35"], check=True)
-    subprocess.run(["qm", "importdisk", str(vm_id), str(qcow2file), args.storage, "--format", "qcow2"], check=True)
-    subprocess.run(["qm", "set", str(vm_id), "--scsi0", f"{args.storage}:vm-{vm_id}-disk-0"], check=True)
-    if args.resize != "+0G":
-        subprocess.run(["qm", "resize", str(vm_id), "scsi0", args.resize], check=True)
-    subprocess.run(["qm", "set", str(vm_id), "--boot", "order=scsi0", "--bootdisk", "scsi0"], check=True)
+    with measure("importdisk", vm_id) as record:
+        if args.stream_import:
+            disk_volume = stream_import_disk(vm_id, iso_path, args.storage, image_dir)
+        else:
+            subprocess.run(["qm", "importdisk", str(vm_id), str(qcow2file), args.storage, "--format", "qcow2"], check=True)
+            disk_volume = f"{args.storage}:vm-{vm_id}-disk-0"
+            record["bytes"] = qcow2file.stat().st_size
+    # 掛載磁碟與開機順序合併為單次 qm set
+    ConfigPlan(vm_id, {}).want(scsi0=disk_volume, boot="order=scsi0", bootdisk="scsi0") \
+        .want_resize("scsi0", args.resize).apply()
     subprocess.run(["qm", "template", str(vm_id)], check=True)
 
     with version_file.open("w") as vf:
         vf.write(version)
 
     print(f"[OK] Template VM 已建立完成（ID: {vm_id}）")
+    return qcow2file, image_sha256
 
-# 複製 Template 建立新 VM 並設定參數
-def deploy_vm(args, vm_name, index=None):
-    vm_id = find_available_vm_id(100)
-    desc = args.description if index is None else f"{args.description} #{index+1}"
+# 確保指定版本的模板存在（依版本或映像 SHA256 比對登錄表，已存在則不重建），回傳模板 VM ID
+def ensure_template(args, release):
+    working_dir = Path(args.workdir).resolve()
+    version = release[1]
+    pinned = args.template_version or version
+    registry = TemplateRegistry(working_dir, TEMPLATE_ID, args.template_slots)
+
+    with registry.locked():
+        registry.adopt_legacy(TEMPLATE_ID, working_dir / ".kali_version")
+        entry = registry.find(version=pinned)
+        if entry is None and pinned != version:
+            raise ValueError(f"[ERROR] 找不到 Kali {pinned} 的模板，可用版本：{[e['version'] for e in registry.entries]}")
+
+        if entry is None:
+            from kali_download import fetch_expected_sha256
+            expected_sha256 = None if args.offline else fetch_expected_sha256(release[3])
+            entry = registry.find(sha256=expected_sha256) if expected_sha256 else None
+            if entry is not None:
+                print(f"[SKIP] 映像 SHA256 與模板 {entry['vm_id']}（Kali {entry['version']}）相同，跳過重建")
+
+        if entry is None:
+            print(f"[INFO] 發現新版 Kali：{version}，需建立黃金映像")
+            # 增量更新的來源模板需先標記為最近使用，避免被 allocate_slot 淘汰
+            base = registry.latest() if getattr(args, "template_refresh", "full") == "incremental" else None
+            if base:
+                registry.touch(base["vm_id"])
+            vm_id, evicted = registry.allocate_slot()
+            if evicted:
+                print(f"[INFO] 淘汰最久未使用的模板 VM {evicted['vm_id']}（Kali {evicted['version']}）")
+                subprocess.run(["qm", "destroy", str(evicted["vm_id"])], check=True)
+                if evicted.get("image_dir"):
+                    shutil.rmtree(evicted["image_dir"], ignore_errors=True)
+            if base:
+                from template_refresh import refresh_template
+                try:
+                    refresh_template(base["vm_id"], vm_id, version)
+                    entry = registry.register(vm_id, version, None, None)
+                except Exception as e:
+                    print(f"[WARN] 增量更新失敗，改為下載完整映像重建：{e}")
+            if entry is None:
+                _, image_sha256 = create_template(args, version, release, vm_id, expected_sha256)
+                entry = registry.register(vm_id, version, image_sha256, working_dir / version)
+
+        registry.touch(entry["vm_id"])
+    print(f"[INFO] 使用模板 VM {entry['vm_id']}（Kali {entry['version']}）")
+    return entry["vm_id"]
+
+# 各階段並行上限，避免同一儲存空間同時執行過多 qm clone / qm start；admission 為主機容量控制（可選）
+class StageLimits:
+    def __init__(self, clone=2, start=4, admission=None):
+        self.admission = admission
+        self._semaphores = {
+            "clone": threading.BoundedSemaphore(max(1, clone)),
+            "start": threading.BoundedSemaphore(max(1, start)),
+        }
+
+    def __call__(self, stage):
+        return self._semaphores.get(stage) or nullcontext()
+
+# 階段一：由 Template 複製 VM
+def clone_vm(vm_id, vm_name, template_id=TEMPLATE_ID, clone_args=()):
+    get_backend().clone(template_id, vm_id, vm_name, clone_args)
+
+# Proxmox 標籤：固定 kali、本次執行 ID（供 kali_teardown.py --run-id 選取）與 --tags
+def vm_tags(args):
+    tags = ["kali"]
+    run = current_run()
+    if run:
+        tags.append(f"run-{run.run_id}")
+    return ";".join(tags + list(getattr(args, "tags", None) or []))
+
+# 依部署參數建立設定規劃；template_config 為模板設定，用於推算 clone 後的設定而不必再讀取
+def vm_config_plan(args, vm_id, vm_name, desc, template_config=None):
     net = f"model=virtio,firewall=0,bridge={args.bridge}"
     if args.vlan:
         net += f",tag={args.vlan}"
+    return ConfigPlan.from_template(vm_id, template_config, vm_name).want(
+        memory=args.max_mem, balloon=args.min_mem, cores=args.cpu, net0=net, description=desc, agent="enabled=1",
+        tags=vm_tags(args)) \
+        .want_resize("scsi0", getattr(args, "clone_resize", None))
 
-    subprocess.run(["qm", "clone", str(TEMPLATE_ID), str(vm_id), "--name", vm_name], check=True)
-    subprocess.run(["qm", "set", str(vm_id),
-                    "--memory", str(args.max_mem),
-                    "--balloon", str(args.min_mem),
-                    "--cores", str(args.cpu),
-                    "--net0", net,
-                    "--description", desc,
-                    "--agent", "enabled=1"], check=True)
-    subprocess.run(["qm", "start", str(vm_id)], check=True)
-    time.sleep(15)  # 等待 15 秒，確保 Guest Agent 啟動
-    ip = wait_for_ip(vm_id)
-    disk = get_disk_size_gb(vm_id, args.storage)
-
-    return {
+# 階段二：以單次 qm set 套用與現有設定不同的 CPU / 記憶體 / 網卡 / 描述
+def configure_vm(args, vm_id, desc, config=None):
+    return (config or vm_config_plan(args, vm_id, None, desc)).apply()
+
+# 階段三：啟動 VM
+def start_vm(vm_id):
+    get_backend().start(vm_id)
+
+# 階段四：取得 IP 與磁碟資訊（watcher 為共用的 ReadinessWatcher，未提供時單獨等待）
+def collect_vm_info(args, vm_id, vm_name, watcher=None, storage=None, node=None):
+    with measure("ip_wait", vm_id) as record:
+        if watcher is None:
+            ip = wait_for_ip(vm_id)
+        else:
+            stats = {}
+            ip = watcher.watch(vm_id, stats, node).result() or "未知"
+            record["retries"] = max(0, stats.get("attempts", 1) - 1)
+    disk = get_disk_size_gb(vm_id, storage or args.storage)
+
+    info = {
         "vm_id": vm_id,
         "name": vm_name,
         "ip": ip,
@@ -178,6 +257,88 @@ def deploy_vm(args, vm_name, index=None):
         "ram": f"{args.min_mem} ~ {args.max_mem} MB",
         "disk": convert_to_gb(disk)
     }
+    if node:
+        info["node"] = node
+    return info
+
+# 複製 Template 建立新 VM 並設定參數
+def deploy_vm(args, vm_name, index=None, limits=None, vm_id=None, watcher=None, plan=None):
+    limits = limits or (lambda stage: nullcontext())
+    desc = args.description if index is None else f"{args.description} #{index+1}"
+    if vm_id is None:
+        vm_id = reserve_vm_ids(1, 100)[0]
+
+    node = getattr(plan, "node", None)
+    if node:
+        get_backend().assign_node(vm_id, node)
+    config = vm_config_plan(args, vm_id, vm_name, desc, getattr(args, "template_config", None))
+    # description 於 clone 時一併帶入，其餘差異合併為單次 qm set
+    with limits("clone"), measure("clone", vm_id) as record:
+        clone_args = [*(plan.clone_args() if plan else ()), *config.clone_args()]
+        clone_vm(vm_id, vm_name, getattr(args, "template_id", TEMPLATE_ID), clone_args)
+        config.cloned()
+        record["bytes"] = plan.size if plan else 0
+    with limits("set"), measure("set", vm_id):
+        configure_vm(args, vm_id, desc, config)
+    # 依主機記憶體與 CPU / IO 壓力排隊，並錯開開機時間（僅適用於本機節點）
+    admission = getattr(limits, "admission", None)
+    if admission and not node:
+        with measure("admission", vm_id):
+            admission.admit(vm_id, args.max_mem * MIB)
+    with limits("start"), measure("start", vm_id):
+        start_vm(vm_id)
+    return collect_vm_info(args, vm_id, vm_name, watcher, plan.storage if plan else None, node)
+
+# 並行部署多台 VM，jobs 為 (args, vm_name, index, vm_id, clone_plan) 清單，結果依原順序回傳
+def deploy_vms_parallel(jobs, parallel=1, limits=None, ip_timeout=120):
+    # qga_readiness 會載入 asyncio，延後到真正部署時才匯入，讓 --help / --dry-run 等路徑維持快速啟動
+    from qga_readiness import ReadinessWatcher
+    limits = limits or StageLimits()
+
+    with ReadinessWatcher(timeout=ip_timeout) as watcher:
+        def run(job):
+            job_args, vm_name, index, vm_id, plan = job
+            try:
+                return deploy_vm(job_args, vm_name, index, limits, vm_id, watcher, plan)
+            except Exception as e:
+                print(f"[ERROR] VM {vm_name} 部署失敗：{e}")
+                return {"name": vm_name, "error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+            return list(pool.map(run, jobs))
+
+# 驗證 VM 參數（CLI 與 manifest 中每台 VM 共用）
+def validate_args(args):
+    if args.count < 1:
+        raise ValueError("[ERROR] --count 必須大於等於 1")
+    if args.min_mem < 512 or args.max_mem < args.min_mem:
+        raise ValueError("[ERROR] 記憶體配置無效，請檢查 --min-mem 與 --max-mem")
+    if args.cpu < 1:
+        raise ValueError("[ERROR] --cpu 必須大於等於 1")
+    for resize in (args.resize, getattr(args, "clone_resize", None)):
+        if resize and not re.match(r"^[+-]?\d+[GMK]$", resize):
+            raise ValueError("[ERROR] --resize 格式無效，請使用類似 +10G 的格式")
+    if args.vlan and not args.vlan.isdigit():
+        raise ValueError("[ERROR] --vlan 必須是數字")
+    for tag in getattr(args, "tags", None) or []:
+        if not re.match(r"^[a-z0-9_][a-z0-9_+.-]*$", tag):
+            raise ValueError(f"[ERROR] 標籤 {tag} 格式無效，僅可使用小寫英數字與 _ + . -")
+
+# 輸出部署結果摘要
+def print_summary(all_vms):
+    print("\n=== 所有 Kali VM 建立完成 ===\n")
+    for vm in all_vms:
+        if vm.get("existing"):
+            print(f"⏭️ VM {vm['name']} (ID: {vm['vm_id']}) 已存在，略過\n")
+            continue
+        if "error" in vm:
+            print(f"❌ VM {vm['name']} 建立失敗：{vm['error']}\n")
+            continue
+        print(f"📌 VM {vm['name']} (ID: {vm['vm_id']})" + (f" @ {vm['node']}" if vm.get("node") else ""))
+        print(f"🧠 記憶體：{vm['ram']}")
+        print(f"🧮 CPU：{vm['cpu']}")
+        print(f"💾 磁碟：{vm['disk']}")
+        print(f"🌐 IP：{vm['ip']}\n")
 
 # 主程式進入點
 if __name__ == "__main__":
@@ -193,58 +354,96 @@ if __name__ == "__main__":
     parser.add_argument("--resize", default="+0G", help="磁碟大小調整值，例如 +10G 或 +0G 表示不變更")
     parser.add_argument("--storage", default="local-lvm")
     parser.add_argument("--workdir", default="/var/lib/vz/template/iso/kali-images")
+    parser.add_argument("--offline", action="store_true", help="不連線 Kali 鏡像站，直接使用快取的版本資訊")
+    parser.add_argument("--release-ttl", type=int, default=DEFAULT_TTL, help="Kali 版本快取有效秒數")
+    parser.add_argument("--download-segments", type=int, default=4, help="映像下載的並行連線（分段）數")
+    parser.add_argument("--report", help="執行報告 JSONL 路徑（預設為 <workdir>/.run_reports.jsonl）")
+    parser.add_argument("--prom-textfile", help="輸出 Prometheus textfile collector 指標的 .prom 路徑（可選）")
+    parser.add_argument("--backend", choices=["cli", "api"], help="Proxmox 操作後端（預設讀取 PVE_BACKEND，未設定時為 cli）")
+    parser.add_argument("--full-clone", action="store_true", help="使用 full clone（預設在儲存支援時使用 linked clone）")
+    parser.add_argument("--target-storage", nargs="+", help="full clone 的目標儲存，可指定多個以分散負載")
+    parser.add_argument("--template-version", help="指定使用的 Kali 模板版本（預設為最新版）")
+    parser.add_argument("--template-slots", type=int, default=TEMPLATE_SLOTS, help="保留的版本化模板數量上限")
+    parser.add_argument("--stream-import", action="store_true", help="以 7z 串流解壓縮：檔案型儲存直接寫入磁碟卷，區塊型儲存（如 local-lvm）經稀疏暫存 qcow2 轉換後刪除")
+    parser.add_argument("--target", nargs="+", help="叢集目標節點（可多個，all 表示所有線上節點），未指定時只在本機建立")
+    parser.add_argument("--placement", choices=POLICIES, default="spread", help="節點放置策略：spread 分散、binpack 集中")
+    parser.add_argument("--manifest", help="批次部署清單（YAML / JSON），重跑時只建立尚不存在的 VM")
+    parser.add_argument("--template-refresh", choices=["full", "incremental"], default="full",
+                        help="新版 Kali 的模板建立方式：full 下載完整映像，incremental 以現有模板 apt full-upgrade（失敗時改為 full）")
+    parser.add_argument("--tags", nargs="+", help="額外的 Proxmox 標籤（另會自動加上 kali 與 run-<執行 ID>）")
+    parser.add_argument("--parallel", type=int, default=1, help="同時部署的 VM 數量")
+    parser.add_argument("--clone-concurrency", type=int, default=2, help="同時執行 qm clone 的上限")
+    parser.add_argument("--start-concurrency", type=int, default=4, help="同時執行 qm start 的上限")
+    parser.add_argument("--ip-timeout", type=int, default=120, help="等待 guest agent 回報 IP 的秒數上限")
+    parser.add_argument("--mem-reserve", type=int, default=2048, help="啟動 VM 時保留給主機的記憶體（MB）")
+    parser.add_argument("--max-cpu-pressure", type=float, default=80.0, help="CPU PSI avg10 超過此百分比時暫緩啟動")
+    parser.add_argument("--max-io-pressure", type=float, default=50.0, help="IO PSI avg10 超過此百分比時暫緩啟動")
+    parser.add_argument("--boot-stagger", type=float, default=0.5, help="相鄰兩台 VM 啟動的最小間隔秒數")
+    parser.add_argument("--no-admission", action="store_true", help="停用主機容量檢查（例如以 API 操作其他節點時）")
     args = parser.parse_args()
 
     # 驗證輸入參數
-    if args.count < 1:
-        raise ValueError("[ERROR] --count 必須大於等於 1")
-    if args.min_mem < 512 or args.max_mem < args.min_mem:
-        raise ValueError("[ERROR] 記憶體配置無效，請檢查 --min-mem 與 --max-mem")
-    if args.cpu < 1:
-        raise ValueError("[ERROR] --cpu 必須大於等於 1")
-    if args.resize and not re.match(r"^[+-]?\d+[GMK]$", args.resize):
-        raise ValueError("[ERROR] --resize 格式無效，請使用類似 +10G 的格式")
-    if args.vlan and not args.vlan.isdigit():
-        raise ValueError("[ERROR] --vlan 必須是數字")
+    validate_args(args)
+    if args.download_segments < 1:
+        raise ValueError("[ERROR] --download-segments 必須大於等於 1")
+    if args.template_slots < 1:
+        raise ValueError("[ERROR] --template-slots 必須大於等於 1")
+    if args.parallel < 1 or args.clone_concurrency < 1 or args.start_concurrency < 1:
+        raise ValueError("[ERROR] --parallel / --clone-concurrency / --start-concurrency 必須大於等於 1")
+    if args.mem_reserve < 0 or args.boot_stagger < 0:
+        raise ValueError("[ERROR] --mem-reserve / --boot-stagger 不可為負數")
 
-    # 名稱規則處理：單一名稱時自動編號，多名稱時需與 count 相等
-    if len(args.name) == 1:
-        vm_names = [args.name[0]] + [f"{args.name[0]}-{i}" for i in range(1, args.count)]
-    elif len(args.name) == args.count:
-        vm_names = args.name
+    # manifest 模式：一次展開並驗證所有 VM，之後只建立名稱尚不存在的 VM
+    if args.manifest:
+        entries = expand_manifest(load_manifest(args.manifest), args, validate_args)
+        existing = existing_vm_names()
+        done = [{"name": name, "vm_id": existing[name], "existing": True}
+                for _, name, _ in entries if name in existing]
+        entries = [entry for entry in entries if entry[1] not in existing]
+        print(f"[INFO] manifest 共 {len(entries) + len(done)} 台 VM，已存在 {len(done)} 台，需建立 {len(entries)} 台")
     else:
-        raise ValueError(f"[ERROR] VM 名稱數量（{len(args.name)}）與 --count（{args.count}）不一致")
-
-    ensure_installed("unar")
+        entries = [(args, name, i) for i, name in enumerate(expand_names(args.name, args.count))]
+        done = []
+    if not entries:
+        print_summary(done)
+        raise SystemExit(0)
 
+    run = start_run("auto_build_kali_vm", params={"count": len(entries), "parallel": args.parallel,
+                                                   "backend": args.backend, "stream_import": args.stream_import,
+                                                   "manifest": args.manifest})
+    configure_backend(args.backend)
     working_dir = Path(args.workdir)
-    version_file = working_dir / ".kali_version"
-    template_conf = Path(f"/etc/pve/qemu-server/{TEMPLATE_ID}.conf")
-    qcow2file = next(working_dir.glob("*.qcow2"), None)
-    _, version, _, _ = get_latest_kali_url("https://cdimage.kali.org/")
-
-    version_changed = True
-    if version_file.exists():
-        with version_file.open() as vf:
-            if vf.read().strip() == version:
-                version_changed = False
-
-    # 若模板不存在或版本改變，則重新建立
-    if not template_conf.exists() or not qcow2file or version_changed:
-        print(f"[INFO] 偵測到以下情況需建立黃金映像：")
-        if not template_conf.exists(): print("  - VM 9000 不存在")
-        if not qcow2file: print("  - 缺少 qcow2 映像")
-        if version_changed: print(f"  - 發現新版 Kali：{version}")
-        create_template(args, version)
-
-    all_vms = []
-    for i in range(args.count):
-        all_vms.append(deploy_vm(args, vm_names[i], i))
+    vm_ids = []
+    try:
+        release = get_latest_kali_url(KALI_BASE_URL, working_dir, args.release_ttl, args.offline)
+        template_id = ensure_template(args, release)
+        template_config = get_backend().get_config(template_id)
 
-    print("\n=== 所有 Kali VM 建立完成 ===\n")
-    for vm in all_vms:
-        print(f"📌 VM {vm['name']} (ID: {vm['vm_id']})")
-        print(f"🧠 記憶體：{vm['ram']}")
-        print(f"🧮 CPU：{vm['cpu']}")
-        print(f"💾 磁碟：{vm['disk']}")
-        print(f"🌐 IP：{vm['ip']}\n")
+        # 一次保留整批 VM ID，避免與其他同時執行的建置流程衝突
+        vm_ids = reserve_vm_ids(len(entries), 100)
+        admission = None if args.no_admission else AdmissionController(
+            args.mem_reserve * MIB, args.max_cpu_pressure, args.max_io_pressure, args.boot_stagger)
+        if admission:
+            print(f"[INFO] 主機狀態：{admission.snapshot().describe()}")
+        limits = StageLimits(args.clone_concurrency, args.start_concurrency, admission)
+        # 部署前先規劃 linked / full clone 並輸出預估資料量與時間
+        plans = plan_clones(template_id, vm_ids, args.full_clone, args.target_storage,
+                            template_config=template_config)
+        print_clone_plan(plans, args.clone_concurrency)
+        if args.target:
+            placement = plan_placement(plans, [vm_args.max_mem * MIB for vm_args, _, _ in entries], args.target,
+                                       args.placement, template_disk(template_id, template_config)[0])
+            print_placement(placement, args.placement)
+        jobs = []
+        for (vm_args, vm_name, index), vm_id, plan in zip(entries, vm_ids, plans):
+            vm_args.template_id, vm_args.template_config = template_id, template_config
+            jobs.append((vm_args, vm_name, index, vm_id, plan))
+        all_vms = done + deploy_vms_parallel(jobs, args.parallel, limits, args.ip_timeout)
+    finally:
+        if vm_ids:
+            release_vm_ids(vm_ids)
+        run.finish(args.report or working_dir / ".run_reports.jsonl", args.prom_textfile)
+    print_summary(all_vms)
+    print(f"[INFO] 執行 ID：{run.run_id}（可用 kali_report.py / kali_teardown.py --run-id {run.run_id} 查詢或移除本次建立的 VM）")
+    if any("error" in vm for vm in all_vms):
+        raise SystemExit(1)
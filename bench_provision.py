@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 佈建效能量測：以模擬的 qm / pct / unar / wget 與 guest agent 驅動各腳本，不需真實 Proxmox 節點
+# 輸出各腳本在不同 VM 數量下的 VMs/分鐘、time-to-IP p50 / p95 與子程序數
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from fake_qga import FakeQgaFleet
+from fake_pve_tools import install_fake_tools, seed_pve_root
+from kali_release import KALI_BASE_URL, RELEASE_CACHE_NAME
+
+ROOT = Path(__file__).resolve().parent
+SCRIPTS = ("auto_build_kali_vm", "test_kali", "n8n")
+BENCH_VERSION = "2025.2"
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+# 監看 fake qm start 留下的標記，為每台啟動的 VM 建立模擬 guest agent socket
+class AgentSpawner:
+    def __init__(self, state_dir, socket_dir, boot_delay):
+        self.started_dir = Path(state_dir) / "started"
+        self.fleet = FakeQgaFleet(socket_dir)
+        self.boot_delay = boot_delay
+        self._seen = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(0.02):
+            if not self.started_dir.exists():
+                continue
+            for marker in self.started_dir.iterdir():
+                if marker.name.isdigit() and marker.name not in self._seen:
+                    self._seen.add(marker.name)
+                    vm_id = int(marker.name)
+                    self.fleet.add(vm_id, f"10.0.{vm_id // 256 % 256}.{vm_id % 256}", self.boot_delay)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.fleet.close()
+
+# 建立一次量測所需的假環境（PATH、/etc/pve、工作目錄、鎖檔與 socket 目錄）
+def prepare_env(base, opts):
+    base = Path(base)
+    pve_root = seed_pve_root(base / "pve")
+    workdir = base / "workdir"
+    workdir.mkdir()
+    (workdir / ".kali_version").write_text(BENCH_VERSION)
+    (workdir / "kali-linux-qemu-amd64.qcow2").touch()
+    (workdir / RELEASE_CACHE_NAME).write_text(json.dumps({
+        "base_url": KALI_BASE_URL, "kali_dir": f"kali-{BENCH_VERSION}", "fetched_at": time.time()}))
+    socket_dir = base / "qga"
+    socket_dir.mkdir()
+    # 主機容量檢查讀取的假 /proc（記憶體充足、無壓力）
+    proc_root = base / "proc"
+    (proc_root / "pressure").mkdir(parents=True)
+    mem_kb = int(opts.host_mem * 1024 ** 2)
+    (proc_root / "meminfo").write_text(f"MemTotal: {mem_kb} kB\nMemFree: {mem_kb} kB\nMemAvailable: {mem_kb} kB\n")
+    for resource in ("cpu", "io", "memory"):
+        (proc_root / "pressure" / resource).write_text(
+            "some avg10=0.00 avg60=0.00 avg300=0.00 total=0\nfull avg10=0.00 avg60=0.00 avg300=0.00 total=0\n")
+    bin_dir = install_fake_tools(base / "bin")
+    env = dict(os.environ,
+               PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+               PVE_CONFIG_ROOT=str(pve_root),
+               FAKE_PVE_STATE=str(base / "state"),
+               KALI_VMID_LOCK=str(base / "vm_ids.lock"),
+               HOST_PROC_ROOT=str(proc_root),
+               HOST_SYS_ROOT=str(base / "sys"),
+               QGA_SOCKET_DIR=str(socket_dir),
+               FAKE_LATENCY=str(opts.latency),
+               FAKE_FAIL_RATE=str(opts.fail_rate),
+               FAKE_BOOT_DELAY=str(opts.boot_delay),
+               PVE_BACKEND="cli",
+               PYTHONDONTWRITEBYTECODE="1")
+    return env, workdir, base / "state", socket_dir
+
+# 由執行報告計算每台 VM 的 time-to-IP（clone 開始 → ip_wait 結束）
+def time_to_ip_from_report(report_path):
+    try:
+        report = json.loads(report_path.read_text().splitlines()[-1])
+    except (OSError, IndexError, ValueError):
+        return {}, None
+    first, ready = {}, {}
+    for record in report["stages"]:
+        vm_id = record.get("vm_id")
+        if vm_id is None:
+            continue
+        first[vm_id] = min(first.get(vm_id, record["start"]), record["start"])
+        if record["stage"] == "ip_wait" and record["ok"]:
+            ready[vm_id] = record["start"] + record["wall"]
+    return {vm_id: ready[vm_id] - first[vm_id] for vm_id in ready}, report
+
+def count_tool_calls(state_dir):
+    calls = {}
+    log = Path(state_dir) / "calls.log"
+    if log.exists():
+        for line in log.read_text().splitlines():
+            tool = json.loads(line)["tool"]
+            calls[tool] = calls.get(tool, 0) + 1
+    return calls
+
+def _run_script(name, extra_args, env, workdir, count, opts):
+    report = workdir / "bench_report.jsonl"
+    cmd = [sys.executable, str(ROOT / f"{name}.py"), "--count", str(count), "--name", "bench",
+           "--workdir", str(workdir), "--report", str(report), *extra_args]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          text=True, timeout=opts.timeout)
+    wall = time.perf_counter() - t0
+    ttips, data = time_to_ip_from_report(report)
+    error = None
+    if data is None:
+        error = (proc.stderr.strip().splitlines() or [f"結束碼 {proc.returncode}"])[-1]
+    return wall, ttips, (data or {}).get("subprocesses"), 1, error
+
+# n8n.py 每台 VM 啟動一次程序（對應 n8n Execute Command 節點），結束後由量測端等待 IP
+def _run_n8n(env, count, opts):
+    from qga_readiness import ReadinessWatcher
+    vm_ids = list(range(100, 100 + count))
+    ttips, errors = {}, []
+    with ReadinessWatcher(timeout=opts.ip_timeout, socket_dir=env["QGA_SOCKET_DIR"]) as watcher:
+        def one(vm_id):
+            t0 = time.perf_counter()
+            proc = subprocess.run([sys.executable, str(ROOT / "n8n.py"), "--vm_id", str(vm_id),
+                                   "--hostname", f"bench-{vm_id}", *opts.n8n_args],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if proc.returncode != 0:
+                errors.append((proc.stderr.strip().splitlines() or [f"結束碼 {proc.returncode}"])[-1])
+                return
+            if watcher.watch(vm_id).result():
+                ttips[vm_id] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=opts.n8n_concurrency) as pool:
+            list(pool.map(one, vm_ids))
+        wall = time.perf_counter() - t0
+    return wall, ttips, None, count, errors[0] if len(errors) == count else None
+
+# 執行單一腳本、單一 VM 數量的量測，回傳結果 dict
+def bench_once(name, count, opts):
+    base = tempfile.mkdtemp(prefix=f"bench-{name}-{count}-")
+    spawner = None
+    try:
+        env, workdir, state_dir, socket_dir = prepare_env(base, opts)
+        spawner = AgentSpawner(state_dir, socket_dir, opts.boot_delay)
+        if name == "auto_build_kali_vm":
+            extra = ["--parallel", str(opts.parallel), "--ip-timeout", str(opts.ip_timeout)]
+            wall, ttips, subprocesses, processes, error = _run_script(name, extra, env, workdir, count, opts)
+        elif name == "test_kali":
+            wall, ttips, subprocesses, processes, error = _run_script(name, [], env, workdir, count, opts)
+        else:
+            wall, ttips, subprocesses, processes, error = _run_n8n(env, count, opts)
+        calls = count_tool_calls(state_dir)
+    except subprocess.TimeoutExpired:
+        return {"script": name, "count": count, "error": f"超過 {opts.timeout} 秒未完成"}
+    finally:
+        if spawner:
+            spawner.close()
+        if not opts.keep:
+            shutil.rmtree(base, ignore_errors=True)
+    values = list(ttips.values())
+    return {
+        "script": name, "count": count, "ok": len(values), "failed": count - len(values),
+        "wall": round(wall, 3), "vms_per_min": round(len(values) / wall * 60, 2) if wall else None,
+        "ttip_p50": percentile(values, 0.5), "ttip_p95": percentile(values, 0.95),
+        "python_processes": processes, "subprocesses": subprocesses,
+        "tool_calls": sum(calls.values()), "tool_calls_by_tool": calls, "error": error,
+        "workdir": base if opts.keep else None,
+    }
+
+# 量測 CLI 啟動成本：`--help` 的牆鐘時間中位數、-X importtime 的累計匯入時間，以及是否載入了重量級模組
+STARTUP_SCRIPTS = ("auto_build_kali_vm", "test_kali")
+HEAVY_MODULES = ("requests", "openai", "urllib3", "ssl")
+
+def bench_startup(name, runs):
+    script = str(ROOT / f"{name}.py")
+    walls = []
+    for _ in range(runs):
+        t0 = time.monotonic()
+        subprocess.run([sys.executable, script, "--help"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        walls.append(time.monotonic() - t0)
+    proc = subprocess.run([sys.executable, "-X", "importtime", script, "--help"],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    import_us, loaded, after_site = 0, set(), False
+    for line in proc.stderr.splitlines():
+        fields = line.partition(":")[2].split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        module = fields[2].strip()
+        loaded.add(module.split(".")[0])
+        # importtime 以縮排表示巢狀匯入，只加總 site 之後的最外層模組（不計直譯器本身與 .pth 的啟動成本）
+        if not fields[2].startswith("  "):
+            if after_site:
+                import_us += int(fields[1])
+            after_site = after_site or module == "site"
+    return {"script": name, "runs": runs, "wall_p50": percentile(walls, 0.5), "wall_min": min(walls),
+            "import_ms": import_us / 1000, "heavy": [m for m in HEAVY_MODULES if m in loaded]}
+
+def print_startup_table(results):
+    print(f"\n{'腳本':<20}{'次數':>6}{'p50(ms)':>10}{'最短(ms)':>10}{'匯入(ms)':>10}  已載入重量級模組")
+    for r in results:
+        print(f"{r['script']:<20}{r['runs']:>6}{r['wall_p50'] * 1000:>10.1f}{r['wall_min'] * 1000:>10.1f}"
+              f"{r['import_ms']:>10.1f}  {', '.join(r['heavy']) or '-'}")
+
+def _fmt(value, spec=".2f"):
+    return "-" if value is None else format(value, spec)
+
+def print_table(results):
+    print(f"\n{'腳本':<20}{'數量':>6}{'成功':>6}{'耗時(s)':>10}{'VMs/分':>10}{'p50(s)':>9}{'p95(s)':>9}{'子程序':>8}{'假指令':>8}")
+    for r in results:
+        if r.get("error") and not r.get("ok"):
+            print(f"{r['script']:<20}{r['count']:>6}  [ERROR] {r['error']}")
+            continue
+        print(f"{r['script']:<20}{r['count']:>6}{r['ok']:>6}{_fmt(r['wall']):>10}{_fmt(r['vms_per_min']):>10}"
+              f"{_fmt(r['ttip_p50']):>9}{_fmt(r['ttip_p95']):>9}{_fmt(r['subprocesses'], 'd'):>8}{r['tool_calls']:>8}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以模擬 Proxmox 工具量測 VM 佈建效能")
+    parser.add_argument("--scripts", nargs="+", choices=SCRIPTS, default=list(SCRIPTS))
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--latency", type=float, default=0.05, help="每次模擬指令的延遲秒數")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="qm clone / start 失敗機率（0–1）")
+    parser.add_argument("--boot-delay", type=float, default=2.0, help="VM 啟動到 guest agent 回報 IP 的秒數")
+    parser.add_argument("--host-mem", type=float, default=1024, help="模擬主機記憶體（GiB），供啟動容量檢查使用")
+    parser.add_argument("--parallel", type=int, default=8, help="auto_build_kali_vm.py 的 --parallel")
+    parser.add_argument("--n8n-concurrency", type=int, default=4, help="同時執行的 n8n.py 程序數")
+    parser.add_argument("--n8n-args", nargs=argparse.REMAINDER, default=[], help="額外傳給 n8n.py 的參數（需放在最後）")
+    parser.add_argument("--ip-timeout", type=int, default=120)
+    parser.add_argument("--timeout", type=int, default=3600, help="單次量測的秒數上限")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔（可選）")
+    parser.add_argument("--keep", action="store_true", help="保留每次量測的暫存目錄以便檢查")
+    parser.add_argument("--startup", type=int, metavar="N",
+                        help="改為量測 CLI 啟動時間：各執行 N 次 --help，回報中位數、匯入時間與已載入的重量級模組")
+    opts = parser.parse_args()
+
+    if opts.startup is not None:
+        if opts.startup < 1:
+            raise ValueError("[ERROR] --startup 必須大於等於 1")
+        results = [bench_startup(name, opts.startup) for name in STARTUP_SCRIPTS]
+        print_startup_table(results)
+        if opts.json:
+            Path(opts.json).write_text(json.dumps({"startup": results}, ensure_ascii=False, indent=2))
+            print(f"[OK] 量測結果已寫入：{opts.json}")
+        sys.exit(0)
+
+    if not 0 <= opts.fail_rate <= 1:
+        raise ValueError("[ERROR] --fail-rate 必須介於 0 與 1 之間")
+    if min(opts.counts) < 1 or opts.parallel < 1 or opts.n8n_concurrency < 1:
+        raise ValueError("[ERROR] --counts / --parallel / --n8n-concurrency 必須大於等於 1")
+
+    results = []
+    for name in opts.scripts:
+        for count in opts.counts:
+            print(f"[INFO] 量測 {name}.py（count={count}）...")
+            result = bench_once(name, count, opts)
+            if result.get("error"):
+                print(f"[WARN] {name}.py（count={count}）：{result['error']}")
+            results.append(result)
+    print_table(results)
+    if opts.json:
+        Path(opts.json).write_text(json.dumps({"params": vars(opts), "results": results}, ensure_ascii=False, indent=2))
+        print(f"[OK] 量測結果已寫入：{opts.json}")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Clone 策略規劃：依模板所在儲存類型與剩餘空間決定 linked / full clone，並預估整批耗時與資料量
+
+from pve_backend import get_backend
+from pve_storage import FILE_STORAGE_TYPES, parse_storage_cfg, storage_status, parse_size_bytes
+
+# 支援以 copy-on-write 建立 linked clone 的儲存類型（檔案型需為 qcow2 格式）
+LINKED_CLONE_TYPES = {"lvmthin", "zfspool", "rbd", "btrfs"} | FILE_STORAGE_TYPES
+FULL_CLONE_RATE = 200 * 1024 ** 2  # full clone 預估複製速率（bytes/s）
+LINKED_CLONE_SECONDS = 2.0         # linked clone 僅建立 metadata 的預估秒數
+
+class ClonePlan:
+    def __init__(self, vm_id, mode, storage, size, seconds):
+        self.vm_id = vm_id
+        self.mode = mode          # "linked" 或 "full"
+        self.storage = storage    # clone 後磁碟所在儲存
+        self.size = size          # 需複製的位元組數
+        self.seconds = seconds
+        self.node = None          # 目標叢集節點（None 為本機），由 cluster_placement 指定
+
+    # 對應的 qm clone 額外參數
+    def clone_args(self):
+        args = ["--full", "1", "--storage", self.storage] if self.mode == "full" else ["--full", "0"]
+        if self.node:
+            args += ["--target", self.node]
+        return args
+
+# 從模板設定取得開機磁碟的 (儲存名稱, 容量 bytes, volume)；已讀取的設定可由 template_config 傳入
+def template_disk(template_id, template_config=None):
+    config = template_config if template_config is not None else get_backend().get_config(template_id)
+    scsi0 = config.get("scsi0")
+    if scsi0:
+        volume, *options = scsi0.split(",")
+        size = next((o.split("=", 1)[1] for o in options if o.startswith("size=")), "0")
+        return volume.split(":", 1)[0], parse_size_bytes(size), volume
+    raise RuntimeError(f"[ERROR] 模板 VM {template_id} 沒有 scsi0 磁碟")
+
+def supports_linked_clone(storage_kind, volume):
+    if storage_kind not in LINKED_CLONE_TYPES:
+        return False
+    if storage_kind in FILE_STORAGE_TYPES:
+        return volume.endswith(".qcow2")
+    return True
+
+# 規劃整批 clone；full=True 或儲存不支援 linked clone 時改為 full clone，並依剩餘空間分散到 target_storages
+def plan_clones(template_id, vm_ids, full=False, target_storages=None, storage_cfg=None, status=None,
+                template_config=None):
+    cfg = storage_cfg if storage_cfg is not None else parse_storage_cfg()
+    src_storage, size, volume = template_disk(template_id, template_config)
+
+    if not full and supports_linked_clone(cfg.get(src_storage, {}).get("type"), volume):
+        return [ClonePlan(vm_id, "linked", src_storage, 0, LINKED_CLONE_SECONDS) for vm_id in vm_ids]
+    if not full:
+        print(f"[WARN] 儲存 {src_storage} 不支援 linked clone，改用 full clone")
+
+    status = status if status is not None else storage_status()
+    targets = target_storages or [src_storage]
+    # 查不到狀態的儲存不做容量檢查
+    free = {name: status.get(name, {}).get("avail", float("inf")) for name in targets}
+    plans = []
+    for vm_id in vm_ids:
+        # 每台分配到剩餘空間最多的儲存，達到分散負載的效果
+        target = max(targets, key=lambda name: free[name])
+        if free[target] < size:
+            raise RuntimeError(f"[ERROR] 儲存空間不足：{', '.join(targets)} 無法再容納 {size / 1024 ** 3:.1f}G 的 full clone")
+        free[target] -= size
+        plans.append(ClonePlan(vm_id, "full", target, size, size / FULL_CLONE_RATE))
+    return plans
+
+# 輸出整批 clone 的預估資料量與時間（同一儲存上的 full clone 視為依序執行）
+def print_clone_plan(plans, clone_concurrency=1):
+    per_storage = {}
+    for plan in plans:
+        per_storage.setdefault((plan.mode, plan.storage), []).append(plan)
+    total_bytes = sum(p.size for p in plans)
+    lanes = max(1, min(clone_concurrency, len(per_storage)))
+    storage_seconds = [sum(p.seconds for p in group) for group in per_storage.values()]
+    estimate = max(max(storage_seconds, default=0), sum(storage_seconds) / lanes)
+    print("[INFO] Clone 規劃：")
+    for (mode, storage), group in per_storage.items():
+        print(f"  - {mode} clone × {len(group)} → {storage}（{sum(p.size for p in group) / 1024 ** 3:.1f}G）")
+    print(f"  預估複製資料量 {total_bytes / 1024 ** 3:.1f}G，耗時約 {estimate:.0f} 秒")
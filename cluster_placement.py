@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 叢集放置：列出各節點剩餘資源，依 spread（分散）或 binpack（集中）策略決定每台 clone 的目標節點
+
+from pve_backend import LOCAL_NODE, get_backend
+from pve_storage import parse_storage_cfg
+
+POLICIES = ("spread", "binpack")
+# 本身即為共用儲存的類型（lvm / zfs 等需於 storage.cfg 設定 shared 1）
+SHARED_STORAGE_TYPES = {"rbd", "cephfs", "nfs", "cifs", "glusterfs", "iscsi", "iscsidirect", "pbs"}
+
+class NodeCapacity:
+    def __init__(self, name, maxmem=0, mem=0, maxcpu=0, cpu=0.0):
+        self.name = name
+        self.maxmem = int(maxmem or 0)
+        self.mem_free = max(0, self.maxmem - int(mem or 0))
+        self.maxcpu = int(maxcpu or 0)
+        self.cpu_free = self.maxcpu * (1 - float(cpu or 0))
+
+# 取得線上節點資源（/cluster/resources type=node）
+def list_nodes(backend=None):
+    nodes = []
+    for item in (backend or get_backend()).cluster_nodes():
+        if item.get("status", "online") != "online":
+            continue
+        nodes.append(NodeCapacity(item.get("node") or item.get("id", "").replace("node/", ""),
+                                  item.get("maxmem"), item.get("mem"), item.get("maxcpu"), item.get("cpu")))
+    return nodes
+
+def storage_is_shared(storage, storage_cfg=None):
+    cfg = (storage_cfg if storage_cfg is not None else parse_storage_cfg()).get(storage, {})
+    return cfg.get("type") in SHARED_STORAGE_TYPES or str(cfg.get("shared", "0")) == "1"
+
+# 依 --target 篩選節點："all" 表示所有線上節點
+def resolve_targets(targets, nodes):
+    if not targets or targets == ["all"]:
+        return nodes
+    by_name = {node.name: node for node in nodes}
+    missing = [name for name in targets if name not in by_name]
+    if missing:
+        raise ValueError(f"[ERROR] 找不到線上節點：{', '.join(missing)}，可用節點：{', '.join(sorted(by_name))}")
+    return [by_name[name] for name in targets]
+
+# 為每台 VM（記憶體需求 bytes）選擇節點；spread 取剩餘比例最高者，binpack 取剩餘最少但仍放得下者
+def place_vms(demands, nodes, policy="spread"):
+    if policy not in POLICIES:
+        raise ValueError(f"[ERROR] 不支援的放置策略：{policy}")
+    free = {node.name: node.mem_free for node in nodes}
+    placement = []
+    for demand in demands:
+        fitting = [node for node in nodes if free[node.name] >= demand]
+        if not fitting:
+            raise RuntimeError(f"[ERROR] 叢集節點記憶體不足：{', '.join(free)} 皆無法再容納 {demand / 1024 ** 3:.1f}G")
+        if policy == "spread":
+            node = max(fitting, key=lambda n: (free[n.name] / n.maxmem if n.maxmem else 0, free[n.name]))
+        else:
+            node = min(fitting, key=lambda n: free[n.name])
+        free[node.name] -= demand
+        placement.append(node.name)
+    return placement
+
+# 規劃整批 clone 的目標節點並寫入 ClonePlan.node；模板磁碟不在共用儲存時只能留在本機
+def plan_placement(plans, demands, targets, policy="spread", template_storage=None, storage_cfg=None, backend=None):
+    nodes = resolve_targets(targets, list_nodes(backend))
+    if template_storage and not storage_is_shared(template_storage, storage_cfg):
+        if any(node.name != LOCAL_NODE for node in nodes):
+            print(f"[WARN] 模板磁碟位於非共用儲存 {template_storage}，無法 clone 到其他節點，改為全部建立於 {LOCAL_NODE}")
+        nodes = [node for node in nodes if node.name == LOCAL_NODE] or [NodeCapacity(LOCAL_NODE)]
+        if not nodes[0].maxmem:
+            nodes[0].mem_free = nodes[0].maxmem = float("inf")
+    placement = place_vms(demands, nodes, policy)
+    for plan, node in zip(plans, placement):
+        plan.node = None if node == LOCAL_NODE else node
+    return placement
+
+def print_placement(placement, policy):
+    counts = {}
+    for node in placement:
+        counts[node] = counts.get(node, 0) + 1
+    print(f"[INFO] 節點放置（{policy}）：" + "，".join(f"{node} × {count}" for node, count in sorted(counts.items())))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 本機模擬 OpenAI 相容的 /v1/chat/completions，供 NLP 解析離線測試使用（以規則解析產生回覆）
+
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from nlp_parser import NLP_DEFAULTS, parse_rules
+
+class FakeLlmState:
+    def __init__(self, latency=0.0, chatty=False):
+        self.latency = latency
+        self.chatty = chatty      # 以說明文字與 ``` 區塊包住 JSON，模擬不守規矩的模型
+        self.requests = 0
+        self.lock = threading.Lock()
+
+class FakeLlmHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def _send(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": f"未支援的路徑 {self.path}"}})
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0) or 0)) or b"{}")
+        prompt = next((m["content"] for m in reversed(request.get("messages", [])) if m["role"] == "user"), "")
+        match = re.search(r"輸入：「(.*?)」", prompt, re.S)
+        found, _ = parse_rules(match.group(1)) if match else ({}, False)
+        content = json.dumps(dict(NLP_DEFAULTS, **found), ensure_ascii=False)
+        if state.chatty:
+            content = f"好的，以下是轉換結果：\n```json\n{content}\n```\n如需調整請告訴我。"
+        time.sleep(state.latency)
+        self._send(200, {"id": f"fake-{state.requests}", "object": "chat.completion", "model": request.get("model"),
+                         "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                      "finish_reason": "stop"}]})
+
+    def log_message(self, *args):
+        pass
+
+# 於背景執行緒啟動模擬服務，回傳 (server, state)
+def start_fake_llm(port=0, latency=0.0, chatty=False):
+    state = FakeLlmState(latency, chatty)
+    handler = type("Handler", (FakeLlmHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="啟動模擬 OpenAI 相容 API")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="每次回覆前的延遲秒數")
+    parser.add_argument("--chatty", action="store_true", help="回覆中夾雜說明文字")
+    args = parser.parse_args()
+    server, _ = start_fake_llm(args.port, args.latency, args.chatty)
+    print(f"[OK] 模擬模型 API：http://127.0.0.1:{server.server_address[1]}/v1（NLP_API_URL）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
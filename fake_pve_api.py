@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 本機模擬 Proxmox API（/api2/json），供 ApiBackend 測試與效能量測使用
+
+import json
+import time
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakePveState:
+    def __init__(self, node="pve", task_latency=0.0):
+        self.node = node
+        self.task_latency = task_latency
+        self.vms = {9000: {"name": "kali-template", "template": "1",
+                           "scsi0": "local-lvm:base-9000-disk-0,size=80G"}}
+        self.tasks = {}
+        self.running = set()
+        self.nodes = [{"node": node, "type": "node", "status": "online", "maxmem": 256 * 1024 ** 3,
+                       "mem": 0, "maxcpu": 64, "cpu": 0.0}]
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    # 建立任務 UPID，task_latency 秒後狀態變為 stopped
+    def new_task(self, kind, vm_id, error=None):
+        with self.lock:
+            upid = f"UPID:{self.node}:{len(self.tasks):08X}:0:{int(time.time()):08X}:{kind}:{vm_id}:root@pam:"
+            self.tasks[upid] = {"done_at": time.monotonic() + self.task_latency, "error": error}
+        return upid
+
+class FakePveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # 支援 keep-alive，以驗證連線池
+    state = None
+
+    def _send(self, status, data):
+        body = json.dumps({"data": data}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _form(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        raw = self.rfile.read(length).decode() if length else ""
+        return {k: v[0] for k, v in parse_qs(raw).items()}
+
+    def _dispatch(self, method):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+        parts = [p for p in self.path.split("?", 1)[0].split("/") if p][2:]  # 去除 api2/json
+        form = self._form() if method in ("POST", "PUT") else {}
+
+        if method == "GET" and parts == ["cluster", "resources"]:
+            query = parse_qs(self.path.partition("?")[2])
+            if query.get("type") == ["vm"]:
+                return self._send(200, [{"id": f"qemu/{vm_id}", "vmid": vm_id, "type": "qemu", "node": state.node,
+                                         "name": vm.get("name", ""), "tags": vm.get("tags", ""),
+                                         "template": int(vm.get("template", 0)),
+                                         "status": "running" if vm_id in state.running else "stopped"}
+                                        for vm_id, vm in list(state.vms.items())])
+            return self._send(200, state.nodes)
+
+        if parts[:1] == ["nodes"] and len(parts) >= 4 and parts[2] == "tasks":
+            task = state.tasks.get(parts[3])
+            if task is None:
+                return self._send(404, None)
+            if time.monotonic() < task["done_at"]:
+                return self._send(200, {"status": "running"})
+            return self._send(200, {"status": "stopped", "exitstatus": task["error"] or "OK"})
+
+        if parts[:1] == ["nodes"] and len(parts) >= 4 and parts[2] == "qemu":
+            vm_id = int(parts[3])
+            action = "/".join(parts[4:])
+            vm = state.vms.get(vm_id)
+            if vm is None:
+                return self._send(500, None)
+            if method == "GET" and action == "config":
+                return self._send(200, vm)
+            if method == "POST" and action == "clone":
+                new_id = int(form["newid"])
+                with state.lock:
+                    if new_id in state.vms:
+                        return self._send(500, None)
+                    disk = vm["scsi0"].replace(f"base-{vm_id}-disk-0", f"base-{vm_id}-disk-0/vm-{new_id}-disk-0")
+                    state.vms[new_id] = {"name": form.get("name", f"vm-{new_id}"), "scsi0": disk}
+                return self._send(200, state.new_task("qmclone", vm_id))
+            if method in ("POST", "PUT") and action == "config":
+                with state.lock:
+                    vm.update(form)
+                return self._send(200, state.new_task("qmconfig", vm_id))
+            if method == "PUT" and action == "resize":
+                return self._send(200, state.new_task("qmresize", vm_id))
+            if method == "POST" and action == "status/start":
+                state.running.add(vm_id)
+                return self._send(200, state.new_task("qmstart", vm_id))
+            if method == "POST" and action in ("status/stop", "status/shutdown"):
+                state.running.discard(vm_id)
+                return self._send(200, state.new_task("qm" + action.split("/")[1], vm_id))
+            if method == "POST" and action == "template":
+                with state.lock:
+                    vm["template"] = "1"
+                    vm["scsi0"] = vm.get("scsi0", "").replace(f"vm-{vm_id}-disk", f"base-{vm_id}-disk")
+                return self._send(200, state.new_task("qmtemplate", vm_id))
+            if method == "DELETE" and action == "":
+                with state.lock:
+                    state.vms.pop(vm_id, None)
+                    state.running.discard(vm_id)
+                return self._send(200, state.new_task("qmdestroy", vm_id))
+        return self._send(501, None)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, *args):
+        pass
+
+# 於背景執行緒啟動模擬 API，回傳 (server, state)；server.server_address 為實際監聽位址
+def start_fake_api(port=0, node="pve", task_latency=0.0):
+    state = FakePveState(node, task_latency)
+    handler = type("Handler", (FakePveHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="啟動模擬 Proxmox API")
+    parser.add_argument("--port", type=int, default=8006)
+    parser.add_argument("--node", default="pve")
+    parser.add_argument("--task-latency", type=float, default=0.0, help="任務完成所需秒數")
+    args = parser.parse_args()
+    server, _ = start_fake_api(args.port, args.node, args.task_latency)
+    print(f"[OK] 模擬 Proxmox API：http://127.0.0.1:{server.server_address[1]}（PVE_API_URL）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 模擬 qm / pct / pvesm / pvesh / unar / lsar / wget 指令，於假的 /etc/pve 目錄維護 VM 狀態，供效能量測使用
+# 環境變數：PVE_CONFIG_ROOT（假 /etc/pve）、FAKE_PVE_STATE（狀態目錄）、FAKE_LATENCY（每次呼叫延遲秒數）、
+#           FAKE_FAIL_RATE（clone / start 失敗機率）、FAKE_BOOT_DELAY（qm guest cmd 回報 IP 前的開機秒數）、
+#           FAKE_NODES（叢集節點，格式 name:記憶體GiB:CPU數，以逗號分隔；預設僅本機）
+
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+import socket
+from pathlib import Path
+
+TOOLS = ("qm", "pct", "pvesm", "pvesh", "unar", "lsar", "wget")
+LOCAL_NODE = socket.gethostname().split(".")[0]
+
+def _root():
+    return Path(os.environ["PVE_CONFIG_ROOT"])
+
+def _state():
+    return Path(os.environ["FAKE_PVE_STATE"])
+
+# node 為 None 時對應本機（qemu-server 為指向 nodes/<本機> 的連結）
+def _conf_path(vm_id, node=None):
+    if node:
+        return _root() / "nodes" / node / "qemu-server" / f"{vm_id}.conf"
+    return _root() / "qemu-server" / f"{vm_id}.conf"
+
+def _nodes():
+    spec = os.environ.get("FAKE_NODES") or f"{LOCAL_NODE}:1024:64"
+    return [(name, float(mem), int(cpus)) for name, mem, cpus in (item.split(":") for item in spec.split(","))]
+
+def _read_conf(vm_id, node=None):
+    path = _conf_path(vm_id, node)
+    if not path.exists():
+        sys.stderr.write(f"Configuration file '{path}' does not exist\n")
+        sys.exit(2)
+    conf = {}
+    for line in path.read_text().splitlines():
+        key, _, value = line.partition(": ")
+        conf[key] = value
+    return conf
+
+def _write_conf(vm_id, conf, node=None):
+    path = _conf_path(vm_id, node)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text("".join(f"{k}: {v}\n" for k, v in conf.items()))
+    tmp.replace(path)
+
+def _options(args):
+    return {args[i].lstrip("-"): args[i + 1] for i in range(0, len(args) - 1, 2)}
+
+def _maybe_fail(action):
+    if random.random() < float(os.environ.get("FAKE_FAIL_RATE", "0")):
+        sys.stderr.write(f"fake {action} failure\n")
+        sys.exit(1)
+
+def _interfaces(vm_id):
+    return [{"name": "lo", "ip-addresses": [{"ip-address-type": "ipv4", "ip-address": "127.0.0.1"}]},
+            {"name": "eth0", "ip-addresses": [{"ip-address-type": "ipv4",
+                                               "ip-address": f"10.{vm_id // 65536 % 256}.{vm_id // 256 % 256}.{vm_id % 256}"}]}]
+
+def qm(args):
+    cmd, rest = args[0], args[1:]
+    if cmd == "clone":
+        _maybe_fail("clone")
+        template_id, vm_id, opts = int(rest[0]), int(rest[1]), _options(rest[2:])
+        src = _read_conf(template_id)
+        target = opts.get("target")
+        if any((_root() / "nodes").glob(f"*/qemu-server/{vm_id}.conf")) or _conf_path(vm_id).exists():
+            sys.stderr.write(f"VM {vm_id} already exists\n")
+            sys.exit(2)
+        conf = {k: v for k, v in src.items() if k not in ("template", "name")}
+        conf["name"] = opts.get("name", f"vm-{vm_id}")
+        if "description" in opts:
+            conf["description"] = opts["description"]
+        if "scsi0" in src:
+            volume, _, tail = src["scsi0"].partition(",")
+            storage = volume.split(":", 1)[0]
+            if opts.get("full") == "1":
+                conf["scsi0"] = f"{opts.get('storage', storage)}:vm-{vm_id}-disk-0,{tail}"
+            else:
+                conf["scsi0"] = f"{storage}:base-{template_id}-disk-0/vm-{vm_id}-disk-0,{tail}"
+        _write_conf(vm_id, conf, target if target != LOCAL_NODE else None)
+    elif cmd == "create":
+        _write_conf(int(rest[0]), _options(rest[1:]))
+    elif cmd == "set":
+        vm_id = int(rest[0])
+        conf = _read_conf(vm_id)
+        opts = _options(rest[1:])
+        for key in opts.pop("delete", "").split(","):
+            conf.pop(key, None)
+        conf.update(opts)
+        _write_conf(vm_id, conf)
+    elif cmd == "config":
+        for key, value in _read_conf(int(rest[0])).items():
+            print(f"{key}: {value}")
+    elif cmd == "template":
+        conf = _read_conf(int(rest[0]))
+        conf["template"] = "1"
+        if "scsi0" in conf:
+            conf["scsi0"] = conf["scsi0"].replace(f"vm-{rest[0]}-disk", f"base-{rest[0]}-disk")
+        _write_conf(int(rest[0]), conf)
+    elif cmd == "start":
+        _maybe_fail("start")
+        _read_conf(int(rest[0]))
+        _start(rest[0])
+    elif cmd in ("stop", "shutdown"):
+        _read_conf(int(rest[0]))
+        (_state() / "started" / rest[0]).unlink(missing_ok=True)
+    elif cmd == "destroy":
+        _read_conf(int(rest[0]))
+        _conf_path(int(rest[0])).unlink()
+        (_state() / "started" / rest[0]).unlink(missing_ok=True)
+    elif cmd == "status":
+        _read_conf(int(rest[0]))
+        print("status: " + ("running" if (_state() / "started" / rest[0]).exists() else "stopped"))
+    elif cmd == "guest" and rest[:1] == ["cmd"]:
+        _read_conf(int(rest[1]))
+        if not _booted(rest[1]):
+            sys.stderr.write("QEMU guest agent is not running\n")
+            sys.exit(255)
+        print(json.dumps(_interfaces(int(rest[1]))))
+    elif cmd == "list":
+        print(f"{'VMID':>10} NAME                 STATUS")
+        for conf in sorted((_root() / "qemu-server").glob("*.conf"), key=lambda p: int(p.stem)):
+            running = (_state() / "started" / conf.stem).exists()
+            print(f"{conf.stem:>10} {_read_conf(int(conf.stem)).get('name', ''):<20} {'running' if running else 'stopped'}")
+    elif cmd in ("resize", "importdisk"):
+        _read_conf(int(rest[0]))
+    else:
+        sys.stderr.write(f"fake qm: 未支援的指令 {cmd}\n")
+        sys.exit(1)
+
+def _start(vm_id):
+    started = _state() / "started"
+    started.mkdir(parents=True, exist_ok=True)
+    (started / str(vm_id)).write_text(str(time.time()))
+
+def _booted(vm_id):
+    marker = _state() / "started" / str(vm_id)
+    boot_delay = float(os.environ.get("FAKE_BOOT_DELAY", "0"))
+    return marker.exists() and time.time() - float(marker.read_text()) >= boot_delay
+
+# 各節點 VM 的 /cluster/resources --type vm 紀錄
+def _vm_resources():
+    resources = []
+    for conf in sorted((_root() / "nodes").glob("*/qemu-server/*.conf")):
+        node, vm_id = conf.parent.parent.name, int(conf.stem)
+        data = _read_conf(vm_id, node)
+        resources.append({"id": f"qemu/{vm_id}", "vmid": vm_id, "type": "qemu", "node": node,
+                          "name": data.get("name", ""), "tags": data.get("tags", ""),
+                          "template": int(data.get("template", 0)), "maxmem": int(data.get("memory", 0)) * 1024 ** 2,
+                          "status": "running" if (_state() / "started" / str(vm_id)).exists() else "stopped"})
+    return resources
+
+# pvesh：叢集資源與 /nodes/<node>/qemu/<vmid>/... 路徑（供操作其他節點上的 VM）
+def pvesh(args):
+    method, path, opts = args[0], args[1], _options([a for a in args[2:] if a != "--output-format" and a != "json"])
+    parts = [p for p in path.split("/") if p]
+    if method == "get" and parts == ["cluster", "resources"] and opts.get("type") == "vm":
+        print(json.dumps(_vm_resources()))
+        return
+    if method == "get" and parts == ["cluster", "resources"]:
+        resources = []
+        for name, mem_gb, cpus in _nodes():
+            used = sum(int(_read_conf(int(c.stem), name).get("memory", 0)) * 1024 ** 2
+                       for c in (_root() / "nodes" / name / "qemu-server").glob("*.conf")
+                       if (_state() / "started" / c.stem).exists())
+            resources.append({"id": f"node/{name}", "node": name, "type": "node", "status": "online",
+                              "maxmem": int(mem_gb * 1024 ** 3), "mem": used, "maxcpu": cpus, "cpu": 0.05})
+        print(json.dumps(resources))
+        return
+    if parts[:1] != ["nodes"] or len(parts) < 4 or parts[2] != "qemu":
+        sys.stderr.write(f"fake pvesh: 未支援的路徑 {path}\n")
+        sys.exit(1)
+    node, vm_id, action = parts[1], int(parts[3]), "/".join(parts[4:])
+    conf = _read_conf(vm_id, node)
+    if method == "get" and action == "config":
+        print(json.dumps(conf))
+    elif method == "set" and action == "config":
+        conf.update(opts)
+        _write_conf(vm_id, conf, node)
+    elif method == "set" and action == "resize":
+        pass
+    elif method == "create" and action == "status/start":
+        _maybe_fail("start")
+        _start(vm_id)
+    elif method == "create" and action in ("status/stop", "status/shutdown"):
+        (_state() / "started" / str(vm_id)).unlink(missing_ok=True)
+    elif method == "create" and action == "template":
+        conf["template"] = "1"
+        if "scsi0" in conf:
+            conf["scsi0"] = conf["scsi0"].replace(f"vm-{vm_id}-disk", f"base-{vm_id}-disk")
+        _write_conf(vm_id, conf, node)
+    elif method == "delete" and action == "":
+        _conf_path(vm_id, node).unlink()
+        (_state() / "started" / str(vm_id)).unlink(missing_ok=True)
+    elif method == "get" and action == "agent/network-get-interfaces":
+        if not _booted(vm_id):
+            sys.stderr.write("QEMU guest agent is not running\n")
+            sys.exit(255)
+        print(json.dumps({"result": _interfaces(vm_id)}))
+    else:
+        sys.stderr.write(f"fake pvesh: 未支援的操作 {method} {path}\n")
+        sys.exit(1)
+
+def pvesm(args):
+    if args[:1] == ["status"]:
+        print("Name             Type     Status           Total            Used       Available        %")
+        print("local-lvm     lvmthin     active      1073741824        10485760      1063256064    0.98%")
+        print("local             dir     active       104857600        10485760        94371840   10.00%")
+    elif args[:1] == ["path"]:
+        print(f"/dev/pve/{args[1].split(':', 1)[1]}")
+    elif args[:1] == ["alloc"]:
+        print(f"successfully created '{args[1]}:{args[3]}'")
+
+def main():
+    tool = sys.argv[1]
+    args = sys.argv[2:]
+    state = _state()
+    state.mkdir(parents=True, exist_ok=True)
+    # 記錄每次呼叫（供量測子程序數量）
+    with (state / "calls.log").open("a") as log:
+        fcntl.flock(log, fcntl.LOCK_EX)
+        log.write(json.dumps({"tool": tool, "args": args[:2], "ts": time.time()}) + "\n")
+    time.sleep(float(os.environ.get("FAKE_LATENCY", "0")))
+
+    if tool == "qm":
+        # 真實 qm 會取得 VM 設定鎖，此處以全域鎖模擬 pmxcfs 寫入序列化
+        with (state / "qm.lock").open("a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            qm(args)
+    elif tool == "pct":
+        sys.exit(2)  # 無 LXC 容器
+    elif tool == "pvesm":
+        pvesm(args)
+    elif tool == "pvesh":
+        with (state / "qm.lock").open("a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            pvesh(args)
+    elif tool == "lsar":
+        print(f"{args[-1]}: 7-Zip")
+        print("kali-linux-qemu-amd64.qcow2")
+
+# 於 bin_dir 建立各指令的包裝腳本，回傳 bin_dir
+def install_fake_tools(bin_dir):
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    script = Path(__file__).resolve()
+    for tool in TOOLS:
+        wrapper = bin_dir / tool
+        wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {tool} "$@"\n')
+        wrapper.chmod(0o755)
+    return bin_dir
+
+# 建立假的 /etc/pve 目錄：含 storage.cfg 與模板 VM；nodes 為其他叢集節點名稱，shared=True 時模板儲存設為共用
+def seed_pve_root(root, template_id=9000, storage="local-lvm", nodes=(), shared=False):
+    root = Path(root)
+    for node in {LOCAL_NODE, *nodes}:
+        for kind in ("qemu-server", "lxc"):
+            (root / "nodes" / node / kind).mkdir(parents=True, exist_ok=True)
+    for kind in ("qemu-server", "lxc"):
+        if not (root / kind).exists():
+            (root / kind).symlink_to(Path("nodes") / LOCAL_NODE / kind)
+    if set(nodes) - {LOCAL_NODE}:
+        (root / "corosync.conf").write_text("totem {\n  cluster_name: fake\n}\n")
+    (root / "storage.cfg").write_text(
+        "dir: local\n\tpath /var/lib/vz\n\tcontent iso,vztmpl,backup\n\n"
+        f"lvmthin: {storage}\n\tthinpool data\n\tvgname pve\n\tcontent rootdir,images\n"
+        + ("\tshared 1\n" if shared else ""))
+    (root / "qemu-server" / f"{template_id}.conf").write_text(
+        f"name: kali-template\nmemory: 8192\ncores: 4\ntemplate: 1\n"
+        f"scsi0: {storage}:base-{template_id}-disk-0,size=80G\n")
+    return root
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in TOOLS:
+        sys.stderr.write(f"用法：{sys.argv[0]} {{{'|'.join(TOOLS)}}} [參數...]\n")
+        sys.exit(1)
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 本機模擬 PyPI JSON API（/pypi/<name>/json），供 setup_dependencies.py 的版本比對離線測試使用
+# 預設回報本機已安裝的版本（全部視為最新），--bump 可指定較新的版本以模擬需要升級的套件
+
+import json
+import time
+import argparse
+import threading
+from importlib import metadata
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakeIndexState:
+    def __init__(self, versions=None, latency=0.0):
+        self.versions = dict(versions or {})
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def latest(self, name):
+        if name in self.versions:
+            return self.versions[name]
+        try:
+            return metadata.version(name)
+        except metadata.PackageNotFoundError:
+            return None
+
+class FakeIndexHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "pypi" or parts[2] != "json":
+            return self._send(404, {"message": "Not Found"})
+        time.sleep(state.latency)
+        version = state.latest(parts[1])
+        if version is None:
+            return self._send(404, {"message": "Not Found"})
+        self._send(200, {"info": {"name": parts[1], "version": version}, "releases": {version: []}})
+
+    def log_message(self, *args):
+        pass
+
+# 於背景執行緒啟動模擬索引，回傳 (server, state)
+def start_fake_index(port=0, versions=None, latency=0.0):
+    state = FakeIndexState(versions, latency)
+    handler = type("Handler", (FakeIndexHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="啟動模擬 PyPI JSON API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="每次回覆前的延遲秒數")
+    parser.add_argument("--bump", nargs="*", default=[], metavar="NAME=VERSION", help="回報指定套件的最新版本")
+    args = parser.parse_args()
+    try:
+        versions = dict(item.split("=", 1) for item in args.bump)
+    except ValueError:
+        raise ValueError("[ERROR] --bump 格式應為 NAME=VERSION")
+    server, _ = start_fake_index(args.port, versions, args.latency)
+    print(f"[OK] 模擬套件索引：http://127.0.0.1:{server.server_address[1]}/pypi（PIP_VERSION_INDEX）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 本機模擬 QEMU guest-agent socket，供測試與效能量測使用（不需真實 Proxmox 節點）
+
+import os
+import json
+import base64
+import asyncio
+import argparse
+import threading
+from pathlib import Path
+
+# 單一 VM 的模擬 guest agent，啟動 ready_after 秒後才回應
+class FakeQgaServer:
+    def __init__(self, socket_path, ip="10.0.0.10", iface="eth0", ready_after=0.0):
+        self.socket_path = Path(socket_path)
+        self.ip = ip
+        self.iface = iface
+        self.ready_after = ready_after
+        self._server = None
+        self._ready_at = None
+        self.executed = []      # guest-exec 執行過的指令
+
+    def _interfaces(self):
+        return [
+            {"name": "lo", "ip-addresses": [{"ip-address-type": "ipv4", "ip-address": "127.0.0.1"}]},
+            {"name": self.iface, "ip-addresses": [{"ip-address-type": "ipv4", "ip-address": self.ip}]},
+        ]
+
+    # guest-exec 的模擬輸出：/etc/os-release 回報 FAKE_GUEST_VERSION，其餘指令視為成功
+    def _exec_output(self, argv):
+        text = f"fake: {' '.join(argv)}\n"
+        if any("/etc/os-release" in arg for arg in argv):
+            text = f'ID=kali\nVERSION="{os.environ.get("FAKE_GUEST_VERSION", "")}"\n'
+        return base64.b64encode(text.encode()).decode()
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._ready_at:
+            writer.close()  # guest agent 尚未啟動
+            return
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = json.loads(line.lstrip(b"\xff"))
+                command = request.get("execute")
+                if command == "guest-sync-delimited":
+                    writer.write(b"\xff" + json.dumps({"return": request["arguments"]["id"]}).encode() + b"\n")
+                elif command == "guest-ping":
+                    writer.write(b'{"return": {}}\n')
+                elif command == "guest-network-get-interfaces":
+                    writer.write(json.dumps({"return": self._interfaces()}).encode() + b"\n")
+                elif command == "guest-exec":
+                    self.executed.append([request["arguments"]["path"], *request["arguments"].get("arg", [])])
+                    writer.write(json.dumps({"return": {"pid": len(self.executed)}}).encode() + b"\n")
+                elif command == "guest-exec-status":
+                    argv = self.executed[request["arguments"]["pid"] - 1]
+                    writer.write(json.dumps({"return": {"exited": True, "exitcode": 0,
+                                                        "out-data": self._exec_output(argv)}}).encode() + b"\n")
+                else:
+                    error = {"class": "CommandNotFound", "desc": f"未支援的指令 {command}"}
+                    writer.write(json.dumps({"error": error}).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self.socket_path.unlink(missing_ok=True)
+        self._ready_at = asyncio.get_running_loop().time() + self.ready_after
+        self._server = await asyncio.start_unix_server(self._handle, path=str(self.socket_path))
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self.socket_path.unlink(missing_ok=True)
+
+# 於背景執行緒執行多個模擬 guest agent，方便同步程式碼使用
+class FakeQgaFleet:
+    def __init__(self, socket_dir):
+        self.socket_dir = Path(socket_dir)
+        self._servers = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def add(self, vm_id, ip, ready_after=0.0):
+        server = FakeQgaServer(self.socket_dir / f"{vm_id}.qga", ip=ip, ready_after=ready_after)
+        asyncio.run_coroutine_threadsafe(server.start(), self._loop).result()
+        self._servers[vm_id] = server
+        return server
+
+    def remove(self, vm_id):
+        server = self._servers.pop(vm_id, None)
+        if server:
+            asyncio.run_coroutine_threadsafe(server.stop(), self._loop).result()
+
+    def close(self):
+        for vm_id in list(self._servers):
+            self.remove(vm_id)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="啟動模擬 QEMU guest-agent socket")
+    parser.add_argument("--dir", default="/tmp/fake-qga", help="socket 目錄（對應 QGA_SOCKET_DIR）")
+    parser.add_argument("--vmid", type=int, nargs="+", required=True)
+    parser.add_argument("--delay", type=float, default=0.0, help="啟動後幾秒才回應")
+    args = parser.parse_args()
+
+    async def main():
+        servers = [FakeQgaServer(Path(args.dir) / f"{vm_id}.qga", ip=f"10.0.{vm_id // 256}.{vm_id % 256}",
+                                 ready_after=args.delay) for vm_id in args.vmid]
+        for server in servers:
+            await server.start()
+            print(f"[OK] 模擬 guest agent：{server.socket_path} → {server.ip}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
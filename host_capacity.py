@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 主機容量感知的啟動控制：讀取 /proc/meminfo、/proc/pressure 與 KSM 狀態，僅在資源足夠時放行 VM 啟動並錯開開機時間
+# 測試時可以 HOST_PROC_ROOT / HOST_SYS_ROOT 指向假的 /proc、/sys 目錄
+
+import os
+import time
+import threading
+from pathlib import Path
+
+PROC_ROOT = Path(os.environ.get("HOST_PROC_ROOT", "/proc"))
+SYS_ROOT = Path(os.environ.get("HOST_SYS_ROOT", "/sys"))
+MIB = 1024 ** 2
+
+# 解析 /proc/meminfo，回傳 {欄位: bytes}
+def read_meminfo(proc_root=None):
+    info = {}
+    for line in (Path(proc_root or PROC_ROOT) / "meminfo").read_text().splitlines():
+        key, _, rest = line.partition(":")
+        parts = rest.split()
+        if parts and parts[0].isdigit():
+            info[key.strip()] = int(parts[0]) * (1024 if parts[1:] == ["kB"] else 1)
+    return info
+
+# 解析 /proc/pressure/<resource> 的 avg10（百分比）；核心不支援 PSI 時回傳 None
+def read_pressure(resource, kind="some", proc_root=None):
+    try:
+        text = (Path(proc_root or PROC_ROOT) / "pressure" / resource).read_text()
+    except OSError:
+        return None
+    for line in text.splitlines():
+        fields = line.split()
+        if fields and fields[0] == kind:
+            for field in fields[1:]:
+                if field.startswith("avg10="):
+                    return float(field.split("=", 1)[1])
+    return None
+
+# KSM 共用中的記憶體（bytes），未啟用時為 0
+def read_ksm_shared(sys_root=None):
+    ksm = Path(sys_root or SYS_ROOT) / "kernel" / "mm" / "ksm"
+    try:
+        if (ksm / "run").read_text().strip() != "1":
+            return 0
+        return int((ksm / "pages_sharing").read_text().strip()) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+class HostSnapshot:
+    def __init__(self, proc_root=None, sys_root=None):
+        meminfo = read_meminfo(proc_root)
+        self.mem_total = meminfo.get("MemTotal", 0)
+        self.mem_available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+        self.cpu_pressure = read_pressure("cpu", proc_root=proc_root)
+        self.io_pressure = read_pressure("io", proc_root=proc_root)
+        self.mem_pressure = read_pressure("memory", "full", proc_root=proc_root)
+        self.ksm_shared = read_ksm_shared(sys_root)
+
+    def describe(self):
+        psi = lambda v: "-" if v is None else f"{v:.1f}%"
+        return (f"可用記憶體 {self.mem_available / MIB / 1024:.1f}G / {self.mem_total / MIB / 1024:.1f}G，"
+                f"KSM 共用 {self.ksm_shared / MIB / 1024:.1f}G，PSI cpu {psi(self.cpu_pressure)} "
+                f"io {psi(self.io_pressure)} memory {psi(self.mem_pressure)}")
+
+# 依主機餘裕依序放行 VM 啟動：記憶體需扣除保留量與尚未反映在 MemAvailable 的已放行 VM，
+# CPU / IO 壓力過高時等待，相鄰兩次放行至少間隔 stagger 秒
+class AdmissionController:
+    def __init__(self, mem_reserve=2048 * MIB, max_cpu_pressure=80.0, max_io_pressure=50.0,
+                 stagger=0.5, settle=60.0, poll=1.0, timeout=900.0, proc_root=None, sys_root=None):
+        self.mem_reserve = mem_reserve
+        self.max_cpu_pressure = max_cpu_pressure
+        self.max_io_pressure = max_io_pressure
+        self.stagger = stagger
+        self.settle = settle            # 放行後記憶體需求保留的秒數（開機期間記憶體尚未被實際使用）
+        self.poll = poll
+        self.timeout = timeout
+        self.proc_root = proc_root
+        self.sys_root = sys_root
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._pending = []              # [(放行時間, bytes)]
+        self._last_start = float("-inf")
+        self.waited = {}                # {vm_id: 等待秒數}
+
+    def snapshot(self):
+        return HostSnapshot(self.proc_root, self.sys_root)
+
+    def _pending_bytes(self, now):
+        self._pending = [(t, size) for t, size in self._pending if now - t < self.settle]
+        return sum(size for _, size in self._pending)
+
+    # 回傳不能放行的原因，可放行時回傳 None
+    def _blocked(self, snap, demand, now):
+        headroom = snap.mem_available - self._pending_bytes(now) - self.mem_reserve
+        if headroom < demand:
+            return f"記憶體餘裕 {headroom / MIB:.0f}MB 不足 {demand / MIB:.0f}MB"
+        if snap.cpu_pressure is not None and snap.cpu_pressure > self.max_cpu_pressure:
+            return f"CPU 壓力 {snap.cpu_pressure:.1f}% 過高"
+        if snap.io_pressure is not None and snap.io_pressure > self.max_io_pressure:
+            return f"IO 壓力 {snap.io_pressure:.1f}% 過高"
+        wait = self._last_start + self.stagger - now
+        if wait > 0:
+            return f"錯開開機，{wait:.1f} 秒後放行"
+        return None
+
+    # 依呼叫順序排隊，等到主機有餘裕才返回；demand 為 VM 最大記憶體（bytes）
+    def admit(self, vm_id, demand):
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while self._serving != ticket:
+                self._cond.wait()
+            try:
+                total = self.snapshot().mem_total
+                if total and demand > total - self.mem_reserve:
+                    raise RuntimeError(f"[ERROR] VM {vm_id} 需要 {demand / MIB:.0f}MB，超過主機可用上限")
+                reported = None
+                while True:
+                    now = time.monotonic()
+                    snap = self.snapshot()
+                    reason = self._blocked(snap, demand, now)
+                    if reason is None:
+                        break
+                    if now - started > self.timeout:
+                        raise RuntimeError(f"[ERROR] VM {vm_id} 等待主機資源逾時：{reason}")
+                    category = reason.split(" ", 1)[0]
+                    if category != reported and not reason.startswith("錯開"):
+                        print(f"[INFO] VM {vm_id} 暫緩啟動：{reason}（{snap.describe()}）")
+                        reported = category
+                    delay = self.poll
+                    if reason.startswith("錯開"):
+                        delay = min(delay, self._last_start + self.stagger - now)
+                    self._cond.wait(max(0.01, delay))
+                self._pending.append((now, demand))
+                self._last_start = now
+            finally:
+                self._serving += 1
+                self._cond.notify_all()
+        self.waited[vm_id] = time.monotonic() - started
+        return self.waited[vm_id]
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Kali 映像下載器：多連線 HTTP Range 分段下載、斷點續傳（segment journal）與邊下載邊計算 SHA256
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import requests
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 1024 * 1024           # 每次讀寫 1 MiB
+JOURNAL_FLUSH_BYTES = 32 * CHUNK_SIZE  # 每下載 32 MiB 寫入一次 journal
+SEGMENT_RETRIES = 5
+REQUEST_TIMEOUT = 30
+
+# 下載統計，可於下載過程中讀取進度與速率
+class DownloadStats:
+    def __init__(self, total=0):
+        self.total = total
+        self.downloaded = 0
+        self.resumed = 0
+        self.hashed = 0
+        self.retries = 0
+        self.sha256 = None
+        self.started = time.monotonic()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:
+            self.downloaded += n
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    # 本次實際傳輸的平均速率（bytes/s，不含續傳前已完成的部分）
+    @property
+    def throughput(self):
+        return (self.downloaded - self.resumed) / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def percent(self):
+        return self.downloaded * 100.0 / self.total if self.total else 0.0
+
+    def as_dict(self):
+        return {"total": self.total, "downloaded": self.downloaded, "resumed": self.resumed,
+                "retries": self.retries, "elapsed": round(self.elapsed, 3),
+                "throughput": round(self.throughput, 1)}
+
+def _print_progress(stats):
+    sys.stdout.write(f"\r[INFO] 下載進度：{stats.percent:5.1f}% "
+                     f"({stats.downloaded / 1048576:.0f}/{stats.total / 1048576:.0f} MiB, "
+                     f"{stats.throughput / 1048576:.1f} MiB/s)")
+    sys.stdout.flush()
+
+# 建立具連線池的 Session，讓各分段共用 keep-alive 連線
+def make_session(pool_size=8):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# 從同目錄的 SHA256SUMS 取得檔案預期雜湊值，找不到時回傳 None
+def fetch_expected_sha256(url, session=None):
+    sums_url = url.rsplit("/", 1)[0] + "/SHA256SUMS"
+    filename = url.rsplit("/", 1)[1]
+    try:
+        response = (session or requests).get(sums_url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"[WARN] 無法取得 SHA256SUMS：{e}")
+        return None
+    for line in response.text.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].lstrip("*") == filename:
+            return parts[0].lower()
+    return None
+
+def _load_journal(journal_path, url, size):
+    try:
+        journal = json.loads(journal_path.read_text())
+    except (OSError, ValueError):
+        return None
+    if journal.get("url") != url or journal.get("size") != size:
+        return None
+    return journal
+
+def _new_journal(url, size, segments):
+    step = -(-size // segments)
+    ranges = [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+    return {"url": url, "size": size, "segments": ranges}
+
+# 分段下載器：各分段以 pwrite 寫入同一個 .part 檔，hasher 依序讀取已連續完成的區段計算 SHA256
+class SegmentedDownload:
+    def __init__(self, url, dest, segments, session, stats):
+        self.url = url
+        self.dest = Path(dest)
+        self.part = self.dest.with_name(self.dest.name + ".part")
+        self.journal_path = self.dest.with_name(self.dest.name + ".part.json")
+        self.session = session
+        self.stats = stats
+        self.segments = segments
+        self.journal = None
+        self.error = None
+        self._cond = threading.Condition()
+        self._unflushed = 0
+        self._stop = threading.Event()   # 任一分段失敗後通知其他分段停止
+
+    def _save_journal(self):
+        tmp = self.journal_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.journal))
+        tmp.replace(self.journal_path)
+
+    def _contiguous_end(self):
+        for start, end, done in self.journal["segments"]:
+            if start + done <= end:
+                return start + done
+        return self.journal["size"]
+
+    def _fetch_segment(self, fd, segment):
+        for attempt in range(SEGMENT_RETRIES):
+            start, end, done = segment
+            if start + done > end or self._stop.is_set():
+                return
+            headers = {"Range": f"bytes={start + done}-{end}"}
+            try:
+                with self.session.get(self.url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as r:
+                    if r.status_code != 206:
+                        raise RuntimeError(f"伺服器未回應分段內容（HTTP {r.status_code}）")
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        if self._stop.is_set():
+                            return
+                        os.pwrite(fd, chunk, start + segment[2])
+                        with self._cond:
+                            segment[2] += len(chunk)
+                            self._unflushed += len(chunk)
+                            if self._unflushed >= JOURNAL_FLUSH_BYTES:
+                                self._save_journal()
+                                self._unflushed = 0
+                            self._cond.notify_all()
+                        self.stats.add(len(chunk))
+                return
+            except (requests.RequestException, RuntimeError) as e:
+                with self._cond:
+                    self.stats.retries += 1
+                if attempt == SEGMENT_RETRIES - 1:
+                    raise RuntimeError(f"分段 {start}-{end} 下載失敗：{e}")
+                if self._stop.wait(2 ** attempt):
+                    return
+
+    def _worker(self, fd, segment):
+        try:
+            self._fetch_segment(fd, segment)
+        except Exception as e:
+            self.error = e
+            self._stop.set()
+        finally:
+            with self._cond:
+                self._cond.notify_all()
+
+    # 依序讀取已完成的連續區段更新 SHA256（資料剛寫入仍在 page cache，不需第二次讀檔）
+    def _hash_until_done(self, fd, workers, progress):
+        sha = hashlib.sha256()
+        size = self.journal["size"]
+        last_report = 0.0
+        while self.stats.hashed < size:
+            with self._cond:
+                while (self._contiguous_end() <= self.stats.hashed and self.error is None
+                       and any(w.is_alive() for w in workers)):
+                    self._cond.wait(1.0)
+                    if progress and time.monotonic() - last_report >= 1.0:
+                        _print_progress(self.stats)
+                        last_report = time.monotonic()
+                limit = self._contiguous_end()
+            if self.error is not None:
+                raise self.error
+            if limit <= self.stats.hashed:
+                raise RuntimeError("下載中斷，資料不完整")
+            while self.stats.hashed < limit:
+                data = os.pread(fd, min(CHUNK_SIZE, limit - self.stats.hashed), self.stats.hashed)
+                sha.update(data)
+                self.stats.hashed += len(data)
+            if progress and time.monotonic() - last_report >= 1.0:
+                _print_progress(self.stats)
+                last_report = time.monotonic()
+        return sha.hexdigest()
+
+    def run(self, size, progress=True):
+        self.journal = _load_journal(self.journal_path, self.url, size) if self.part.exists() else None
+        if self.journal:
+            self.stats.resumed = sum(s[2] for s in self.journal["segments"])
+            self.stats.downloaded = self.stats.resumed
+            print(f"[INFO] 由 journal 續傳，已完成 {self.stats.resumed / 1048576:.0f} MiB")
+        else:
+            self.journal = _new_journal(self.url, size, self.segments)
+            with self.part.open("wb") as f:
+                f.truncate(size)
+            self._save_journal()
+
+        fd = os.open(self.part, os.O_RDWR)
+        try:
+            workers = [threading.Thread(target=self._worker, args=(fd, seg), daemon=True)
+                       for seg in self.journal["segments"]]
+            for w in workers:
+                w.start()
+            try:
+                digest = self._hash_until_done(fd, workers, progress)
+            finally:
+                # 已完成或失敗時讓其餘分段在下一個區塊前結束，不必等整段下載完才回報錯誤
+                self._stop.set()
+                for w in workers:
+                    w.join()
+                with self._cond:
+                    self._save_journal()
+        finally:
+            os.close(fd)
+        return digest
+
+# 單一連線下載（伺服器不支援 Range 時使用），同樣邊下載邊計算雜湊
+def _download_single(url, dest, session, stats, progress):
+    part = dest.with_name(dest.name + ".part")
+    sha = hashlib.sha256()
+    last_report = 0.0
+    with session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as r:
+        r.raise_for_status()
+        with part.open("wb") as f:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                sha.update(chunk)
+                stats.add(len(chunk))
+                if progress and time.monotonic() - last_report >= 1.0:
+                    _print_progress(stats)
+                    last_report = time.monotonic()
+    return sha.hexdigest()
+
+def sha256_file(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# 下載映像並驗證 SHA256；expected_sha256 為 None 時僅記錄雜湊值
+def download_image(url, dest, segments=4, expected_sha256=None, session=None, progress=True):
+    dest = Path(dest)
+    session = session or make_session(segments)
+    sidecar = dest.with_name(f".{dest.name}.sha256")
+
+    if dest.exists():
+        digest = sidecar.read_text().strip() if sidecar.exists() else sha256_file(dest)
+        if expected_sha256 is None or digest == expected_sha256:
+            print(f"[SKIP] 已存在完整映像：{dest}")
+            stats = DownloadStats(dest.stat().st_size)
+            stats.downloaded = stats.resumed = stats.total
+            stats.sha256 = digest
+            stats.finished = time.monotonic()
+            return stats
+        print("[WARN] 現有映像 SHA256 不符，重新下載")
+        dest.unlink()
+
+    head = session.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    head.raise_for_status()
+    size = int(head.headers.get("Content-Length", 0))
+    ranged = head.headers.get("Accept-Ranges", "").lower() == "bytes" and size > 0
+    stats = DownloadStats(size)
+
+    if ranged and segments > 1:
+        digest = SegmentedDownload(head.url, dest, segments, session, stats).run(size, progress)
+    else:
+        digest = _download_single(head.url, dest, session, stats, progress)
+    stats.finished = time.monotonic()
+    stats.sha256 = digest
+    if progress:
+        _print_progress(stats)
+        print()
+
+    part = dest.with_name(dest.name + ".part")
+    journal = dest.with_name(dest.name + ".part.json")
+    if expected_sha256 and digest != expected_sha256:
+        part.unlink(missing_ok=True)
+        journal.unlink(missing_ok=True)
+        raise RuntimeError(f"[ERROR] SHA256 驗證失敗：預期 {expected_sha256}，實際 {digest}")
+
+    part.replace(dest)
+    journal.unlink(missing_ok=True)
+    sidecar.write_text(digest + "\n")
+    print(f"[OK] 下載完成，SHA256 {'驗證通過' if expected_sha256 else '為'}：{digest}")
+    return stats
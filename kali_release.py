@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Kali 版本資訊查詢：磁碟快取 + ETag / If-Modified-Since 條件式請求，並以版本號排序
+
+import re
+import json
+import time
+from pathlib import Path
+
+KALI_BASE_URL = "https://cdimage.kali.org/"
+RELEASE_CACHE_NAME = ".kali_release.json"  # 與 .kali_version 放在同一工作目錄
+DEFAULT_TTL = 3600       # 快取有效秒數，期間內完全不連線
+REQUEST_TIMEOUT = 10     # 連線 / 讀取逾時秒數
+
+# 版本排序鍵："2024.10" > "2024.9"，"2024.2a" > "2024.2"
+def version_key(version: str):
+    match = re.match(r"(\d+)\.(\d+)([a-z]?)$", version)
+    if not match:
+        return (0, 0, version)
+    return (int(match.group(1)), int(match.group(2)), match.group(3))
+
+# 從目錄索引頁面解析所有 kali-YYYY.N 目錄，新版本在前
+def parse_release_dirs(html: str):
+    dirs = {d.strip("/") for d in re.findall(r'kali-\d+\.\d+[a-z]?/', html)}
+    return sorted(dirs, key=lambda d: version_key(d.replace("kali-", "")), reverse=True)
+
+# 依目錄名稱組出 (kali_dir, version, filename, url)，與 get_latest_kali_url 回傳格式相同
+def build_release(base_url: str, kali_dir: str):
+    version = kali_dir.replace("kali-", "")
+    filename = f"kali-linux-{version}-qemu-amd64.7z"
+    return kali_dir, version, filename, f"{base_url}{kali_dir}/{filename}"
+
+def _load_cache(cache_file: Path, base_url: str):
+    try:
+        cache = json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        return None
+    if cache.get("base_url") != base_url or not cache.get("kali_dir"):
+        return None
+    return cache
+
+def _save_cache(cache_file: Path, cache: dict):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_file.with_suffix(".tmp")
+    tmp.write_text(json.dumps(cache, indent=2))
+    tmp.replace(cache_file)
+
+# 取得最新 Kali 版本；快取未過期或 offline 時直接使用快取，否則以條件式請求重新驗證
+def get_latest_release(base_url: str = KALI_BASE_URL, cache_dir=None, ttl: int = DEFAULT_TTL,
+                       offline: bool = False, session=None):
+    cache_file = Path(cache_dir) / RELEASE_CACHE_NAME if cache_dir else None
+    cache = _load_cache(cache_file, base_url) if cache_file else None
+
+    if offline:
+        if not cache:
+            raise RuntimeError("[ERROR] --offline 模式下找不到 Kali 版本快取，請先連線執行一次")
+        return build_release(base_url, cache["kali_dir"])
+    if cache and time.time() - cache.get("fetched_at", 0) < ttl:
+        return build_release(base_url, cache["kali_dir"])
+
+    headers = {}
+    if cache and cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache and cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    import requests  # 快取有效時不需連線，延遲載入以縮短啟動時間
+    try:
+        response = (session or requests).get(base_url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 304:
+            response.raise_for_status()
+    except requests.RequestException as e:
+        if cache:
+            print(f"[WARN] 無法連線 Kali 鏡像站（{e}），改用快取版本 {cache['kali_dir']}")
+            return build_release(base_url, cache["kali_dir"])
+        raise
+
+    if response.status_code == 304:
+        cache["fetched_at"] = time.time()
+    else:
+        dirs = parse_release_dirs(response.text)
+        if not dirs:
+            raise RuntimeError("無法取得 Kali 最新版本目錄")
+        cache = {
+            "base_url": base_url,
+            "kali_dir": dirs[0],
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        }
+    if cache_file:
+        _save_cache(cache_file, cache)
+    return build_release(base_url, cache["kali_dir"])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# VM 清單報表：以單次 /cluster/resources 查詢取得狀態，CPU / 記憶體 / 磁碟由 VM 清單快取讀取，
+# 執行中的 VM 以有限並行、短逾時向 guest agent 查詢一次 IP，輸出表格、JSON 或 CSV
+
+import sys
+import csv
+import json
+import time
+import argparse
+from pve_backend import configure_backend, get_backend
+from pve_storage import convert_to_gb
+from vm_inventory import load_inventory, parse_tags
+from qga_readiness import query_ips
+
+FIELDS = ("vm_id", "name", "node", "status", "ip", "cores", "memory", "disk", "tags")
+DEFAULT_TAG = "kali"          # auto_build_kali_vm.py 建立的 VM 皆帶有此標籤
+DEFAULT_IP_TIMEOUT = 3.0
+DEFAULT_PARALLEL = 32
+
+# guest agent 於設定中明確停用時不查詢（agent: 0 或 enabled=0）
+def _agent_enabled(record):
+    agent = record.config.get("agent", "") if record else ""
+    return not (agent.startswith("0") or "enabled=0" in agent)
+
+# 由 /cluster/resources 選取 QEMU VM 並補上設定檔中的規格（清單中沒有時退回 resources 的 max* 欄位）
+def collect_vms(vms, tag=DEFAULT_TAG, prefix=None, run_id=None, include_templates=False):
+    inventory = load_inventory()
+    rows = []
+    for vm in vms:
+        if vm.get("type", "qemu") != "qemu":
+            continue
+        vm_id = int(vm["vmid"])
+        record = inventory.get(vm_id)
+        if int(vm.get("template") or 0) and not include_templates:
+            continue
+        if prefix and not str(vm.get("name", "")).startswith(prefix):
+            continue
+        if run_id and f"run-{run_id}" not in parse_tags(vm.get("tags")):
+            continue
+        if tag and tag not in parse_tags(vm.get("tags")) and (record is None or tag not in record.description):
+            continue
+        rows.append({
+            "vm_id": vm_id,
+            "name": vm.get("name") or (record.name if record else ""),
+            "node": vm.get("node") or (record.node if record else None),
+            "status": vm.get("status", "unknown"),
+            "ip": None,
+            "cores": record.cores if record else vm.get("maxcpu"),
+            "memory": convert_to_gb(f"{record.memory}M" if record and record.memory else vm.get("maxmem") or 0),
+            "disk": convert_to_gb(record.disk_bytes if record and record.disks else vm.get("maxdisk") or 0),
+            "tags": ";".join(sorted(parse_tags(vm.get("tags")))),
+            "_agent": _agent_enabled(record),
+        })
+    return sorted(rows, key=lambda r: r["vm_id"])
+
+# 並行查詢執行中 VM 的 IP（每台只查一次，逾時或 agent 未回應即為 None）
+def fill_ips(rows, timeout=DEFAULT_IP_TIMEOUT, parallel=DEFAULT_PARALLEL):
+    targets = [(r["vm_id"], r["node"]) for r in rows if r["status"] == "running" and r["_agent"]]
+    ips = query_ips(targets, timeout, parallel) if targets else {}
+    for r in rows:
+        r["ip"] = ips.get(r["vm_id"])
+    return rows
+
+def print_table(rows, out=sys.stdout):
+    print(f"{'VMID':>6}  {'名稱':<24}{'節點':<10}{'狀態':<9}{'IP':<16}{'CPU':>4}{'RAM':>8}{'磁碟':>8}  標籤", file=out)
+    for r in rows:
+        print(f"{r['vm_id']:>6}  {r['name']:<24}{(r['node'] or '-'):<10}{r['status']:<9}{(r['ip'] or '-'):<16}"
+              f"{(r['cores'] or '-'):>4}{r['memory']:>8}{r['disk']:>8}  {r['tags'] or '-'}", file=out)
+
+def write_report(rows, fmt, out=sys.stdout):
+    rows = [{k: r[k] for k in FIELDS} for r in rows]
+    if fmt == "json":
+        json.dump(rows, out, ensure_ascii=False, indent=2)
+        out.write("\n")
+    elif fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        print_table(rows, out)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="列出 Kali VM 的名稱、IP、CPU、記憶體、磁碟與狀態")
+    parser.add_argument("--tag", default=DEFAULT_TAG, help="Proxmox 標籤或描述中包含的文字（空字串表示不限）")
+    parser.add_argument("--prefix", help="VM 名稱前綴")
+    parser.add_argument("--run-id", help="auto_build_kali_vm.py 執行 ID（對應標籤 run-<ID>）")
+    parser.add_argument("--include-templates", action="store_true", help="一併列出模板")
+    parser.add_argument("--format", choices=["table", "json", "csv"], default="table", help="輸出格式")
+    parser.add_argument("--output", help="寫入檔案（預設輸出到終端機）")
+    parser.add_argument("--ip-timeout", type=float, default=DEFAULT_IP_TIMEOUT, help="每台 VM 查詢 guest agent 的秒數上限")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL, help="同時查詢 guest agent 的 VM 數量")
+    parser.add_argument("--no-ip", action="store_true", help="不查詢 IP（只讀取設定與狀態）")
+    parser.add_argument("--backend", choices=["cli", "api"], help="Proxmox 操作後端（預設讀取 PVE_BACKEND）")
+    args = parser.parse_args()
+
+    if args.parallel < 1 or args.ip_timeout <= 0:
+        raise ValueError("[ERROR] --parallel 必須大於等於 1，--ip-timeout 必須大於 0")
+    # 表格以外的格式輸出到終端機時，訊息改寫到 stderr 以免混入資料
+    info = sys.stdout if args.format == "table" or args.output else sys.stderr
+    configure_backend(args.backend)
+    started = time.monotonic()
+    rows = collect_vms(get_backend().cluster_vms(), args.tag or None, args.prefix, args.run_id, args.include_templates)
+    if not args.no_ip:
+        fill_ips(rows, args.ip_timeout, args.parallel)
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            write_report(rows, args.format, f)
+        print(f"[OK] 報表已寫入：{args.output}", file=info)
+    else:
+        write_report(rows, args.format)
+    running = sum(1 for r in rows if r["status"] == "running")
+    with_ip = sum(1 for r in rows if r["ip"])
+    print(f"[INFO] 共 {len(rows)} 台 VM（執行中 {running}，取得 IP {with_ip}），耗時 {time.monotonic() - started:.1f} 秒",
+          file=info)
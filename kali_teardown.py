@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 批次移除 VM：依名稱前綴、標籤 / 描述或執行 ID 選取，並行 ACPI 關機（逾時則強制停止），
+# 再以有限並行刪除；linked clone 一律先於其模板刪除，並輸出每台 VM 各階段耗時
+
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from pve_backend import configure_backend, get_backend
+from vm_inventory import load_inventory, parse_tags
+from template_registry import template_in_use
+from run_metrics import start_run, stage as measure
+
+DEFAULT_SHUTDOWN_TIMEOUT = 60
+DEFAULT_STOP_PARALLEL = 16
+DEFAULT_PARALLEL = 4      # 同一儲存空間同時刪除過多磁碟卷會互相等待儲存鎖
+
+# 判斷 VM 是否符合條件（tag 同時比對 Proxmox 標籤與描述文字，描述僅在需要時才讀取）
+def _matches(vm, prefix=None, tag=None, run_id=None, ids=None, inventory=None):
+    if ids and vm["vmid"] not in ids:
+        return False
+    if prefix and not str(vm.get("name", "")).startswith(prefix):
+        return False
+    if run_id and f"run-{run_id}" not in parse_tags(vm.get("tags")):
+        return False
+    if tag and tag not in parse_tags(vm.get("tags")):
+        record = (inventory or load_inventory(refresh=False)).get(vm["vmid"])
+        if record is None or tag not in record.description:
+            return False
+    return True
+
+# 由 /cluster/resources 選取符合條件的 QEMU VM；未指定任何條件時拒絕執行以免誤刪整個叢集
+def select_vms(vms, prefix=None, tag=None, run_id=None, ids=None, include_templates=False):
+    if not any((prefix, tag, run_id, ids)):
+        raise ValueError("[ERROR] 請至少指定 --prefix、--tag、--run-id 或 --ids 其中一項")
+    inventory = load_inventory()       # 整批只掃描一次設定檔
+    selected = []
+    for vm in vms:
+        if vm.get("type", "qemu") != "qemu":
+            continue
+        vm = dict(vm, vmid=int(vm["vmid"]))
+        if not _matches(vm, prefix, tag, run_id, ids, inventory):
+            continue
+        if int(vm.get("template") or 0) and not include_templates:
+            print(f"[SKIP] VM {vm['vmid']} 為模板，需加上 --include-templates 才會刪除")
+            continue
+        selected.append(vm)
+    return sorted(selected, key=lambda vm: vm["vmid"])
+
+# 關機：先 ACPI shutdown，timeout 秒內未完成則強制 stop，回傳採用的方式
+def stop_vm(vm, timeout=DEFAULT_SHUTDOWN_TIMEOUT, force=False):
+    backend = get_backend()
+    vm_id = vm["vmid"]
+    if vm.get("status") != "running":
+        return "stopped"
+    if not force:
+        try:
+            with measure("shutdown", vm_id):
+                backend.shutdown(vm_id, timeout)
+            return "shutdown"
+        except Exception as e:
+            print(f"[WARN] VM {vm_id} 未於 {timeout} 秒內關機，改為強制停止：{e}")
+    with measure("stop", vm_id):
+        backend.stop(vm_id)
+    return "stop"
+
+def destroy_vm(vm_id):
+    with measure("destroy", vm_id):
+        get_backend().destroy(vm_id)
+
+def _timed(fn, *args):
+    started = time.monotonic()
+    try:
+        return fn(*args), time.monotonic() - started, None
+    except Exception as e:
+        return None, time.monotonic() - started, str(e)
+
+# 並行關機後分批刪除：一般 VM 先刪，模板最後刪（仍有未選取的 linked clone 引用時略過）
+def teardown(vms, shutdown_timeout=DEFAULT_SHUTDOWN_TIMEOUT, stop_parallel=DEFAULT_STOP_PARALLEL,
+             parallel=DEFAULT_PARALLEL, force=False):
+    backend = get_backend()
+    results = {vm["vmid"]: {"vm_id": vm["vmid"], "name": vm.get("name", ""), "node": vm.get("node"),
+                            "stop": None, "stop_s": 0.0, "destroy_s": 0.0, "error": None} for vm in vms}
+    for vm in vms:
+        if vm.get("node"):
+            backend.assign_node(vm["vmid"], vm["node"])
+
+    with ThreadPoolExecutor(max_workers=max(1, min(stop_parallel, len(vms)))) as pool:
+        for vm, (method, seconds, error) in zip(vms, pool.map(lambda vm: _timed(stop_vm, vm, shutdown_timeout, force), vms)):
+            results[vm["vmid"]].update(stop=method, stop_s=round(seconds, 2), error=error)
+
+    def destroy(vm):
+        _, seconds, error = _timed(destroy_vm, vm["vmid"])
+        results[vm["vmid"]].update(destroy_s=round(seconds, 2), error=error, destroyed=error is None)
+
+    stopped = [vm for vm in vms if results[vm["vmid"]]["error"] is None]
+    clones = [vm for vm in stopped if not int(vm.get("template") or 0)]
+    templates = [vm for vm in stopped if int(vm.get("template") or 0)]
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        list(pool.map(destroy, clones))
+        ready = []
+        for vm in templates:
+            if template_in_use(vm["vmid"]):
+                results[vm["vmid"]]["error"] = "仍有 linked clone 引用此模板"
+            else:
+                ready.append(vm)
+        list(pool.map(destroy, ready))
+    return [results[vm["vmid"]] for vm in vms]
+
+def print_results(results, wall):
+    print(f"\n{'VMID':>6}  {'名稱':<24}{'節點':<10}{'關機方式':<10}{'關機(s)':>8}{'刪除(s)':>8}  結果")
+    for r in results:
+        status = "✅" if r.get("destroyed") else f"❌ {r['error']}"
+        print(f"{r['vm_id']:>6}  {r['name']:<24}{(r['node'] or '-'):<10}{(r['stop'] or '-'):<10}"
+              f"{r['stop_s']:>8.2f}{r['destroy_s']:>8.2f}  {status}")
+    done = sum(1 for r in results if r.get("destroyed"))
+    print(f"\n[INFO] 共刪除 {done} / {len(results)} 台 VM，耗時 {wall:.1f} 秒")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="依名稱前綴、標籤或執行 ID 批次移除 VM")
+    parser.add_argument("--prefix", help="VM 名稱前綴，例如 kali-vm")
+    parser.add_argument("--tag", help="Proxmox 標籤或描述中包含的文字")
+    parser.add_argument("--run-id", help="auto_build_kali_vm.py 執行 ID（對應標籤 run-<ID>）")
+    parser.add_argument("--ids", type=int, nargs="+", help="指定 VM ID")
+    parser.add_argument("--include-templates", action="store_true", help="一併刪除符合條件的模板（於其 linked clone 之後）")
+    parser.add_argument("--shutdown-timeout", type=int, default=DEFAULT_SHUTDOWN_TIMEOUT, help="ACPI 關機等待秒數，逾時改為強制停止")
+    parser.add_argument("--force", action="store_true", help="不嘗試 ACPI 關機，直接強制停止")
+    parser.add_argument("--stop-parallel", type=int, default=DEFAULT_STOP_PARALLEL, help="同時關機的 VM 數量")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL, help="同時刪除的 VM 數量")
+    parser.add_argument("--dry-run", action="store_true", help="只列出將刪除的 VM")
+    parser.add_argument("--yes", action="store_true", help="不詢問直接刪除")
+    parser.add_argument("--report", help="執行報告 JSONL 路徑（各 VM 關機 / 刪除耗時）")
+    parser.add_argument("--json", help="將每台 VM 的結果寫入 JSON 檔")
+    parser.add_argument("--backend", choices=["cli", "api"], help="Proxmox 操作後端（預設讀取 PVE_BACKEND）")
+    args = parser.parse_args()
+
+    if args.parallel < 1 or args.stop_parallel < 1:
+        raise ValueError("[ERROR] --parallel 與 --stop-parallel 必須大於等於 1")
+    configure_backend(args.backend)
+    vms = select_vms(get_backend().cluster_vms(), args.prefix, args.tag, args.run_id, set(args.ids or ()),
+                     args.include_templates)
+    if not vms:
+        print("[SKIP] 沒有符合條件的 VM")
+        raise SystemExit(0)
+    print(f"[INFO] 符合條件的 VM 共 {len(vms)} 台：")
+    for vm in vms:
+        print(f"  - {vm['vmid']} {vm.get('name', '')} @ {vm.get('node', '-')}（{vm.get('status', '未知')}）")
+    if args.dry_run:
+        raise SystemExit(0)
+    if not args.yes and input("確定要刪除以上 VM？輸入 yes 繼續：").strip().lower() != "yes":
+        print("[SKIP] 已取消")
+        raise SystemExit(1)
+
+    run = start_run("kali_teardown", params={"count": len(vms), "parallel": args.parallel, "force": args.force})
+    started = time.monotonic()
+    results = teardown(vms, args.shutdown_timeout, args.stop_parallel, args.parallel, args.force)
+    run.finish(args.report)
+    print_results(results, time.monotonic() - started)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2))
+        print(f"[OK] 結果已寫入：{args.json}")
+    if not all(r.get("destroyed") for r in results):
+        raise SystemExit(1)
@@ -1,5 +1,7 @@
-import subprocess
 import argparse
+from clone_planner import plan_clones, print_clone_plan
+from pve_backend import configure_backend, get_backend
+from vm_config_plan import ConfigPlan
 
 # === 預設參數設定 ===
 DEFAULT_CPU = 2
@@ -10,50 +12,36 @@ DEFAULT_STORAGE = "local-lvm"
 DEFAULT_TEMPLATE_ID = 9000  # 預設模板 VM ID
 
 
-def run_command(cmd):
-    """執行系統指令並顯示輸出"""
-    print(f"\u26a1\ufe0f 執行指令: {' '.join(cmd)}")
-    subprocess.run(cmd, check=True)
-
-
-def create_vm(vm_id, hostname, cpu=None, ram=None, disk=None, bridge=None, template_id=None):
+def create_vm(vm_id, hostname, cpu=None, ram=None, disk=None, bridge=None, template_id=None,
+              storage=None, full=True):
     """建立新的 VM"""
     cpu = cpu or DEFAULT_CPU
     ram = ram or DEFAULT_RAM
     disk = disk or DEFAULT_DISK
     bridge = bridge or DEFAULT_BRIDGE
     template_id = template_id or DEFAULT_TEMPLATE_ID
+    storage = storage or DEFAULT_STORAGE
 
-    # Step 1: clone 從模板
-    clone_cmd = [
-        "qm", "clone", str(template_id), str(vm_id),
-        "--name", hostname,
-        "--full", "1",
-        "--storage", DEFAULT_STORAGE
-    ]
-    run_command(clone_cmd)
-
-    # Step 2: 設定 CPU / RAM / 磁碟 / 網卡
-    set_cmd = [
-        "qm", "set", str(vm_id),
-        "--cores", str(cpu),
-        "--memory", str(ram),
-        "--net0", f"virtio,bridge={bridge}"
-    ]
-    run_command(set_cmd)
+    # Step 1: clone 從模板（依儲存能力決定 linked / full clone）
+    backend = get_backend()
+    template_config = backend.get_config(template_id)
+    plan = plan_clones(template_id, [vm_id], full, [storage], template_config=template_config)[0]
+    print_clone_plan([plan])
+    print(f"\u26a1\ufe0f clone {template_id} → {vm_id}（{hostname}，{plan.mode} clone）")
+    backend.clone(template_id, vm_id, hostname, plan.clone_args())
 
-    # Step 3: 磁碟大小調整（可選）
-    if disk:
-        resize_cmd = [
-            "qm", "resize", str(vm_id), "scsi0", f"{disk}G"
-        ]
-        run_command(resize_cmd)
+    # Step 2–3: CPU / RAM / 網卡以單次 set 套用（與模板相同者略過），磁碟僅在需要放大時 resize
+    print(f"\u26a1\ufe0f 設定 VM {vm_id}：cores={cpu} memory={ram} bridge={bridge} disk={disk}G")
+    ConfigPlan.from_template(vm_id, template_config, hostname) \
+        .want(cores=cpu, memory=ram, net0=f"virtio,bridge={bridge}") \
+        .want_resize("scsi0", f"{disk}G").apply(backend)
 
     # Step 4: 啟動 VM
-    start_cmd = ["qm", "start", str(vm_id)]
-    run_command(start_cmd)
+    print(f"\u26a1\ufe0f 啟動 VM {vm_id}")
+    backend.start(vm_id)
 
-    print(f"\ud83c\udf89 VM {vm_id} ({hostname}) 建立完成並啟動！")
+    print(f"\U0001f389 VM {vm_id} ({hostname}) 建立完成並啟動！")
+    return {"vm_id": int(vm_id), "hostname": hostname, "clone_mode": plan.mode, "storage": plan.storage}
 
 
 if __name__ == "__main__":
@@ -65,9 +53,13 @@ if __name__ == "__main__":
     parser.add_argument("--disk", type=int, help="磁碟GB大小（可選）")
     parser.add_argument("--bridge", help="網卡橋接名稱（可選）")
     parser.add_argument("--template_id", type=int, help="模板 VM ID（可選）")
+    parser.add_argument("--storage", help="full clone 目標儲存（可選）")
+    parser.add_argument("--backend", choices=["cli", "api"], help="Proxmox 操作後端（可選，預設讀取 PVE_BACKEND）")
+    parser.add_argument("--linked", action="store_true", help="儲存支援時使用 linked clone（可選）")
 
     args = parser.parse_args()
 
+    configure_backend(args.backend)
     create_vm(
         vm_id=args.vm_id,
         hostname=args.hostname,
@@ -75,6 +67,8 @@ if __name__ == "__main__":
         ram=args.ram,
         disk=args.disk,
         bridge=args.bridge,
-        template_id=args.template_id
+        template_id=args.template_id,
+        storage=args.storage,
+        full=not args.linked
     )
 
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 自然語言轉 CLI 參數：先查持久化快取，再以規則解析常見句型，最後才呼叫模型（OpenAI 或 OpenAI 相容的本機服務）
+# 模型回覆容許前後夾雜文字或 ``` 區塊，解析失敗時重試一次
+
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import unicodedata
+from pathlib import Path
+
+NLP_DEFAULTS = {
+    "count": 1,
+    "name": ["kali-nlp"],
+    "description": "Kali NLP VM",
+    "min_mem": 4096,
+    "max_mem": 8192,
+    "cpu": 2,
+    "bridge": "vmbr0",
+    "vlan": None,
+    "resize": "+0G",
+    "storage": "local-lvm",
+}
+PROMPT_VERSION = 2          # 變更提示詞、欄位或規則解析時遞增，使舊快取失效
+CACHE_LIMIT = 500
+DEFAULT_MODEL = "gpt-4"
+DEFAULT_HTTP_URL = "http://127.0.0.1:8080/v1"
+SYSTEM_PROMPT = "你是參數轉換助手，幫助將中文指令轉成 CLI 所需格式。"
+CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "兩": 2, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+CN_UNITS = {"十": 10, "百": 100}
+CN_NUMERAL = "[零〇一兩二三四五六七八九十百]"
+
+def build_prompt(instruction):
+    return f"""
+將以下自然語言指令轉換為 JSON 格式參數，對應 CLI 指令中：
+--count、--name、--description、--min-mem、--max-mem、--cpu、--bridge、--vlan、--resize、--storage
+
+輸入：「{instruction}」
+
+請輸出如下：
+{json.dumps(NLP_DEFAULTS, ensure_ascii=False, indent=2)}
+只輸出純 JSON。
+"""
+
+# 正規化指令作為快取鍵：全形轉半形、小寫、合併空白、去除結尾標點
+def normalize_instruction(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"\s+", " ", text).strip(" 。.!！?？")
+
+# 從模型回覆取出第一個完整的 JSON 物件（略過 ``` 區塊標記與前後說明文字）
+def extract_json(text):
+    text = re.sub(r"```(?:json)?", "", str(text or ""))
+    start = text.find("{")
+    while start != -1:
+        depth, in_string, escaped = 0, False, False
+        for i, ch in enumerate(text[start:], start):
+            if in_string:
+                escaped = ch == "\\" and not escaped
+                if ch == '"' and not escaped:
+                    in_string = False
+                continue
+            if ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        return json.loads(text[start:i + 1])
+                    except ValueError:
+                        break
+        start = text.find("{", start + 1)
+    raise ValueError(f"[ERROR] 模型回覆中找不到有效的 JSON：{text.strip()[:200]}")
+
+# 檢查欄位並轉換型別，未知欄位忽略、缺少的欄位補預設值
+def coerce_args(data):
+    if not isinstance(data, dict):
+        raise ValueError("[ERROR] NLP 解析結果必須是 JSON 物件")
+    result = dict(NLP_DEFAULTS)
+    for key in NLP_DEFAULTS:
+        value = data.get(key)
+        if value is None or value == "":
+            continue
+        try:
+            if key in ("count", "min_mem", "max_mem", "cpu"):
+                result[key] = int(value)
+            elif key == "name":
+                result[key] = [str(v) for v in value] if isinstance(value, list) else str(value).split()
+            elif key == "vlan":
+                result[key] = str(int(value))
+            else:
+                result[key] = str(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"[ERROR] NLP 解析結果欄位 {key} 格式無效：{value!r}")
+    if result["max_mem"] < result["min_mem"]:
+        result["min_mem"] = result["max_mem"]
+    return result
+
+# 中文數字（十二、二十、一百零五）轉整數，無法解析時回傳 None
+def _cn_number(text):
+    total, digit = 0, None
+    for ch in text:
+        if ch in CN_UNITS:
+            total += (1 if digit is None else digit) * CN_UNITS[ch]
+            digit = None
+        elif ch in CN_DIGITS:
+            if digit:                     # 「二二」這類連續數字不是合法寫法
+                return None
+            digit = CN_DIGITS[ch]
+        else:
+            return None
+    return total + (digit or 0)
+
+def _number(text):
+    return int(text) if text.isdigit() else _cn_number(text)
+
+def _mb(value, unit):
+    return int(float(value) * (1024 if unit.startswith("g") else 1))
+
+# 常見句型的規則解析（例如「建立 3 台 4 核 8G 記憶體的 kali，vlan 20，磁碟加 10G」）
+RULES = [
+    ("count", re.compile(rf"(\d+|{CN_NUMERAL}+)\s*(?:台|臺|個|部|vms?\b|machines?\b|instances?\b)")),
+    ("cpu", re.compile(rf"(\d+|{CN_NUMERAL}+)\s*(?:核心?|顆\s*cpu|v?cpus?\b|cores?\b)|(?:cpu|核心數?)\s*[:：=]?\s*(\d+)")),
+    # 範圍兩端皆可帶單位（4G~8G 或 4~8G），記憶體字樣可在前或在後
+    ("mem_range", re.compile(r"(\d+(?:\.\d+)?)\s*(gib|mib|gb?|mb?)?\s*[~到至-]\s*(\d+(?:\.\d+)?)\s*(gib|mib|gb?|mb?)\s*(?:的)?\s*(?:記憶體|內存|ram|memory)"
+                             r"|(?:記憶體|內存|ram|memory)\s*[:：=]?\s*(\d+(?:\.\d+)?)\s*(gib|mib|gb?|mb?)?\s*[~到至-]\s*(\d+(?:\.\d+)?)\s*(gib|mib|gb?|mb?)")),
+    ("mem", re.compile(r"(\d+(?:\.\d+)?)\s*(gb?|mb?|gib|mib)\s*(?:的)?\s*(?:記憶體|內存|ram|memory)|(?:記憶體|內存|ram|memory)\s*[:：=]?\s*(\d+(?:\.\d+)?)\s*(gb?|mb?|gib|mib)")),
+    ("resize", re.compile(r"(?:磁碟|硬碟|disk)\s*(?:加大|增加|擴充|加|多|grow|\+)\s*(\d+)\s*g|(?:加大|增加|擴充)\s*(?:磁碟|硬碟)\s*(\d+)\s*g")),
+    ("vlan", re.compile(r"vlan\s*[:：=#]?\s*(\d+)")),
+    ("bridge", re.compile(r"\b(vmbr\d+)\b")),
+    ("storage", re.compile(r"(?:storage|儲存(?:空間)?|存放(?:於|在)|放在)\s*[:：=]?\s*([a-z][\w-]*)")),
+    ("name", re.compile(r"(?:名稱|名字|命名為|叫做|叫|named?|called)\s*[:：=]?\s*[\"'「]?([a-z0-9][\w.-]*)")),
+    ("description", re.compile(r"(?:描述|說明|備註|description)\s*[:：=]?\s*[\"'「](.+?)[\"'」]")),
+]
+
+# 規則解析：回傳 (參數, 是否完全理解)；指令中仍有未被任何規則使用的數字（含中文數字）時視為未完全理解
+def parse_rules(instruction):
+    text = normalize_instruction(instruction)
+    found, consumed = {}, []
+    for field, pattern in RULES:
+        match = pattern.search(text)
+        if not match:
+            continue
+        groups = [g for g in match.groups() if g is not None]
+        if field in ("count", "cpu"):
+            if not _number(groups[0]):
+                continue
+            found[field] = _number(groups[0])
+        elif field == "mem_range":
+            low, low_unit, high, high_unit = match.groups()[:4] if match.group(1) else match.groups()[4:]
+            found["min_mem"], found["max_mem"] = _mb(low, low_unit or high_unit), _mb(high, high_unit)
+        elif field == "mem" and "max_mem" not in found:
+            found["min_mem"] = found["max_mem"] = _mb(groups[0], groups[1])
+        elif field == "resize":
+            found["resize"] = f"+{groups[0]}G"
+        elif field == "name":
+            found["name"] = [groups[0]]
+        elif field in ("vlan", "bridge", "storage", "description"):
+            found[field] = groups[0]
+        else:
+            continue
+        consumed.append(match.span())
+    leftover = "".join(ch for i, ch in enumerate(text) if not any(s <= i < e for s, e in consumed))
+    complete = bool(found) and not re.search(rf"\d|{CN_NUMERAL}", leftover)
+    return found, complete
+
+class NlpCache:
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def key(self, instruction, backend_id):
+        raw = f"{PROMPT_VERSION}|{backend_id}|{normalize_instruction(instruction)}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _load(self):
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        entry = self._load().get(key)
+        return entry["args"] if entry else None
+
+    # 讀取 → 合併 → 原子寫回，超過上限時淘汰最舊的項目
+    def put(self, key, instruction, args, source):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.with_suffix(".lock").open("a+") as lf:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+                entries = self._load()
+                entries[key] = {"instruction": instruction, "args": args, "source": source, "created": time.time()}
+                if len(entries) > CACHE_LIMIT:
+                    for old in sorted(entries, key=lambda k: entries[k]["created"])[:len(entries) - CACHE_LIMIT]:
+                        del entries[old]
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(entries, ensure_ascii=False, indent=2))
+                tmp.replace(self.path)
+        except OSError as e:
+            print(f"[WARN] 無法寫入 NLP 快取 {self.path}：{e}")
+
+# OpenAI 官方 API（延遲匯入 openai，同時支援 0.x 與 1.x 版 SDK）
+class OpenAIBackend:
+    def __init__(self, model=DEFAULT_MODEL, api_key=None):
+        self.model = model
+        self.api_key = api_key
+
+    # 金鑰在實際呼叫模型時才讀取，快取或規則命中時不需要金鑰
+    def _api_key(self):
+        if not self.api_key:
+            self.api_key = os.getenv("OPENAI_API_KEY")
+        if not self.api_key:
+            key_file = Path("~/.openai_api_key").expanduser()
+            if not key_file.exists():
+                raise RuntimeError("[ERROR] NLP 模式需設定 OPENAI_API_KEY 環境變數或 ~/.openai_api_key")
+            self.api_key = key_file.read_text().strip()
+        return self.api_key
+
+    @property
+    def id(self):
+        return f"openai:{self.model}"
+
+    def complete(self, messages):
+        try:
+            import openai
+        except ImportError:
+            raise RuntimeError("[ERROR] 尚未安裝 openai 模組，請執行：pip install openai")
+        if hasattr(openai, "OpenAI"):
+            client = openai.OpenAI(api_key=self._api_key())
+            res = client.chat.completions.create(model=self.model, messages=messages, temperature=0)
+            return res.choices[0].message.content
+        openai.api_key = self._api_key()
+        res = openai.ChatCompletion.create(model=self.model, messages=messages, temperature=0)
+        return res["choices"][0]["message"]["content"]
+
+# OpenAI 相容的 /chat/completions 服務（llama.cpp server、Ollama、vLLM 或 fake_llm_api.py）
+class HttpBackend:
+    def __init__(self, url=DEFAULT_HTTP_URL, model="local", api_key=None, timeout=60):
+        self.url = url.rstrip("/")
+        self.model = model
+        self.api_key = api_key or os.getenv("NLP_API_KEY")
+        self.timeout = timeout
+
+    @property
+    def id(self):
+        return f"http:{self.url}:{self.model}"
+
+    def complete(self, messages):
+        import requests
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        response = requests.post(f"{self.url}/chat/completions", headers=headers, timeout=self.timeout,
+                                 json={"model": self.model, "messages": messages, "temperature": 0})
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+# 依名稱建立模型後端：openai、http，或 rules（只用規則解析，不呼叫模型）
+def make_backend(kind=None, url=None, model=None):
+    kind = kind or os.getenv("NLP_BACKEND", "openai")
+    if kind == "openai":
+        return OpenAIBackend(model or DEFAULT_MODEL)
+    if kind == "http":
+        return HttpBackend(url or os.getenv("NLP_API_URL", DEFAULT_HTTP_URL), model or os.getenv("NLP_MODEL", "local"))
+    if kind == "rules":
+        return None
+    raise ValueError(f"[ERROR] 不支援的 NLP 後端：{kind}")
+
+class NlpParser:
+    def __init__(self, backend=None, cache=None, use_rules=True):
+        self.backend = backend
+        self.cache = cache
+        self.use_rules = use_rules
+
+    def _ask_model(self, instruction):
+        messages = [{"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": build_prompt(instruction)}]
+        for attempt in range(2):
+            reply = self.backend.complete(messages)
+            try:
+                return coerce_args(extract_json(reply))
+            except ValueError as e:
+                if attempt:
+                    raise
+                print(f"[WARN] 模型回覆無法解析，重試一次：{e}")
+                messages += [{"role": "assistant", "content": str(reply)},
+                             {"role": "user", "content": "請只輸出一個 JSON 物件，不要有其他文字。"}]
+
+    # 回傳 (參數 dict, 來源 cache / rules / model)
+    def parse(self, instruction):
+        backend_id = self.backend.id if self.backend else "rules"
+        key = self.cache.key(instruction, backend_id) if self.cache else None
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            return coerce_args(cached), "cache"
+
+        found, complete = parse_rules(instruction) if self.use_rules else ({}, False)
+        if complete:
+            args, source = coerce_args(found), "rules"
+        elif self.backend is None:
+            # 只理解部分內容時不自行補上預設值，以免建立與指令不符的 VM
+            understood = f"（僅解析出 {found}）" if found else ""
+            raise ValueError(f"[ERROR] 規則無法完整解析指令「{instruction}」{understood}，請改寫指令或設定 NLP 模型後端")
+        else:
+            args, source = self._ask_model(instruction), "model"
+        if self.cache:
+            self.cache.put(key, instruction, args, source)
+        return args, source
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 常駐佈建服務：提供本機 HTTP/JSON API 給 n8n 呼叫，以工作佇列執行 create_vm，避免每次請求都啟動新的 Python 程序
+
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from n8n import create_vm
+from pve_backend import configure_backend
+from qga_readiness import wait_for_guest_ip
+from vm_id_allocator import reserve_vm_ids, release_vm_ids
+
+JOB_RETENTION = 3600    # 已完成工作保留秒數
+MAX_BODY = 64 * 1024
+JOB_FIELDS = ("vm_id", "hostname", "cpu", "ram", "disk", "bridge", "template_id", "storage", "linked", "wait_ip")
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Job:
+    def __init__(self, params, idempotency_key=None):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.idempotency_key = idempotency_key
+        self.status = "queued"   # queued → running → succeeded / failed
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def as_dict(self):
+        return {"job_id": self.id, "status": self.status, "params": self.params,
+                "idempotency_key": self.idempotency_key, "error": self.error,
+                "created": self.created, "started": self.started, "finished": self.finished}
+
+class ProvisionService:
+    def __init__(self, workers=4, token=None, ip_timeout=120):
+        self.workers = workers
+        self.token = token
+        self.ip_timeout = ip_timeout
+        self.jobs = {}
+        self.by_key = {}
+        self.queue = asyncio.Queue()
+
+    # 驗證並整理請求參數（對應 n8n.py 的 CLI 參數）
+    def _validate(self, body):
+        if not isinstance(body, dict):
+            raise HttpError(400, "請求內容必須是 JSON 物件")
+        unknown = set(body) - set(JOB_FIELDS)
+        if unknown:
+            raise HttpError(400, f"未知的欄位：{', '.join(sorted(unknown))}")
+        if not body.get("hostname"):
+            raise HttpError(400, "缺少 hostname")
+        for key in ("vm_id", "cpu", "ram", "disk", "template_id"):
+            if body.get(key) is not None and (not isinstance(body[key], int) or body[key] < 1):
+                raise HttpError(400, f"{key} 必須是正整數")
+        return {key: body.get(key) for key in JOB_FIELDS}
+
+    def submit(self, body, idempotency_key=None):
+        if idempotency_key and idempotency_key in self.by_key:
+            return self.jobs[self.by_key[idempotency_key]], False
+        job = Job(self._validate(body), idempotency_key)
+        self.jobs[job.id] = job
+        if idempotency_key:
+            self.by_key[idempotency_key] = job.id
+        self.queue.put_nowait(job)
+        return job, True
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        params = job.params
+        vm_id = params["vm_id"]
+        reserved = []
+        if vm_id is None:
+            reserved = await loop.run_in_executor(None, reserve_vm_ids, 1)
+            vm_id = reserved[0]
+        try:
+            result = await loop.run_in_executor(None, lambda: create_vm(
+                vm_id, params["hostname"], params["cpu"], params["ram"], params["disk"], params["bridge"],
+                params["template_id"], params["storage"], not params["linked"]))
+        finally:
+            if reserved:
+                await loop.run_in_executor(None, release_vm_ids, reserved)
+        if params["wait_ip"]:
+            result["ip"] = await wait_for_guest_ip(vm_id, self.ip_timeout)
+        return result
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                job.result = await self._run(job)
+                job.status = "succeeded"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished = time.time()
+                self.queue.task_done()
+
+    # 定期清除過期的已完成工作
+    async def reaper(self):
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.time() - JOB_RETENTION
+            for job in [j for j in self.jobs.values() if j.finished and j.finished < cutoff]:
+                self.jobs.pop(job.id, None)
+                if job.idempotency_key:
+                    self.by_key.pop(job.idempotency_key, None)
+
+    def route(self, method, path, headers, body):
+        if self.token and headers.get("authorization") != f"Bearer {self.token}":
+            raise HttpError(401, "未授權")
+        parts = [p for p in path.split("?", 1)[0].split("/") if p]
+        if method == "GET" and parts == ["healthz"]:
+            return 200, {"status": "ok", "queued": self.queue.qsize(), "jobs": len(self.jobs)}
+        if parts[:1] != ["jobs"]:
+            raise HttpError(404, "找不到路徑")
+        if method == "POST" and len(parts) == 1:
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                raise HttpError(400, "請求內容不是有效的 JSON")
+            job, created = self.submit(payload, headers.get("idempotency-key"))
+            return (202 if created else 200), job.as_dict()
+        if method == "GET" and len(parts) == 1:
+            return 200, [job.as_dict() for job in self.jobs.values()]
+        job = self.jobs.get(parts[1]) if len(parts) > 1 else None
+        if job is None:
+            raise HttpError(404, "找不到工作")
+        if method == "GET" and len(parts) == 2:
+            return 200, job.as_dict()
+        if method == "GET" and len(parts) == 3 and parts[2] == "result":
+            if job.status == "failed":
+                return 500, {"job_id": job.id, "status": job.status, "error": job.error}
+            if job.status != "succeeded":
+                return 409, {"job_id": job.id, "status": job.status}
+            return 200, {"job_id": job.id, "status": job.status, "result": job.result}
+        raise HttpError(405, "不支援的方法")
+
+    # 最小化的 HTTP/1.1 處理（支援 keep-alive），不需額外套件
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                # Content-Length 無效或過大時無法判斷請求邊界，回應錯誤後關閉連線
+                framing_lost = False
+                try:
+                    try:
+                        length = int(headers.get("content-length", 0) or 0)
+                    except ValueError:
+                        length = -1
+                    if length < 0:
+                        framing_lost = True
+                        raise HttpError(400, "Content-Length 無效")
+                    if length > MAX_BODY:
+                        framing_lost = True
+                        raise HttpError(413, "請求內容過大")
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = self.route(method.upper(), path, headers, body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                data = json.dumps(payload, ensure_ascii=False).encode()
+                writer.write(f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if framing_lost or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self.reaper()))
+        print(f"[OK] 佈建服務啟動：http://{host}:{port}（workers={self.workers}）")
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proxmox VM 佈建常駐服務（供 n8n 呼叫）")
+    parser.add_argument("--host", default="127.0.0.1", help="監聽位址（預設僅限本機）")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4, help="同時執行的建立工作數量")
+    parser.add_argument("--token", help="API Bearer Token（可選）")
+    parser.add_argument("--ip-timeout", type=int, default=120, help="wait_ip 時等待 IP 的秒數上限")
+    parser.add_argument("--backend", choices=["cli", "api"], help="Proxmox 操作後端（預設讀取 PVE_BACKEND）")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        raise ValueError("[ERROR] --workers 必須大於等於 1")
+    configure_backend(args.backend)
+    try:
+        asyncio.run(ProvisionService(args.workers, args.token, args.ip_timeout).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Proxmox 操作後端：subprocess（qm CLI）與 HTTPS API（keep-alive 連線池）兩種實作，介面相同
+
+import os
+import json
+import time
+import socket
+import subprocess
+
+API_TIMEOUT = 30
+TASK_POLL_INTERVAL = 0.5
+LOCAL_NODE = socket.gethostname().split(".")[0]  # 本機節點名稱（各模組共用）
+
+class BackendError(RuntimeError):
+    pass
+
+# 將 {"memory": 8192, "agent": "enabled=1"} 轉為 qm CLI 參數
+def _cli_options(options):
+    args = []
+    for key, value in options.items():
+        args += [f"--{key}", str(value)]
+    return args
+
+# 解析 qm config 輸出（key: value），略過快照區段
+def parse_config_text(text):
+    config = {}
+    for line in text.splitlines():
+        if line.startswith("["):
+            break
+        key, sep, value = line.partition(":")
+        if sep and key and not key.startswith("#"):
+            config[key.strip()] = value.strip()
+    return config
+
+# 記錄 VM 所在節點，之後對該 VM 的操作自動導向該節點（未記錄者視為本機）
+class _Placement:
+    def __init__(self):
+        self.placement = {}
+
+    def assign_node(self, vm_id, node):
+        self.placement[int(vm_id)] = node
+
+    def node_of(self, vm_id):
+        return self.placement.get(int(vm_id))
+
+class SubprocessBackend(_Placement):
+    name = "cli"
+
+    def _run(self, tool, *args, capture=False):
+        result = subprocess.run([tool, *map(str, args)], check=True, text=True,
+                                stdout=subprocess.PIPE if capture else None)
+        return result.stdout if capture else None
+
+    def _qm(self, *args, capture=False):
+        return self._run("qm", *args, capture=capture)
+
+    # qm 只能操作本機 VM，其他節點上的 VM 改以 pvesh 呼叫對應的 API 路徑
+    def _remote(self, vm_id):
+        node = self.node_of(vm_id)
+        return node if node and node != LOCAL_NODE else None
+
+    def _pvesh(self, method, path, options=None, capture=False):
+        args = [method, path, *_cli_options(options or {})]
+        if capture:
+            args += ["--output-format", "json"]
+        return self._run("pvesh", *args, capture=capture)
+
+    def clone(self, template_id, vm_id, name, clone_args=()):
+        self._qm("clone", template_id, vm_id, "--name", name, *clone_args)
+
+    def set_config(self, vm_id, options):
+        if not options:
+            return
+        node = self._remote(vm_id)
+        if node:
+            self._pvesh("set", f"/nodes/{node}/qemu/{vm_id}/config", options)
+        else:
+            self._qm("set", vm_id, *_cli_options(options))
+
+    def get_config(self, vm_id):
+        node = self._remote(vm_id)
+        if node:
+            data = json.loads(self._pvesh("get", f"/nodes/{node}/qemu/{vm_id}/config", capture=True) or "{}")
+            return {k: str(v) for k, v in data.items()}
+        return parse_config_text(self._qm("config", vm_id, capture=True))
+
+    def resize(self, vm_id, disk, size):
+        node = self._remote(vm_id)
+        if node:
+            self._pvesh("set", f"/nodes/{node}/qemu/{vm_id}/resize", {"disk": disk, "size": size})
+        else:
+            self._qm("resize", vm_id, disk, size)
+
+    def start(self, vm_id):
+        node = self._remote(vm_id)
+        if node:
+            self._pvesh("create", f"/nodes/{node}/qemu/{vm_id}/status/start")
+        else:
+            self._qm("start", vm_id)
+
+    def stop(self, vm_id):
+        node = self._remote(vm_id)
+        if node:
+            self._pvesh("create", f"/nodes/{node}/qemu/{vm_id}/status/stop")
+        else:
+            self._qm("stop", vm_id)
+
+    # 透過 ACPI 關機，timeout 秒內未關機時 qm 會回傳錯誤
+    def shutdown(self, vm_id, timeout=60):
+        node = self._remote(vm_id)
+        if node:
+            self._pvesh("create", f"/nodes/{node}/qemu/{vm_id}/status/shutdown", {"timeout": timeout})
+        else:
+            self._qm("shutdown", vm_id, "--timeout", timeout)
+
+    # 將（已關機的）VM 轉為模板，磁碟卷由 vm-<ID>-disk 改名為 base-<ID>-disk
+    def template(self, vm_id):
+        node = self._remote(vm_id)
+        if node:
+            self._pvesh("create", f"/nodes/{node}/qemu/{vm_id}/template")
+        else:
+            self._qm("template", vm_id)
+
+    def destroy(self, vm_id):
+        node = self._remote(vm_id)
+        if node:
+            self._pvesh("delete", f"/nodes/{node}/qemu/{vm_id}")
+        else:
+            self._qm("destroy", vm_id)
+
+    # 叢集資源（pvesh get /cluster/resources --type node|vm）
+    def _cluster_resources(self, kind):
+        return json.loads(self._pvesh("get", "/cluster/resources", {"type": kind}, capture=True) or "[]")
+
+    def cluster_nodes(self):
+        return self._cluster_resources("node")
+
+    # 叢集所有 VM / 容器的節點、狀態、名稱與標籤（單次查詢）
+    def cluster_vms(self):
+        return self._cluster_resources("vm")
+
+    def close(self):
+        pass
+
+class ApiBackend(_Placement):
+    name = "api"
+
+    def __init__(self, url, token, node=None, verify=True, pool_size=16):
+        import requests
+        from requests.adapters import HTTPAdapter
+        super().__init__()
+        self.base = url.rstrip("/") + "/api2/json"
+        self.node = node or LOCAL_NODE
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"PVEAPIToken={token}"
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _request(self, method, path, **kwargs):
+        response = self.session.request(method, self.base + path, timeout=API_TIMEOUT, **kwargs)
+        if response.status_code >= 400:
+            raise BackendError(f"[ERROR] Proxmox API {method} {path} 失敗（HTTP {response.status_code}）：{response.text.strip()}")
+        return response.json().get("data")
+
+    def _vm_path(self, vm_id, node=None):
+        return f"/nodes/{node or self.node_of(vm_id) or self.node}/qemu/{vm_id}"
+
+    # 等待單一 UPID 完成，結束狀態非 OK 時拋出例外
+    def wait_task(self, upid, timeout=600):
+        node = upid.split(":")[1]
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = self._request("GET", f"/nodes/{node}/tasks/{upid}/status")
+            if status.get("status") == "stopped":
+                if status.get("exitstatus") != "OK":
+                    raise BackendError(f"[ERROR] 任務 {upid} 失敗：{status.get('exitstatus')}")
+                return status
+            time.sleep(TASK_POLL_INTERVAL)
+        raise BackendError(f"[ERROR] 等待任務 {upid} 逾時")
+
+    def _task(self, upid):
+        if upid:
+            self.wait_task(upid)
+        return upid
+
+    def clone(self, template_id, vm_id, name, clone_args=()):
+        data = {"newid": vm_id, "name": name}
+        # clone_args 沿用 qm clone 的 --key value 形式
+        for key, value in zip(clone_args[::2], clone_args[1::2]):
+            data[key.lstrip("-")] = value
+        return self._task(self._request("POST", f"{self._vm_path(template_id)}/clone", data=data))
+
+    def set_config(self, vm_id, options):
+        if options:
+            return self._task(self._request("POST", f"{self._vm_path(vm_id)}/config", data=options))
+
+    def get_config(self, vm_id):
+        return {k: str(v) for k, v in (self._request("GET", f"{self._vm_path(vm_id)}/config") or {}).items()}
+
+    def resize(self, vm_id, disk, size):
+        return self._task(self._request("PUT", f"{self._vm_path(vm_id)}/resize", data={"disk": disk, "size": size}))
+
+    def start(self, vm_id):
+        return self._task(self._request("POST", f"{self._vm_path(vm_id)}/status/start"))
+
+    def stop(self, vm_id):
+        return self._task(self._request("POST", f"{self._vm_path(vm_id)}/status/stop"))
+
+    def shutdown(self, vm_id, timeout=60):
+        upid = self._request("POST", f"{self._vm_path(vm_id)}/status/shutdown", data={"timeout": timeout})
+        if upid:
+            self.wait_task(upid, timeout + 30)
+        return upid
+
+    def template(self, vm_id):
+        return self._task(self._request("POST", f"{self._vm_path(vm_id)}/template"))
+
+    def destroy(self, vm_id):
+        return self._task(self._request("DELETE", self._vm_path(vm_id)))
+
+    def cluster_nodes(self):
+        return self._request("GET", "/cluster/resources", params={"type": "node"}) or []
+
+    def cluster_vms(self):
+        return self._request("GET", "/cluster/resources", params={"type": "vm"}) or []
+
+    def close(self):
+        self.session.close()
+
+_backend = None
+
+# 依參數或環境變數建立後端：PVE_BACKEND=cli|api，API 模式需 PVE_API_URL 與 PVE_API_TOKEN（USER@REALM!TOKENID=UUID）
+def configure_backend(kind=None):
+    global _backend
+    kind = kind or os.environ.get("PVE_BACKEND", "cli")
+    if kind == "cli":
+        _backend = SubprocessBackend()
+    elif kind == "api":
+        url = os.environ.get("PVE_API_URL", "https://127.0.0.1:8006")
+        token = os.environ.get("PVE_API_TOKEN")
+        if not token:
+            raise RuntimeError("[ERROR] API 後端需設定 PVE_API_TOKEN 環境變數")
+        # 預設驗證 TLS 憑證；PVE_VERIFY_SSL 可指定 CA 檔路徑（如 /etc/pve/pve-root-ca.pem），設為 0 才明確停用
+        verify = os.environ.get("PVE_VERIFY_SSL", "1")
+        if verify.lower() in ("0", "false", "no"):
+            verify = False
+        elif verify.lower() in ("1", "true", "yes"):
+            verify = True
+        _backend = ApiBackend(url, token, os.environ.get("PVE_NODE"), verify)
+    else:
+        raise ValueError(f"[ERROR] 不支援的後端：{kind}")
+    return _backend
+
+def get_backend():
+    return _backend or configure_backend()
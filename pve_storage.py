@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Proxmox 儲存空間資訊：解析 storage.cfg 與 pvesm status
+
+import subprocess
+from vm_id_allocator import PVE_CONFIG_ROOT
+
+# 以檔案形式存放磁碟映像（可直接寫入 qcow2）的儲存類型
+FILE_STORAGE_TYPES = {"dir", "nfs", "cifs", "glusterfs", "cephfs", "btrfs"}
+# 區塊裝置型儲存（需轉為 raw 寫入）
+BLOCK_STORAGE_TYPES = {"lvm", "lvmthin", "zfspool", "rbd", "iscsi", "iscsidirect"}
+
+# 解析 /etc/pve/storage.cfg，回傳 {名稱: {"type": ..., 其他設定}}
+def parse_storage_cfg(path=None):
+    path = path or PVE_CONFIG_ROOT / "storage.cfg"
+    storages = {}
+    current = None
+    try:
+        lines = path.read_text().splitlines()
+    except OSError:
+        return storages
+    for line in lines:
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        if not line[0].isspace() and ":" in line:
+            kind, _, name = line.partition(":")
+            current = {"type": kind.strip()}
+            storages[name.strip()] = current
+        elif current is not None:
+            key, _, value = line.strip().partition(" ")
+            current[key] = value.strip() or True
+    return storages
+
+# 取得儲存類型，找不到設定時回傳 None
+def storage_type(storage, cfg=None):
+    cfg = cfg if cfg is not None else parse_storage_cfg()
+    return cfg.get(storage, {}).get("type")
+
+# 解析 pvesm status，回傳 {名稱: {"type", "active", "total", "used", "avail"}}，容量單位為 bytes
+def storage_status():
+    result = subprocess.run(["pvesm", "status"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    status = {}
+    for line in result.stdout.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) < 6:
+            continue
+        try:
+            total, used, avail = (int(v) * 1024 for v in parts[3:6])
+        except ValueError:
+            continue
+        status[parts[0]] = {"type": parts[1], "active": parts[2] == "active",
+                            "total": total, "used": used, "avail": avail}
+    return status
+
+# 將 Proxmox 容量字串（例如 80G、512M、1T 或純位元組數）轉為 bytes
+def parse_size_bytes(size_str):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    size_str = str(size_str).strip().upper().rstrip("B")
+    if size_str and size_str[-1] in units:
+        return int(float(size_str[:-1]) * units[size_str[-1]])
+    return int(float(size_str))
+
+# 將容量（G / M / K / T 字串或位元組數）統一轉換為 GiB 表示，整數不帶小數；無法解析時原樣回傳
+def convert_to_gb(size_str) -> str:
+    try:
+        gib = parse_size_bytes(size_str) / 1024 ** 3
+    except (TypeError, ValueError):
+        return str(size_str)
+    if gib.is_integer():
+        return f"{int(gib)}G"
+    return f"{gib:.1f}G" if gib >= 0.1 else f"{gib:.2f}G"
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Guest Agent 就緒偵測：直接連線 QEMU guest-agent socket，以指數退避 + jitter 等待 VM 取得 IP
+
+import os
+import json
+import base64
+import random
+import asyncio
+import threading
+from pathlib import Path
+from pve_backend import LOCAL_NODE
+
+QGA_SOCKET_DIR = Path(os.environ.get("QGA_SOCKET_DIR", "/var/run/qemu-server"))
+IFACE_NAMES = ("eth0", "ens18", "ens3", "enp0s3")  # 常見的 Kali 網卡名稱
+
+class QgaError(RuntimeError):
+    pass
+
+# 從 guest-network-get-interfaces 結果取出第一個非 loopback 的 IPv4
+def extract_ipv4(interfaces):
+    for iface in interfaces or []:
+        if iface.get("name") not in IFACE_NAMES:
+            continue
+        for ip in iface.get("ip-addresses", []):
+            if ip.get("ip-address-type") == "ipv4" and ip.get("ip-address") != "127.0.0.1":
+                return ip.get("ip-address")
+    return None
+
+# 讀取一則 QGA 回應，略過 guest-sync-delimited 的 0xFF 分隔字元
+async def _read_response(reader):
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise QgaError("guest agent 連線已關閉")
+        line = line.lstrip(b"\xff").strip()
+        if line:
+            return json.loads(line)
+
+# 透過 socket 執行單一 QGA 指令（先 guest-sync-delimited 清除殘留回應）
+async def qga_command(vm_id, command, arguments=None, timeout=2.0, socket_dir=None):
+    path = Path(socket_dir or QGA_SOCKET_DIR) / f"{vm_id}.qga"
+
+    async def exchange():
+        reader, writer = await asyncio.open_unix_connection(str(path))
+        try:
+            sync_id = random.randint(1, 2 ** 31)
+            writer.write(b"\xff" + json.dumps({"execute": "guest-sync-delimited",
+                                                "arguments": {"id": sync_id}}).encode() + b"\n")
+            await writer.drain()
+            while (await _read_response(reader)).get("return") != sync_id:
+                pass
+
+            request = {"execute": command}
+            if arguments:
+                request["arguments"] = arguments
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            response = await _read_response(reader)
+        finally:
+            writer.close()
+        if "error" in response:
+            raise QgaError(response["error"].get("desc", str(response["error"])))
+        return response.get("return")
+
+    return await asyncio.wait_for(exchange(), timeout)
+
+# socket 不存在時（非本機節點或權限不足）退回 qm guest cmd
+async def _qm_guest_cmd(vm_id, command, timeout=5.0):
+    proc = await asyncio.create_subprocess_exec(
+        "qm", "guest", "cmd", str(vm_id), command.replace("guest-", "", 1),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        raise
+    if proc.returncode != 0:
+        raise QgaError(stderr.decode(errors="replace").strip() or f"qm guest cmd 結束碼 {proc.returncode}")
+    return json.loads(stdout)
+
+# 其他叢集節點上的 VM 無本機 socket，改以 pvesh 呼叫該節點的 agent API
+async def _pvesh_agent(node, vm_id, command, timeout=5.0):
+    proc = await asyncio.create_subprocess_exec(
+        "pvesh", "get", f"/nodes/{node}/qemu/{vm_id}/agent/{command.replace('guest-', '', 1)}",
+        "--output-format", "json", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        raise
+    if proc.returncode != 0:
+        raise QgaError(stderr.decode(errors="replace").strip() or f"pvesh 結束碼 {proc.returncode}")
+    return json.loads(stdout).get("result")
+
+async def _get_interfaces(vm_id, socket_dir=None, node=None):
+    if node and node != LOCAL_NODE:
+        return await _pvesh_agent(node, vm_id, "guest-network-get-interfaces")
+    path = Path(socket_dir or QGA_SOCKET_DIR) / f"{vm_id}.qga"
+    if path.exists():
+        await qga_command(vm_id, "guest-ping", socket_dir=socket_dir)
+        return await qga_command(vm_id, "guest-network-get-interfaces", socket_dir=socket_dir)
+    return await _qm_guest_cmd(vm_id, "guest-network-get-interfaces")
+
+# 等待單台 VM 取得 IP，逾時回傳 None；stats 若提供則記錄嘗試次數，node 為 VM 所在的叢集節點
+async def wait_for_guest_ip(vm_id, timeout=120, base_delay=0.25, max_delay=5.0, socket_dir=None, stats=None,
+                            node=None):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    attempt = 0
+    last_error = None
+    while True:
+        if stats is not None:
+            stats["attempts"] = attempt + 1
+        try:
+            ip = extract_ipv4(await _get_interfaces(vm_id, socket_dir, node))
+            if ip:
+                return ip
+            last_error = "尚未取得 IPv4 位址"
+        except (OSError, ValueError, asyncio.TimeoutError, QgaError) as e:
+            last_error = str(e) or type(e).__name__
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            print(f"[WARN] VM {vm_id} 等待 IP 逾時（{attempt + 1} 次嘗試）：{last_error}")
+            return None
+        # full jitter：避免大量 VM 同時重試
+        delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+        await asyncio.sleep(min(max(delay, 0.05), remaining))
+        attempt += 1
+
+def _b64(data):
+    return base64.b64decode(data).decode(errors="replace") if data else ""
+
+# socket 不存在時改用 qm guest exec（會等待指令結束並直接回傳結果）
+async def _qm_guest_exec(vm_id, argv, timeout):
+    proc = await asyncio.create_subprocess_exec(
+        "qm", "guest", "exec", str(vm_id), "--timeout", str(int(timeout)), "--", *argv,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0 and not stdout:
+        raise QgaError(stderr.decode(errors="replace").strip() or f"qm guest exec 結束碼 {proc.returncode}")
+    result = json.loads(stdout)
+    if not result.get("exited"):
+        raise QgaError(f"VM {vm_id} 指令執行逾時（{timeout} 秒）")
+    return result.get("exitcode", -1), result.get("out-data", ""), result.get("err-data", "")
+
+# 透過 guest-exec 在 VM 內執行指令並等待結束，回傳 (exitcode, stdout, stderr)
+async def guest_exec(vm_id, argv, timeout=1800, poll=2.0, socket_dir=None):
+    if not (Path(socket_dir or QGA_SOCKET_DIR) / f"{vm_id}.qga").exists():
+        return await _qm_guest_exec(vm_id, argv, timeout)
+    started = await qga_command(vm_id, "guest-exec", {"path": argv[0], "arg": list(argv[1:]), "capture-output": True},
+                                socket_dir=socket_dir)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        status = await qga_command(vm_id, "guest-exec-status", {"pid": started["pid"]}, socket_dir=socket_dir)
+        if status.get("exited"):
+            return status.get("exitcode", -1), _b64(status.get("out-data")), _b64(status.get("err-data"))
+        if loop.time() > deadline:
+            raise QgaError(f"VM {vm_id} 指令執行逾時（{timeout} 秒）：{' '.join(argv)}")
+        await asyncio.sleep(poll)
+
+def run_guest_command(vm_id, argv, timeout=1800, socket_dir=None):
+    return asyncio.run(guest_exec(vm_id, argv, timeout, socket_dir=socket_dir))
+
+# 於同一個 event loop 同時等待多台 VM，回傳 {vm_id: ip 或 None}
+async def wait_for_guest_ips(vm_ids, timeout=120, socket_dir=None):
+    ips = await asyncio.gather(*(wait_for_guest_ip(vm_id, timeout, socket_dir=socket_dir) for vm_id in vm_ids))
+    return dict(zip(vm_ids, ips))
+
+def wait_for_ips(vm_ids, timeout=120, socket_dir=None):
+    return asyncio.run(wait_for_guest_ips(list(vm_ids), timeout, socket_dir))
+
+# 只查詢一次（不重試）：targets 為 [(vm_id, node)]，同時最多 parallel 台，每台 timeout 秒，回傳 {vm_id: ip 或 None}
+async def query_guest_ips(targets, timeout=3.0, parallel=32, socket_dir=None):
+    limit = asyncio.Semaphore(parallel)
+
+    async def query(vm_id, node):
+        async with limit:
+            try:
+                return extract_ipv4(await asyncio.wait_for(_get_interfaces(vm_id, socket_dir, node), timeout))
+            except (OSError, ValueError, asyncio.TimeoutError, QgaError):
+                return None
+
+    ips = await asyncio.gather(*(query(vm_id, node) for vm_id, node in targets))
+    return {vm_id: ip for (vm_id, _), ip in zip(targets, ips)}
+
+def query_ips(targets, timeout=3.0, parallel=32, socket_dir=None):
+    return asyncio.run(query_guest_ips(list(targets), timeout, parallel, socket_dir))
+
+# 背景 event loop：讓多個部署執行緒共用同一個 loop 監看 VM 就緒狀態
+class ReadinessWatcher:
+    def __init__(self, timeout=120, socket_dir=None):
+        self.timeout = timeout
+        self.socket_dir = socket_dir
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    # 回傳 concurrent.futures.Future，結果為 IP 或 None
+    def watch(self, vm_id, stats=None, node=None):
+        coro = wait_for_guest_ip(vm_id, self.timeout, socket_dir=self.socket_dir, stats=stats, node=node)
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 執行階段計時：記錄各階段耗時、子程序數、傳輸量與重試次數，輸出 JSONL 報告與 Prometheus textfile 指標
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+
+_stack_var = contextvars.ContextVar("run_metrics_stack", default=None)
+_current = None
+_hook_installed = False
+
+# 以 audit hook 計算子程序數，歸屬於目前 context 最內層的階段
+# 階段堆疊存於 ContextVar：run_coroutine_threadsafe 送出的協程沿用呼叫端的 context，
+# 因此 ReadinessWatcher 事件迴圈中的 asyncio 子程序也會計入呼叫端的 ip_wait 階段
+def _audit(event, _args):
+    if event != "subprocess.Popen" or _current is None:
+        return
+    _current.count_subprocess()
+
+def new_run_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+class RunReport:
+    def __init__(self, script, run_id=None, params=None):
+        self.script = script
+        self.run_id = run_id or new_run_id()
+        self.params = params or {}
+        self.started = time.time()
+        self.finished = None
+        self.stages = []
+        self.subprocesses = 0
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = _stack_var.get()
+        if stack is None:
+            stack = []
+            _stack_var.set(stack)
+        return stack
+
+    def count_subprocess(self):
+        with self._lock:
+            self.subprocesses += 1
+        stack = self._stack()
+        if stack:
+            stack[-1]["subprocesses"] += 1
+
+    # 計時單一階段，呼叫端可於 record 中填入 bytes / retries
+    @contextmanager
+    def stage(self, name, vm_id=None):
+        record = {"stage": name, "vm_id": vm_id, "start": time.time(), "wall": 0.0,
+                  "subprocesses": 0, "bytes": 0, "retries": 0, "ok": True, "error": None}
+        stack = self._stack()
+        stack.append(record)
+        t0 = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["ok"] = False
+            record["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            record["wall"] = round(time.perf_counter() - t0, 4)
+            stack.pop()
+            with self._lock:
+                self.stages.append(record)
+
+    # 依階段彙總：次數、總耗時、p50 / p95 / max
+    def summary(self):
+        grouped = {}
+        for record in self.stages:
+            grouped.setdefault(record["stage"], []).append(record)
+        result = {}
+        for name, records in grouped.items():
+            walls = sorted(r["wall"] for r in records)
+            result[name] = {
+                "count": len(records),
+                "failed": sum(1 for r in records if not r["ok"]),
+                "wall_total": round(sum(walls), 4),
+                "p50": walls[len(walls) // 2],
+                "p95": walls[min(len(walls) - 1, int(len(walls) * 0.95))],
+                "max": walls[-1],
+                "subprocesses": sum(r["subprocesses"] for r in records),
+                "bytes": sum(r["bytes"] for r in records),
+                "retries": sum(r["retries"] for r in records),
+            }
+        return result
+
+    def as_dict(self):
+        return {"run_id": self.run_id, "script": self.script, "params": self.params,
+                "started": self.started, "finished": self.finished,
+                "wall": round((self.finished or time.time()) - self.started, 4),
+                "subprocesses": self.subprocesses, "summary": self.summary(), "stages": self.stages}
+
+    # 追加一行 JSON 至報告檔（每次執行一行，方便長期統計延遲百分位）
+    def write_jsonl(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a") as f:
+            f.write(json.dumps(self.as_dict(), ensure_ascii=False, default=str) + "\n")
+
+    # 輸出 node_exporter textfile collector 格式（先寫暫存檔再原子替換）
+    def write_prometheus(self, path):
+        path = Path(path)
+        lines = [
+            "# HELP kali_provision_stage_seconds 各階段耗時總和（最近一次執行）",
+            "# TYPE kali_provision_stage_seconds gauge",
+        ]
+        summary = self.summary()
+        for name, s in summary.items():
+            lines.append(f'kali_provision_stage_seconds{{script="{self.script}",stage="{name}"}} {s["wall_total"]}')
+        for metric, key, help_text in (
+                ("kali_provision_stage_count", "count", "各階段執行次數"),
+                ("kali_provision_stage_p95_seconds", "p95", "各階段耗時 p95"),
+                ("kali_provision_stage_subprocesses", "subprocesses", "各階段啟動的子程序數"),
+                ("kali_provision_stage_bytes", "bytes", "各階段傳輸位元組數"),
+                ("kali_provision_stage_retries", "retries", "各階段重試次數")):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for name, s in summary.items():
+                lines.append(f'{metric}{{script="{self.script}",stage="{name}"}} {s[key]}')
+        lines += [
+            "# HELP kali_provision_run_seconds 整體執行耗時",
+            "# TYPE kali_provision_run_seconds gauge",
+            f'kali_provision_run_seconds{{script="{self.script}"}} {self.as_dict()["wall"]}',
+            "# HELP kali_provision_last_run_timestamp_seconds 最近一次執行完成時間",
+            "# TYPE kali_provision_last_run_timestamp_seconds gauge",
+            f'kali_provision_last_run_timestamp_seconds{{script="{self.script}"}} {self.finished or time.time():.0f}',
+        ]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        tmp.replace(path)
+
+    def finish(self, jsonl_path=None, prom_path=None):
+        self.finished = time.time()
+        for writer, target in ((self.write_jsonl, jsonl_path), (self.write_prometheus, prom_path)):
+            if not target:
+                continue
+            try:
+                writer(target)
+                print(f"[INFO] 執行報告已寫入：{target}")
+            except OSError as e:
+                print(f"[WARN] 無法寫入執行報告 {target}：{e}")
+
+# 開始一次執行的紀錄，之後 stage() 皆歸入此報告
+def start_run(script, run_id=None, params=None):
+    global _current, _hook_installed
+    _current = RunReport(script, run_id, params)
+    if not _hook_installed:
+        sys.addaudithook(_audit)
+        _hook_installed = True
+    return _current
+
+def current_run():
+    return _current
+
+# 未呼叫 start_run 時 stage() 僅回傳暫存 record，不做紀錄
+@contextmanager
+def stage(name, vm_id=None):
+    if _current is None:
+        yield {"bytes": 0, "retries": 0}
+        return
+    with _current.stage(name, vm_id) as record:
+        yield record
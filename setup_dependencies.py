@@ -1,79 +1,331 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 # Proxmox 每日自動更新與 Python 套件維護任務（全自動化）+ 日誌紀錄
+# apt 與 pip 兩個階段並行執行；pip 套件先與索引的最新版本比對，只有過期或缺少時才以單次 pip 呼叫安裝，
+# 並保留本機 wheel 快取，避免每晚重新下載；日誌為單一 JSON lines 檔（maintenance.jsonl），依大小與天數輪替壓縮
 
-import subprocess
-import shutil
-import sys
 import os
+import sys
+import json
+import time
+import gzip
+import uuid
+import shutil
+import argparse
+import threading
+import subprocess
+import urllib.request
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata
+
+APT_PACKAGES = ["unar"]
+# 以發行套件名稱（distribution name）列出，版本由 importlib.metadata 查詢，不需對應 import 名稱
+PIP_PACKAGES = ["requests", "urllib3", "idna", "certifi", "setuptools", "wheel", "openai", "proxmoxer"]
+LOG_DIR = Path("/root/update_log")
+LOG_NAME = "maintenance.jsonl"
+LOG_MAX_BYTES = 5 * 1024 * 1024   # 超過即輪替
+LOG_MAX_AGE_DAYS = 30             # 目前日誌最舊紀錄超過此天數即輪替
+LOG_KEEP_DAYS = 180               # 輪替後的壓縮檔（與舊版 *.log）保留天數
+LOG_BUFFER = 64 * 1024
+WHEEL_CACHE = Path(os.environ.get("PIP_WHEEL_CACHE", "/var/cache/kali-pip"))
+# PyPI JSON API（/<name>/json 回傳 info.version），離線測試可指向 fake_pypi_index.py
+VERSION_INDEX = os.environ.get("PIP_VERSION_INDEX", "https://pypi.org/pypi")
+INDEX_TIMEOUT = 10
+
+LOG = None
+_phase = threading.local()
+
+# 維護日誌：整次執行只開啟一個緩衝寫入的檔案，每筆紀錄一行 JSON（ts / run / phase / event / msg 及附加欄位）
+class MaintenanceLog:
+    def __init__(self, log_dir=LOG_DIR, quiet=False, max_bytes=LOG_MAX_BYTES, max_age_days=LOG_MAX_AGE_DAYS,
+                 keep_days=LOG_KEEP_DAYS):
+        self.dir = Path(log_dir)
+        self.path = self.dir / LOG_NAME
+        self.quiet = quiet
+        self.max_bytes = max_bytes
+        self.max_age = timedelta(days=max_age_days)
+        self.keep = timedelta(days=keep_days)
+        self.run_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.rotate()
+        self.prune()
+        self._file = open(self.path, "a", buffering=LOG_BUFFER)
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self._file.close()
+
+    # 目前日誌超過大小或最舊紀錄超過天數時，壓縮為 maintenance-<時間>.jsonl.gz 並另起新檔
+    def rotate(self, now=None):
+        now = now or datetime.now()
+        try:
+            size = self.path.stat().st_size
+        except OSError:
+            return None
+        first = read_records(self.path, limit=1)
+        started = parse_ts(first[0]["ts"]) if first else now
+        if size < self.max_bytes and now - started < self.max_age:
+            return None
+        archive = self.dir / f"maintenance-{now.strftime('%Y%m%d_%H%M%S')}.jsonl.gz"
+        with open(self.path, "rb") as src, gzip.open(archive, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        self.path.unlink()
+        return archive
+
+    # 刪除超過保留天數的壓縮檔與舊版每次執行產生的 *.log
+    def prune(self, now=None):
+        cutoff = (now or datetime.now()) - self.keep
+        removed = []
+        for path in [*self.dir.glob("maintenance-*.jsonl.gz"), *self.dir.glob("*.log")]:
+            if datetime.fromtimestamp(path.stat().st_mtime) < cutoff:
+                path.unlink()
+                removed.append(path)
+        return removed
+
+    def write(self, event, msg=None, **fields):
+        record = {"ts": datetime.now().isoformat(timespec="milliseconds"), "run": self.run_id,
+                  "phase": getattr(_phase, "name", None), "event": event}
+        if msg is not None:
+            record["msg"] = msg
+        record.update(fields)
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if not self.quiet and msg is not None:
+                print(f"[{record['ts'][:19].replace('T', ' ')}] {msg}")
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
 
 def log(msg):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{timestamp}] {msg}")
-    with open(LOG_FILE, "a") as f:
-        f.write(f"[{timestamp}] {msg}\n")
+    if LOG is None:
+        print(msg)
+    else:
+        LOG.write("message", msg)
+
+# 執行指令並把輸出與結束碼記為一筆紀錄（兩個階段並行時各自擷取，避免輸出交錯）
+def run_logged(cmd, check=True):
+    t0 = time.monotonic()
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if LOG is not None:
+        LOG.write("command", cmd=cmd, exit_code=proc.returncode, duration=round(time.monotonic() - t0, 3),
+                  output=proc.stdout)
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return proc
 
 def run_apt_upgrade():
     log("🔧 正在更新 Proxmox 主機套件 ...")
-    subprocess.run(["apt", "update"], check=True, stdout=log_file, stderr=log_file)
-    subprocess.run(["apt", "upgrade", "-y"], check=True, stdout=log_file, stderr=log_file)
-    log("✅ 系統更新完成")
+    run_logged(["apt", "update"])
+    upgradable = [line for line in run_logged(["apt", "list", "--upgradable"]).stdout.splitlines() if "/" in line]
+    if upgradable:
+        run_logged(["apt", "upgrade", "-y"])
+        log(f"✅ 系統更新完成（{len(upgradable)} 個套件）")
+    else:
+        log("[SKIP] 系統套件皆為最新版本")
 
 def ensure_apt_package(pkg_name):
     if shutil.which(pkg_name) is None:
         log(f"[INFO] 安裝系統套件: {pkg_name}")
-        subprocess.run(["apt", "install", "-y", pkg_name], check=True, stdout=log_file, stderr=log_file)
+        run_logged(["apt", "install", "-y", pkg_name])
     else:
         log(f"[OK] 系統套件 {pkg_name} 已安裝")
 
-def ensure_pip_package(pkg_name):
+def installed_version(dist):
     try:
-        __import__(pkg_name)
-        log(f"[OK] Python 模組 {pkg_name} 已存在")
-    except ImportError:
-        log(f"[INFO] 尚未安裝 Python 模組: {pkg_name}，執行安裝...")
-        try:
-            subprocess.run([
-                sys.executable, "-m", "pip", "install", "--no-cache-dir",
-                "--break-system-packages", pkg_name
-            ], check=True, stdout=log_file, stderr=log_file)
-            log(f"[OK] 成功安裝 Python 模組: {pkg_name}")
-        except subprocess.CalledProcessError:
-            log(f"[ERROR] 模組 {pkg_name} 安裝失敗，請手動檢查")
+        return metadata.version(dist)
+    except metadata.PackageNotFoundError:
+        return None
 
-def upgrade_python_packages():
-    log("📦 升級 pip 與核心 Python 套件 ...")
-    try:
-        subprocess.run([
-            sys.executable, "-m", "pip", "install", "--upgrade", "pip",
-            "--no-cache-dir", "--break-system-packages"
-        ], check=True, stdout=log_file, stderr=log_file)
-    except subprocess.CalledProcessError:
-        log("[ERROR] pip 升級失敗，跳過此步驟")
-
-    packages = ["requests", "urllib3", "idna", "certifi", "setuptools", "wheel"]
+# 向索引查詢最新版本
+def latest_version(dist, index=VERSION_INDEX):
+    with urllib.request.urlopen(f"{index.rstrip('/')}/{dist}/json", timeout=INDEX_TIMEOUT) as resp:
+        return json.load(resp)["info"]["version"]
+
+# 回傳需要安裝或升級的套件：{名稱: (已安裝版本, 最新版本)}；查詢失敗的套件視為需要更新，交由 pip 判斷
+def outdated_packages(packages, index=VERSION_INDEX):
+    latest = {}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = {pkg: pool.submit(latest_version, pkg, index) for pkg in packages}
+    for pkg, future in futures.items():
+        try:
+            latest[pkg] = future.result()
+        except (OSError, ValueError, KeyError) as e:
+            log(f"[WARN] 無法查詢 {pkg} 的最新版本：{e}")
+            latest[pkg] = None
+    outdated = {}
     for pkg in packages:
+        current = installed_version(pkg)
+        if current is None or latest[pkg] is None or current != latest[pkg]:
+            outdated[pkg] = (current, latest[pkg])
+        else:
+            log(f"[OK] Python 套件 {pkg} {current} 已是最新版本")
+    return outdated
+
+def pip_install(packages):
+    WHEEL_CACHE.mkdir(parents=True, exist_ok=True)
+    run_logged([sys.executable, "-m", "pip", "install", "--upgrade",
+                "--cache-dir", str(WHEEL_CACHE), "--break-system-packages", *packages])
+
+def upgrade_python_packages(packages=PIP_PACKAGES, index=VERSION_INDEX, dry_run=False):
+    log("📦 比對 pip 與 Python 套件版本 ...")
+    # pip 本身先升級，讓後續的單次安裝使用新版解析器
+    pip_outdated = outdated_packages(["pip"], index)
+    outdated = outdated_packages(list(packages), index)
+    for pkg, (current, latest) in {**pip_outdated, **outdated}.items():
+        log(f"[INFO] {pkg}: {current or '未安裝'} → {latest or '最新版本'}")
+    if LOG is not None:
+        LOG.write("outdated", packages={pkg: {"installed": c, "latest": l}
+                                        for pkg, (c, l) in {**pip_outdated, **outdated}.items()})
+    if dry_run:
+        log("[SKIP] --dry-run：不執行 pip 安裝")
+        return
+    if pip_outdated:
         try:
-            subprocess.run([
-                sys.executable, "-m", "pip", "install", "--upgrade", pkg,
-                "--no-cache-dir", "--break-system-packages"
-            ], check=True, stdout=log_file, stderr=log_file)
+            pip_install(["pip"])
         except subprocess.CalledProcessError:
-            log(f"[ERROR] 套件 {pkg} 升級失敗，繼續下一項")
-    log("✅ Python 核心套件升級流程完成")
+            log("[ERROR] pip 升級失敗，沿用現有版本")
+    if not outdated:
+        log("[SKIP] Python 套件皆為最新版本")
+        return
+    pip_install(sorted(outdated))
+    log(f"✅ Python 套件安裝完成：{', '.join(sorted(outdated))}")
+
+def apt_phase(dry_run=False):
+    if dry_run:
+        missing = [p for p in APT_PACKAGES if shutil.which(p) is None]
+        log(f"[SKIP] --dry-run：不執行 apt（缺少：{', '.join(missing) or '無'}）")
+        return
+    run_apt_upgrade()
+    for pkg in APT_PACKAGES:
+        ensure_apt_package(pkg)
+
+# 執行單一階段並記錄耗時，回傳是否成功
+def timed_phase(name, func, *args):
+    _phase.name = name
+    t0 = time.monotonic()
+    try:
+        func(*args)
+        ok = True
+    except Exception as e:
+        log(f"[ERROR] {name} 階段失敗：{e}")
+        ok = False
+    duration = time.monotonic() - t0
+    log(f"[INFO] {name} 階段{'完成' if ok else '失敗'}（{duration:.1f} 秒）")
+    if LOG is not None:
+        LOG.write("phase", ok=ok, duration=round(duration, 3))
+        LOG.flush()
+    _phase.name = None
+    return ok
+
+def parse_ts(value):
+    return datetime.fromisoformat(value)
+
+# 讀取 JSON lines（支援 .gz），略過無法解析的行
+def read_records(path, limit=None):
+    records = []
+    opener = gzip.open if str(path).endswith(".gz") else open
+    try:
+        with opener(path, "rt") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+                if limit and len(records) >= limit:
+                    break
+    except OSError:
+        pass
+    return records
+
+# 彙整 since ~ until（含）之間的每次維護執行：各階段耗時與結果、失敗指令、安裝的套件
+def summarize_runs(log_dir=LOG_DIR, since=None, until=None):
+    log_dir = Path(log_dir)
+    runs = {}
+    for path in [*sorted(log_dir.glob("maintenance-*.jsonl.gz")), log_dir / LOG_NAME]:
+        for record in read_records(path):
+            ts = parse_ts(record["ts"])
+            if (since and ts.date() < since) or (until and ts.date() > until):
+                continue
+            run = runs.setdefault(record["run"], {"run": record["run"], "start": record["ts"], "ok": None,
+                                                  "duration": None, "phases": {}, "failed_commands": [],
+                                                  "outdated": []})
+            event = record.get("event")
+            if event == "phase":
+                run["phases"][record["phase"]] = {"ok": record["ok"], "duration": record["duration"]}
+            elif event == "command" and record.get("exit_code"):
+                run["failed_commands"].append({"cmd": " ".join(record["cmd"]), "exit_code": record["exit_code"]})
+            elif event == "outdated":
+                run["outdated"] = sorted(record["packages"])
+            elif event == "run":
+                run["ok"], run["duration"] = record["ok"], record["duration"]
+    return sorted(runs.values(), key=lambda r: r["start"])
+
+def print_summary(runs):
+    print(f"{'開始時間':<21}{'執行 ID':<14}{'結果':<6}{'總耗時(s)':>10}{'apt(s)':>9}{'pip(s)':>9}  更新套件")
+    for r in runs:
+        status = "-" if r["ok"] is None else ("OK" if r["ok"] else "FAIL")
+        phases = [r["phases"].get(p, {}).get("duration") for p in ("apt", "pip")]
+        cols = "".join(f"{'-' if d is None else format(d, '.1f'):>9}" for d in phases)
+        total = "-" if r["duration"] is None else format(r["duration"], ".1f")
+        print(f"{r['start'][:19].replace('T', ' '):<21}{r['run']:<14}{status:<6}{total:>10}{cols}  "
+              f"{', '.join(r['outdated']) or '-'}")
+        for failed in r["failed_commands"]:
+            print(f"{'':<21}[ERROR] {failed['cmd']}（結束碼 {failed['exit_code']}）")
+    failures = sum(1 for r in runs if r["ok"] is False)
+    durations = [r["duration"] for r in runs if r["duration"] is not None]
+    avg = f"{sum(durations) / len(durations):.1f}" if durations else "-"
+    print(f"\n[INFO] 共 {len(runs)} 次執行，失敗 {failures} 次，平均耗時 {avg} 秒")
+
+def _date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式應為 YYYY-MM-DD：{value}")
 
 if __name__ == "__main__":
-    log_dir = Path("/root/update_log")
-    log_dir.mkdir(parents=True, exist_ok=True)
-    log_name = datetime.now().strftime("%Y%m%d_%H%M%S") + ".log"
-    LOG_FILE = log_dir / log_name
-
-    with open(LOG_FILE, "a") as log_file:
-        run_apt_upgrade()
-        ensure_apt_package("unar")
-        upgrade_python_packages()
-        ensure_pip_package("openai")
-        ensure_pip_package("proxmoxer")
-        ensure_pip_package("requests")
+    parser = argparse.ArgumentParser(description="Proxmox 主機每日套件維護（apt 與 pip 並行）")
+    parser.add_argument("--skip-apt", action="store_true", help="略過 apt 更新與系統套件安裝")
+    parser.add_argument("--skip-pip", action="store_true", help="略過 Python 套件維護")
+    parser.add_argument("--index", default=VERSION_INDEX, help="版本比對用的 PyPI JSON API（PIP_VERSION_INDEX）")
+    parser.add_argument("--dry-run", action="store_true", help="只比對版本並列出需要更新的項目")
+    parser.add_argument("--log-dir", default=str(LOG_DIR), help="日誌目錄")
+    parser.add_argument("--log-max-mb", type=float, default=LOG_MAX_BYTES / 1024 / 1024, help="日誌超過此大小（MiB）即輪替")
+    parser.add_argument("--log-max-age", type=int, default=LOG_MAX_AGE_DAYS, help="日誌最舊紀錄超過此天數即輪替")
+    parser.add_argument("--log-keep", type=int, default=LOG_KEEP_DAYS, help="輪替後壓縮檔的保留天數")
+    parser.add_argument("--quiet", action="store_true", help="不輸出到終端機（供 cron 使用，紀錄只寫入日誌）")
+    parser.add_argument("--summary", action="store_true", help="彙整日誌中的維護執行紀錄，不執行維護")
+    parser.add_argument("--since", type=_date, help="--summary 的起始日期（YYYY-MM-DD）")
+    parser.add_argument("--until", type=_date, help="--summary 的結束日期（YYYY-MM-DD，含當日）")
+    parser.add_argument("--json", action="store_true", help="--summary 以 JSON 輸出")
+    args = parser.parse_args()
+
+    if args.summary:
+        runs = summarize_runs(args.log_dir, args.since, args.until)
+        if args.json:
+            print(json.dumps(runs, ensure_ascii=False, indent=2))
+        else:
+            print_summary(runs)
+        sys.exit(0)
+
+    phases = []
+    if not args.skip_apt:
+        phases.append(("apt", apt_phase, args.dry_run))
+    if not args.skip_pip:
+        phases.append(("pip", upgrade_python_packages, PIP_PACKAGES, args.index, args.dry_run))
+    with MaintenanceLog(args.log_dir, args.quiet, int(args.log_max_mb * 1024 * 1024), args.log_max_age,
+                        args.log_keep) as LOG:
+        t0 = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, len(phases))) as pool:
+            results = list(pool.map(lambda p: timed_phase(*p), phases))
+        duration = time.monotonic() - t0
+        log(f"[INFO] 維護任務結束，總耗時 {duration:.1f} 秒")
+        LOG.write("run", ok=all(results), duration=round(duration, 3), dry_run=args.dry_run)
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 串流匯入：以 7z -so 解壓縮映像並直接寫入目標儲存的磁碟卷（檔案型儲存不產生中間 qcow2 檔，區塊型儲存以稀疏暫存檔轉換）
+
+import shutil
+import struct
+import subprocess
+from pathlib import Path
+from pve_storage import FILE_STORAGE_TYPES, parse_storage_cfg
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# 確保 7z 可用（套件名稱為 p7zip-full）
+def ensure_7z_available():
+    if shutil.which("7z") is None:
+        print("[INFO] 未安裝 7z，正在安裝 p7zip-full ...")
+        subprocess.run(["apt", "update"], check=True)
+        subprocess.run(["apt", "install", "-y", "p7zip-full"], check=True)
+
+# 找出壓縮檔中的 qcow2 成員名稱
+def find_qcow2_member(archive):
+    result = subprocess.run(["7z", "l", "-slt", str(archive)], stdout=subprocess.PIPE, text=True, check=True)
+    for line in result.stdout.splitlines():
+        if line.startswith("Path = ") and line.endswith(".qcow2"):
+            return line[len("Path = "):]
+    raise RuntimeError("找不到壓縮檔中的 qcow2 映像")
+
+# 解壓縮指定成員並寫入 dest，全零區塊以 seek 略過（產生稀疏檔），回傳寫入位元組數
+def stream_extract(archive, member, dest):
+    proc = subprocess.Popen(["7z", "x", "-so", str(archive), member],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    zero = bytes(CHUNK_SIZE)
+    offset = 0
+    try:
+        with open(dest, "wb") as out:
+            while True:
+                chunk = proc.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if chunk == zero[:len(chunk)]:
+                    out.seek(len(chunk), 1)
+                else:
+                    out.write(chunk)
+                offset += len(chunk)
+            out.truncate(offset)
+    except BaseException:
+        # 寫入失敗（如磁碟已滿）時先結束 7z，保留原本的例外
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"7z 解壓縮失敗（結束碼 {proc.returncode}）")
+    return offset
+
+# 由 qcow2 標頭讀取虛擬磁碟大小（bytes），位於第 24 位元組的 64-bit big-endian 整數
+def qcow2_virtual_size(path):
+    with open(path, "rb") as f:
+        header = f.read(32)
+    if header[:4] != b"QFI\xfb":
+        raise RuntimeError(f"{path} 不是 qcow2 映像")
+    return struct.unpack(">Q", header[24:32])[0]
+
+def _pvesm_path(volume):
+    result = subprocess.run(["pvesm", "path", volume], stdout=subprocess.PIPE, text=True, check=True)
+    return Path(result.stdout.strip())
+
+# 將壓縮檔中的 qcow2 直接匯入 vm_id 的第一顆磁碟，回傳 volume ID（例如 local-lvm:vm-9000-disk-0）
+def stream_import_disk(vm_id, archive, storage, scratch_dir, storage_cfg=None):
+    ensure_7z_available()
+    member = find_qcow2_member(archive)
+    kind = (storage_cfg if storage_cfg is not None else parse_storage_cfg()).get(storage, {}).get("type")
+
+    if kind in FILE_STORAGE_TYPES:
+        # 檔案型儲存：解壓縮結果即為最終 qcow2 磁碟卷，不需再經 importdisk 複製
+        volume = f"{storage}:{vm_id}/vm-{vm_id}-disk-0.qcow2"
+        target = _pvesm_path(volume)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        print(f"[INFO] 串流解壓縮 {member} → {target}")
+        stream_extract(archive, member, target)
+        return volume
+
+    # 區塊型儲存：qcow2 需可隨機存取才能轉換，仍須先解壓至 scratch_dir 的稀疏暫存檔，轉入磁碟卷後立即刪除
+    scratch = Path(scratch_dir) / f".stream-{vm_id}.qcow2"
+    volume = None
+    try:
+        print(f"[INFO] 串流解壓縮 {member} → {scratch}")
+        stream_extract(archive, member, scratch)
+        size_kib = -(-qcow2_virtual_size(scratch) // 1024)
+        result = subprocess.run(["pvesm", "alloc", storage, str(vm_id), f"vm-{vm_id}-disk-0", str(size_kib)],
+                                stdout=subprocess.PIPE, text=True, check=True)
+        volume = result.stdout.strip().split("'")[1] if "'" in result.stdout else f"{storage}:vm-{vm_id}-disk-0"
+        target = _pvesm_path(volume)
+        print(f"[INFO] 轉換並寫入磁碟卷 {volume}")
+        subprocess.run(["qemu-img", "convert", "-p", "-n", "-f", "qcow2", "-O", "raw", str(scratch), str(target)],
+                       check=True)
+    except BaseException:
+        # 轉換失敗時釋放已配置的磁碟卷，避免留下未掛載的孤立磁碟
+        if volume:
+            subprocess.run(["pvesm", "free", volume])
+        raise
+    finally:
+        scratch.unlink(missing_ok=True)
+    return volume
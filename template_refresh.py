@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 增量更新黃金映像：以目前模板 full clone 出暫存 VM，開機後透過 guest agent 執行 apt full-upgrade，
+# 關機後直接轉為新版本模板，不需重新下載與匯入數 GB 的映像；失敗時由呼叫端改走完整重建
+
+from pve_backend import get_backend
+from clone_planner import template_disk
+from vm_config_plan import ConfigPlan
+from kali_release import version_key
+from qga_readiness import run_guest_command, wait_for_ips
+from run_metrics import stage as measure
+
+UPGRADE_TIMEOUT = 3600
+SHUTDOWN_TIMEOUT = 120
+# 非互動升級，保留既有設定檔；清除 machine-id 讓由新模板 clone 出的 VM 各自取得 DHCP 租約
+UPGRADE_SCRIPT = (
+    "export DEBIAN_FRONTEND=noninteractive && apt-get update && "
+    "apt-get -y -o Dpkg::Options::=--force-confdef -o Dpkg::Options::=--force-confold full-upgrade && "
+    "apt-get -y autoremove --purge && apt-get clean"
+)
+RESET_SCRIPT = "truncate -s 0 /etc/machine-id && rm -f /var/lib/dbus/machine-id && sync"
+
+def _guest(vm_id, script, timeout):
+    exitcode, stdout, stderr = run_guest_command(vm_id, ["/bin/sh", "-c", script], timeout)
+    if exitcode != 0:
+        tail = (stderr or stdout).strip().splitlines()[-5:]
+        raise RuntimeError(f"[ERROR] VM {vm_id} 執行失敗（結束碼 {exitcode}）：{' / '.join(tail)}")
+    return stdout
+
+# 解析 /etc/os-release 的 VERSION（Kali 為 2025.2 形式）
+def guest_version(vm_id):
+    for line in _guest(vm_id, "cat /etc/os-release", 30).splitlines():
+        key, _, value = line.partition("=")
+        if key == "VERSION":
+            return value.strip().strip('"') or None
+    return None
+
+def _discard(vm_id):
+    backend = get_backend()
+    try:
+        backend.stop(vm_id)
+    except Exception:
+        pass
+    try:
+        backend.destroy(vm_id)
+        print(f"[INFO] 已刪除暫存 VM {vm_id}")
+    except Exception as e:
+        print(f"[WARN] 刪除暫存 VM {vm_id} 失敗，請手動處理：{e}")
+
+# 由 base_id 模板產生 version 版本的新模板（VM ID 為 vm_id）；失敗時清除暫存 VM 並拋出例外
+def refresh_template(base_id, vm_id, version, ip_timeout=300, upgrade_timeout=UPGRADE_TIMEOUT):
+    backend = get_backend()
+    storage = template_disk(base_id)[0]
+    print(f"[INFO] 增量更新：由模板 {base_id} 建立暫存 VM {vm_id}，升級至 Kali {version}")
+    try:
+        with measure("refresh_clone", vm_id):
+            backend.clone(base_id, vm_id, f"kali-template-{version}",
+                          ["--full", "1", "--storage", storage, "--description", f"Kali Golden Image Template {version}"])
+        ConfigPlan(vm_id).want(agent="enabled=1").apply(backend)
+        with measure("refresh_boot", vm_id):
+            backend.start(vm_id)
+            if not wait_for_ips([vm_id], ip_timeout).get(vm_id):
+                raise RuntimeError(f"[ERROR] 暫存 VM {vm_id} 未於 {ip_timeout} 秒內連上網路，無法執行 apt")
+        with measure("refresh_upgrade", vm_id):
+            _guest(vm_id, UPGRADE_SCRIPT, upgrade_timeout)
+        detected = guest_version(vm_id)
+        if detected is None:
+            raise RuntimeError(f"[ERROR] 暫存 VM {vm_id} 的 /etc/os-release 沒有 VERSION，無法確認升級結果")
+        if version_key(detected) < version_key(version):
+            raise RuntimeError(f"[ERROR] 升級後版本為 {detected}，仍低於 {version}（鏡像站可能尚未同步）")
+        _guest(vm_id, RESET_SCRIPT, 60)
+        with measure("refresh_shutdown", vm_id):
+            try:
+                backend.shutdown(vm_id, SHUTDOWN_TIMEOUT)
+            except Exception as e:
+                print(f"[WARN] 暫存 VM {vm_id} 未正常關機，改為強制停止：{e}")
+                backend.stop(vm_id)
+        backend.template(vm_id)
+    except BaseException:
+        _discard(vm_id)
+        raise
+    print(f"[OK] 增量更新完成：模板 VM {vm_id}（Kali {version}）")
+    return vm_id
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 黃金映像模板登錄表：以 Kali 版本與映像 SHA256 為鍵，保留多個版本化模板並以 LRU 淘汰未使用者
+
+import json
+import time
+import fcntl
+from pathlib import Path
+from contextlib import contextmanager
+from kali_release import version_key
+from vm_id_allocator import PVE_CONFIG_ROOT
+from vm_inventory import load_inventory
+
+REGISTRY_NAME = ".templates.json"  # 與 .kali_version 放在同一工作目錄
+TEMPLATE_BASE_ID = 9000
+TEMPLATE_SLOTS = 10                # 預設保留 9000–9009
+
+# 檢查是否仍有 linked clone 引用此模板的 base 磁碟
+def template_in_use(template_id, config_root=None):
+    return bool(load_inventory(config_root).linked_clones(template_id))
+
+def template_exists(template_id, config_root=None):
+    return (Path(config_root or PVE_CONFIG_ROOT) / "qemu-server" / f"{template_id}.conf").exists()
+
+class TemplateRegistry:
+    def __init__(self, workdir, base_id=TEMPLATE_BASE_ID, slots=TEMPLATE_SLOTS, config_root=None):
+        self.workdir = Path(workdir)
+        self.path = self.workdir / REGISTRY_NAME
+        self.base_id = base_id
+        self.slots = slots
+        self.config_root = config_root
+        self.entries = []
+
+    # 鎖定登錄表（涵蓋檢查與建置期間），避免兩個流程同時建置同一版本
+    @contextmanager
+    def locked(self):
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        with self.path.with_suffix(".lock").open("a+") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                self.load()
+                yield self
+                self.save()
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    # 載入登錄表並移除模板 VM 已不存在的紀錄
+    def load(self):
+        try:
+            self.entries = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.entries = []
+        self.entries = [e for e in self.entries if template_exists(e["vm_id"], self.config_root)]
+        return self.entries
+
+    def save(self):
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.entries, indent=2))
+        tmp.replace(self.path)
+
+    # 將舊版單一模板（ID 9000 + .kali_version）納入登錄表
+    def adopt_legacy(self, template_id, version_file):
+        if any(e["vm_id"] == template_id for e in self.entries):
+            return
+        if not template_exists(template_id, self.config_root) or not Path(version_file).exists():
+            return
+        version = Path(version_file).read_text().strip()
+        print(f"[INFO] 將既有模板 VM {template_id}（Kali {version}）納入登錄表")
+        self.register(template_id, version, None, None)
+
+    def find(self, version=None, sha256=None):
+        for entry in self.entries:
+            if version is not None and entry["version"] == version:
+                return entry
+            if sha256 is not None and entry.get("sha256") == sha256:
+                return entry
+        return None
+
+    def latest(self):
+        return max(self.entries, key=lambda e: version_key(e["version"]), default=None)
+
+    def touch(self, vm_id):
+        for entry in self.entries:
+            if entry["vm_id"] == vm_id:
+                entry["last_used"] = time.time()
+
+    def register(self, vm_id, version, sha256, image_dir):
+        self.entries = [e for e in self.entries if e["vm_id"] != vm_id]
+        entry = {"vm_id": vm_id, "version": version, "sha256": sha256,
+                 "image_dir": str(image_dir) if image_dir else None,
+                 "created": time.time(), "last_used": time.time()}
+        self.entries.append(entry)
+        return entry
+
+    # 取得可用的模板 ID；槽位已滿時淘汰最久未使用且無 linked clone 的模板，回傳 (vm_id, 被淘汰的紀錄或 None)
+    def allocate_slot(self):
+        registered = {e["vm_id"] for e in self.entries}
+        for vm_id in range(self.base_id, self.base_id + self.slots):
+            if vm_id not in registered and not template_exists(vm_id, self.config_root):
+                return vm_id, None
+        candidates = sorted((e for e in self.entries if self.base_id <= e["vm_id"] < self.base_id + self.slots),
+                            key=lambda e: e.get("last_used", 0))
+        for entry in candidates:
+            if not template_in_use(entry["vm_id"], self.config_root):
+                self.entries.remove(entry)
+                return entry["vm_id"], entry
+        raise RuntimeError(f"[ERROR] 模板槽位 {self.base_id}–{self.base_id + self.slots - 1} 皆在使用中，無法建立新模板")
@@ -2,104 +2,51 @@
 # -*- coding: utf-8 -*-
 # 自動化建立 Kali Linux VM 腳本，加入 NLP 指令解析（OpenAI GPT）支援
 
-import os
 import re
 import sys
-import json
 import time
 import shutil
 import subprocess
 import argparse
-import requests
-import openai
 from pathlib import Path
-
-TEMPLATE_ID = 9000  # 固定的黃金映像 VM ID
-
-# ========== 檢查 unar ==========
-def ensure_unar_available():
-    if shutil.which("unar") is not None:
-        return  # OK
-    print("[WARN] 系統缺少 unar，正在嘗試執行 setup_dependencies.py 自動修復...")
-    setup_path = Path("/root/setup_dependencies.py")
-    if not setup_path.exists():
-        print("[ERROR] 找不到 /root/setup_dependencies.py，無法自動安裝 unar，請手動修復")
-        sys.exit(1)
-    try:
-        subprocess.run(["python3", str(setup_path)], check=True)
-    except subprocess.CalledProcessError:
-        print("[ERROR] 嘗試執行 setup_dependencies.py 修復 unar 失敗，請手動檢查")
-        sys.exit(1)
-    if shutil.which("unar") is None:
-        print("[ERROR] unar 套件仍未安裝成功，請手動安裝後重試")
-        sys.exit(1)
-    print("[OK] unar 安裝成功，繼續執行")
+from vm_id_allocator import snapshot_used_ids
+from kali_release import KALI_BASE_URL, DEFAULT_TTL, get_latest_release
+from run_metrics import start_run, stage as measure
+from pve_backend import configure_backend, get_backend
+from vm_config_plan import ConfigPlan
+from vm_inventory import load_inventory
+from pve_storage import convert_to_gb
+from nlp_parser import NlpParser, NlpCache, make_backend
+from template_registry import TEMPLATE_SLOTS
+from auto_build_kali_vm import ensure_template
 
 # ========== 自然語言轉 CLI 參數 ==========
-def parse_nlp_to_args(nlp_instruction: str):
-    prompt = f"""
-將以下自然語言指令轉換為 JSON 格式參數，對應 CLI 指令中：
---count、--name、--description、--min-mem、--max-mem、--cpu、--bridge、--vlan、--resize、--storage
-
-輸入：「{nlp_instruction}」
-
-請輸出如下：
-{{
-  "count": 1,
-  "name": ["kali-nlp"],
-  "description": "Kali NLP VM",
-  "min_mem": 4096,
-  "max_mem": 8192,
-  "cpu": 2,
-  "bridge": "vmbr0",
-  "vlan": null,
-  "resize": "+0G",
-  "storage": "local-lvm"
-}}
-只輸出純 JSON。
-"""
+# 依序查詢快取 → 規則解析 → 模型（--nlp-backend），重複的指令直接由快取回傳
+def parse_nlp_to_args(nlp_instruction: str, args=None):
+    backend = make_backend(getattr(args, "nlp_backend", None), getattr(args, "nlp_url", None),
+                           getattr(args, "nlp_model", None))
+    cache_path = getattr(args, "nlp_cache", None) or Path(getattr(args, "workdir", ".")) / ".nlp_cache.json"
+    parser = NlpParser(backend, NlpCache(cache_path), use_rules=not getattr(args, "no_nlp_rules", False))
+    started = time.monotonic()
     try:
-        res = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "你是參數轉換助手，幫助將中文指令轉成 CLI 所需格式。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0
-        )
+        with measure("nlp_parse") as record:
+            result, source = parser.parse(nlp_instruction)
+            record["source"] = source
+    except (ValueError, RuntimeError) as e:
+        print(e)
+        sys.exit(1)
     except Exception as e:
-        print(f"[ERROR] 呼叫 OpenAI API 失敗：{e}")
+        print(f"[ERROR] 呼叫 NLP 模型失敗：{e}")
         sys.exit(1)
-    result = json.loads(res['choices'][0]['message']['content'])
-    defaults = {
-        "count": 1,
-        "name": ["kali-nlp"],
-        "description": "Kali NLP VM",
-        "min_mem": 4096,
-        "max_mem": 8192,
-        "cpu": 2,
-        "bridge": "vmbr0",
-        "vlan": None,
-        "resize": "+0G",
-        "storage": "local-lvm"
-    }
-    for key, val in defaults.items():
-        result.setdefault(key, val)
-    print("[INFO] 使用 NLP 轉換後參數：")
+    print(f"[INFO] 使用 NLP 轉換後參數（來源：{source}，{(time.monotonic() - started) * 1000:.0f} ms）：")
     for k, v in result.items():
         print(f"  {k}: {v}")
     return result
 
 # ========== 從官網抓 Kali 最新版本 ==========
-def get_latest_kali_url(base_url: str):
-    response = requests.get(base_url)
-    dirs = sorted(set(re.findall(r'kali-\d+\.\d+[a-z]?/', response.text)), reverse=True)
-    if not dirs:
-        raise RuntimeError("無法取得 Kali 最新版本目錄")
-    kali_dir = dirs[0].strip('/')
-    version = kali_dir.replace("kali-", "")
-    filename = f"kali-linux-{version}-qemu-amd64.7z"
-    return kali_dir, version, filename, f"{base_url}{kali_dir}/{filename}"
+def get_latest_kali_url(base_url: str, cache_dir=None, ttl: int = DEFAULT_TTL, offline: bool = False):
+    with measure("get_latest_kali_url"):
+        return get_latest_release(base_url, cache_dir, ttl, offline)
 
 # ========== 自動安裝依賴 ==========
 def ensure_installed(package_name):
@@ -111,133 +58,44 @@ def ensure_installed(package_name):
         print(f"[SKIP] 已安裝 {package_name}，跳過安裝")
 
 # ========== VM ID 管理 ==========
-def id_in_use(vm_id: int) -> bool:
-    vm_conf = Path(f"/etc/pve/qemu-server/{vm_id}.conf")
-    ct_conf = Path(f"/etc/pve/lxc/{vm_id}.conf")
-    return (
-        subprocess.run(["qm", "status", str(vm_id)], stdout=subprocess.DEVNULL).returncode == 0 or
-        subprocess.run(["pct", "status", str(vm_id)], stdout=subprocess.DEVNULL).returncode == 0 or
-        vm_conf.exists() or
-        ct_conf.exists()
-    )
-
 def find_available_vm_id(start: int = 100):
-    while id_in_use(start):
+    used = snapshot_used_ids()
+    while start in used:
         start += 1
     return start
 
 # ========== 磁碟容量查詢與單位轉換 ==========
 def get_disk_size_gb(vm_id: int, storage: str) -> str:
-    result = subprocess.run(["qm", "config", str(vm_id)], stdout=subprocess.PIPE, text=True)
-    for line in result.stdout.splitlines():
-        if "scsi0:" in line and f"{storage}:" in line:
-            for part in line.split(","):
-                if part.startswith("size="):
-                    return part.split("=")[1]
+    with measure("get_disk_size_gb", vm_id):
+        record = load_inventory(refresh=False).reload(vm_id)
+    disk = record.disk("scsi0") if record else None
+    if disk and disk.storage == storage and disk.size_text:
+        return disk.size_text
     return "未知"
 
-def convert_to_gb(size_str: str) -> str:
-    if size_str.endswith("G"):
-        return size_str
-    elif size_str.endswith("M"):
-        return f"{float(size_str[:-1]) / 1024:.1f}G"
-    elif size_str.endswith("K"):
-        return f"{float(size_str[:-1]) / (1024 * 1024):.2f}G"
-    return size_str
-
 # ========== 取得 VM 啟動後 IP ==========
-def wait_for_ip(vm_id, retries=50, delay=1):
-    for _ in range(retries):
-        try:
-            result = subprocess.run(
-                ["qm", "guest", "cmd", str(vm_id), "network-get-interfaces"],
-                capture_output=True, text=True, timeout=5
-            )
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                for iface in data:
-                    if iface.get("name") not in ["eth0", "ens18", "ens3", "enp0s3"]:
-                        continue
-                    for ip in iface.get("ip-addresses", []):
-                        if ip.get("ip-address-type") == "ipv4" and ip.get("ip-address") != "127.0.0.1":
-                            return ip.get("ip-address")
-        except Exception:
-            pass
-        time.sleep(delay)
-    return "未知"
-
-# ========== 建立模板 ==========
-def create_template(args, version):
-    vm_id = TEMPLATE_ID
-    working_dir = Path(args.workdir).resolve()
-    kali_dir, _, filename, kali_url = get_latest_kali_url("https://cdimage.kali.org/")
-    iso_path = working_dir / filename
-    version_file = working_dir / ".kali_version"
-
-    working_dir.mkdir(parents=True, exist_ok=True)
-
-    qcow2file = next(working_dir.glob("*.qcow2"), None)
-    if qcow2file:
-        print(f"[INFO] 發現現有的 qcow2 檔案：{qcow2file}，跳過下載與解壓縮")
-    else:
-        print(f"[INFO] 下載 Kali 映像：{kali_url}")
-        subprocess.run(["wget", "-c", "--retry-connrefused", "--tries=5", "--show-progress", kali_url],
-                       check=True, cwd=working_dir)
-        print("[INFO] 清空工作目錄中其他檔案 ...")
-        for f in working_dir.glob("*"):
-            if f.name != filename:
-                f.unlink()
-        print("[INFO] 解壓縮 Kali QEMU 映像 ...")
-        subprocess.run(["unar", "-f", filename], check=True, cwd=working_dir)
-        qcow2file = next(working_dir.glob("*.qcow2"), None)
-        if not qcow2file:
-            raise RuntimeError("找不到解壓後的 qcow2 映像")
-
-    if Path(f"/etc/pve/qemu-server/{vm_id}.conf").exists():
-        print(f"[INFO] 刪除舊的黃金映像 VM（ID {vm_id}）")
-        subprocess.run(["qm", "destroy", str(vm_id)], check=True)
-
-    print("[INFO] 建立黃金映像 VM ...")
-    subprocess.run(["qm", "create", str(vm_id),
-                    "--memory", str(args.max_mem),
-                    "--balloon", str(args.min_mem),
-                    "--cores", str(args.cpu),
-                    "--name", "kali-template",
-                    "--description", "Kali Golden Image Template",
-                    "--net0", f"model=virtio,bridge={args.bridge}",
-                    "--ostype", "l26",
-                    "--machine", "q35"], check=True)
-    subprocess.run(["qm", "importdisk", str(vm_id), str(qcow2file), args.storage, "--format", "qcow2"], check=True)
-    subprocess.run(["qm", "set", str(vm_id), "--scsi0", f"{args.storage}:vm-{vm_id}-disk-0"], check=True)
-    if args.resize != "+0G":
-        subprocess.run(["qm", "resize", str(vm_id), "scsi0", args.resize], check=True)
-    subprocess.run(["qm", "set", str(vm_id), "--boot", "order=scsi0", "--bootdisk", "scsi0"], check=True)
-    subprocess.run(["qm", "template", str(vm_id)], check=True)
-
-    with version_file.open("w") as vf:
-        vf.write(version)
-
-    print(f"[OK] Template VM 已建立完成（ID: {vm_id}）")
+def wait_for_ip(vm_id, timeout=120):
+    from qga_readiness import wait_for_ips
+    return wait_for_ips([vm_id], timeout).get(vm_id) or "未知"
 
 # ========== 複製 VM ==========
-def deploy_vm(args, vm_name, index=None):
+def deploy_vm(args, vm_name, template_id, index=None):
     vm_id = find_available_vm_id(100)
     desc = args.description if index is None else f"{args.description} #{index+1}"
     net = f"model=virtio,firewall=0,bridge={args.bridge}"
     if args.vlan:
         net += f",tag={args.vlan}"
 
-    subprocess.run(["qm", "clone", str(TEMPLATE_ID), str(vm_id), "--name", vm_name], check=True)
-    subprocess.run(["qm", "set", str(vm_id),
-                    "--memory", str(args.max_mem),
-                    "--balloon", str(args.min_mem),
-                    "--cores", str(args.cpu),
-                    "--net0", net,
-                    "--description", desc,
-                    "--agent", "enabled=1"], check=True)
-    subprocess.run(["qm", "start", str(vm_id)], check=True)
-    time.sleep(15)  # 等待 15 秒，確保 Guest Agent 啟動
-    ip = wait_for_ip(vm_id)
+    config = ConfigPlan(vm_id).want(memory=args.max_mem, balloon=args.min_mem, cores=args.cpu,
+                                    net0=net, description=desc, agent="enabled=1")
+    with measure("clone", vm_id):
+        get_backend().clone(template_id, vm_id, vm_name, config.clone_args())
+    with measure("set", vm_id):
+        config.apply()
+    with measure("start", vm_id):
+        get_backend().start(vm_id)
+    with measure("ip_wait", vm_id):
+        ip = wait_for_ip(vm_id)
     disk = get_disk_size_gb(vm_id, args.storage)
 
     return {
@@ -251,15 +109,13 @@ def deploy_vm(args, vm_name, index=None):
 
 # ========== 主程式 ==========
 if __name__ == "__main__":
-    try:
-        import openai
-    except ImportError:
-        print("[ERROR] 尚未安裝 openai 模組，請執行：pip install openai")
-        sys.exit(1)
-    ensure_unar_available()
-
     parser = argparse.ArgumentParser(description="建立 Kali Template 並快速複製多台 VM")
     parser.add_argument("--nlp", type=str, help="自然語言描述 VM 建立指令")
+    parser.add_argument("--nlp-backend", choices=["openai", "http", "rules"], help="NLP 模型後端（預設讀取 NLP_BACKEND，未設定時為 openai）")
+    parser.add_argument("--nlp-url", help="http 後端的 OpenAI 相容 API 位址（預設讀取 NLP_API_URL）")
+    parser.add_argument("--nlp-model", help="模型名稱（openai 預設 gpt-4）")
+    parser.add_argument("--nlp-cache", help="NLP 解析快取路徑（預設為 <workdir>/.nlp_cache.json）")
+    parser.add_argument("--no-nlp-rules", action="store_true", help="不使用規則解析，一律交由模型處理")
     parser.add_argument("--count", type=int, default=1)
     parser.add_argument("--name", nargs='+', default=["kali-vm"])
     parser.add_argument("--description", default="Kali VM auto-generated")
@@ -271,20 +127,20 @@ if __name__ == "__main__":
     parser.add_argument("--resize", default="+0G")
     parser.add_argument("--storage", default="local-lvm")
     parser.add_argument("--workdir", default="/var/lib/vz/template/iso/kali-images")
+    parser.add_argument("--offline", action="store_true", help="不連線 Kali 鏡像站，直接使用快取的版本資訊")
+    parser.add_argument("--release-ttl", type=int, default=DEFAULT_TTL, help="Kali 版本快取有效秒數")
+    parser.add_argument("--download-segments", type=int, default=4, help="映像下載的並行連線（分段）數")
+    parser.add_argument("--template-version", help="指定使用的 Kali 模板版本（預設為最新版）")
+    parser.add_argument("--template-slots", type=int, default=TEMPLATE_SLOTS, help="保留的版本化模板數量上限")
+    parser.add_argument("--stream-import", action="store_true", help="以 7z 串流解壓縮：檔案型儲存直接寫入磁碟卷，區塊型儲存（如 local-lvm）經稀疏暫存 qcow2 轉換後刪除")
+    parser.add_argument("--report", help="執行報告 JSONL 路徑（預設為 <workdir>/.run_reports.jsonl）")
+    parser.add_argument("--prom-textfile", help="輸出 Prometheus textfile collector 指標的 .prom 路徑（可選）")
+    parser.add_argument("--backend", choices=["cli", "api"], help="Proxmox 操作後端（預設讀取 PVE_BACKEND，未設定時為 cli）")
     args = parser.parse_args()
+    run = start_run("test_kali", params={"nlp": bool(args.nlp)})
 
     if args.nlp:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            key_file = Path("~/.openai_api_key").expanduser()
-            if key_file.exists():
-                with key_file.open() as f:
-                    api_key = f.read().strip()
-            else:
-                raise RuntimeError("[ERROR] NLP 模式需設定 OPENAI_API_KEY 環境變數或 ~/.openai_api_key")
-        openai.api_key = api_key
-
-        parsed_args = parse_nlp_to_args(args.nlp)
+        parsed_args = parse_nlp_to_args(args.nlp, args)
         args.count = parsed_args.get("count", 1)
         args.name = parsed_args.get("name", ["kali-nlp"])
         args.description = parsed_args.get("description", "Kali NLP VM")
@@ -307,6 +163,8 @@ if __name__ == "__main__":
         raise ValueError("[ERROR] --resize 格式無效，請使用類似 +10G 的格式")
     if args.vlan and not args.vlan.isdigit():
         raise ValueError("[ERROR] --vlan 必須是數字")
+    if args.download_segments < 1:
+        raise ValueError("[ERROR] --download-segments 必須大於等於 1")
 
     # 名稱規則處理
     if len(args.name) == 1:
@@ -316,28 +174,19 @@ if __name__ == "__main__":
     else:
         raise ValueError(f"[ERROR] VM 名稱數量（{len(args.name)}）與 --count（{args.count}）不一致")
 
+    configure_backend(args.backend)
     working_dir = Path(args.workdir)
-    version_file = working_dir / ".kali_version"
-    template_conf = Path(f"/etc/pve/qemu-server/{TEMPLATE_ID}.conf")
-    qcow2file = next(working_dir.glob("*.qcow2"), None)
-    _, version, _, _ = get_latest_kali_url("https://cdimage.kali.org/")
-
-    version_changed = True
-    if version_file.exists():
-        with version_file.open() as vf:
-            if vf.read().strip() == version:
-                version_changed = False
-
-    if not template_conf.exists() or not qcow2file or version_changed:
-        print(f"[INFO] 偵測到以下情況需建立黃金映像：")
-        if not template_conf.exists(): print("  - VM 9000 不存在")
-        if not qcow2file: print("  - 缺少 qcow2 映像")
-        if version_changed: print(f"  - 發現新版 Kali：{version}")
-        create_template(args, version)
-
     all_vms = []
-    for i in range(args.count):
-        all_vms.append(deploy_vm(args, vm_names[i], i))
+    try:
+        # 模板與 auto_build_kali_vm.py 共用同一登錄表（版本固定、SHA256 比對、保護仍有 linked clone 的模板）
+        release = get_latest_kali_url(KALI_BASE_URL, working_dir, args.release_ttl, args.offline)
+        template_id = ensure_template(args, release)
+
+        for i in range(args.count):
+            all_vms.append(deploy_vm(args, vm_names[i], template_id, i))
+    finally:
+        run.params["count"] = args.count
+        run.finish(args.report or working_dir / ".run_reports.jsonl", args.prom_textfile)
 
     print("\n=== 所有 Kali VM 建立完成 ===\n")
     for vm in all_vms:
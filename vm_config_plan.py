@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# VM 設定規劃：收集所有欲變更的設定，與現有設定比對後以最少次數套用（相同者略過），減少叢集設定鎖與 pmxcfs 寫入
+
+import re
+from pve_backend import get_backend
+from pve_storage import parse_size_bytes
+from vm_inventory import NIC_MODELS, load_inventory
+
+CLONE_KEYS = ("description",)  # qm clone 可直接帶入、不需另外 qm set 的設定
+
+# 由 VM 清單快取取得目前設定（含叢集其他節點；description 取自開頭 # 註解行），不在清單中時改由後端查詢
+def read_current_config(vm_id, config_root=None):
+    record = load_inventory(config_root, refresh=False).reload(vm_id)
+    if record is None:
+        return get_backend().get_config(vm_id)
+    return dict(record.config)
+
+def _split_options(value):
+    options = {}
+    for part in str(value).split(","):
+        key, sep, val = part.partition("=")
+        options[key.strip()] = val.strip() if sep else None
+    return options
+
+# 將設定值正規化後再比對：網卡忽略 MAC 與預設 firewall，agent 接受 1 / enabled=1
+def normalize(key, value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if re.fullmatch(r"net\d+", key):
+        options = {}
+        for name, val in _split_options(value).items():
+            if name in NIC_MODELS:
+                options["model"] = name      # virtio=AA:BB:... 形式，MAC 由 Proxmox 產生
+            elif name == "model":
+                options["model"] = val
+            elif name not in ("macaddr",) and val is not None:
+                options[name] = val
+        if options.get("firewall") == "0":
+            options.pop("firewall")
+        return tuple(sorted(options.items()))
+    if key == "agent":
+        options = _split_options(value)
+        enabled = options.pop("enabled", None) or next((k for k, v in options.items() if v is None), "0")
+        options = {k: v for k, v in options.items() if v is not None}
+        return (enabled, tuple(sorted(options.items())))
+    if key == "boot":
+        return value.replace(" ", "")
+    return value
+
+# 判斷 qm resize 是否會改變容量（+0G 或絕對值不大於目前容量時略過）
+def resize_needed(current_disk, size):
+    size = str(size).strip()
+    if size.startswith("+"):
+        return parse_size_bytes(size[1:] or "0") > 0
+    current = next((o.split("=", 1)[1] for o in str(current_disk or "").split(",") if o.startswith("size=")), None)
+    if current is None:
+        return True
+    return parse_size_bytes(size) > parse_size_bytes(current)
+
+class ConfigPlan:
+    def __init__(self, vm_id, current=None):
+        self.vm_id = vm_id
+        self._current = dict(current) if current is not None else None
+        self.desired = {}
+        self.resizes = []
+
+    # 由模板設定推算 clone 後的設定，不必在 clone 後再讀一次
+    @classmethod
+    def from_template(cls, vm_id, template_config, name=None):
+        current = {k: v for k, v in (template_config or {}).items() if k != "template"}
+        if name:
+            current["name"] = name
+        return cls(vm_id, current if template_config is not None else None)
+
+    @property
+    def current(self):
+        if self._current is None:
+            self._current = read_current_config(self.vm_id)
+        return self._current
+
+    def want(self, **options):
+        self.desired.update({k: v for k, v in options.items() if v is not None})
+        return self
+
+    def want_resize(self, disk, size):
+        if size:
+            self.resizes.append((disk, size))
+        return self
+
+    # 與目前設定不同的項目
+    def diff(self, exclude=()):
+        return {key: value for key, value in self.desired.items()
+                if key not in exclude and normalize(key, value) != normalize(key, self.current.get(key))}
+
+    # 可於 qm clone 時一併帶入的參數（沿用 --key value 形式）
+    def clone_args(self):
+        args = []
+        for key, value in self.desired.items():
+            if key in CLONE_KEYS:
+                args += [f"--{key}", str(value)]
+        return args
+
+    # clone 完成後將已帶入的設定視為已套用
+    def cloned(self):
+        if self._current is not None:
+            self._current.update({k: str(v) for k, v in self.desired.items() if k in CLONE_KEYS})
+
+    # 以單次 set_config 套用所有差異，再執行必要的 resize，回傳實際變更的設定
+    def apply(self, backend=None):
+        backend = backend or get_backend()
+        changes = self.diff()
+        if changes:
+            backend.set_config(self.vm_id, changes)
+            self.current.update({k: str(v) for k, v in changes.items()})
+        else:
+            print(f"[SKIP] VM {self.vm_id} 設定未變更，略過 qm set")
+        for disk, size in self.resizes:
+            if resize_needed(self.current.get(disk), size):
+                backend.resize(self.vm_id, disk, size)
+            else:
+                print(f"[SKIP] VM {self.vm_id} 磁碟 {disk} 已為 {size} 以上，略過 resize")
+        self.resizes = []
+        return changes
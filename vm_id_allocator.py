@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# VM ID 批次配置器：一次取得已使用 ID 快照，並以鎖定檔防止多個建置流程搶到相同 ID
+
+import os
+import json
+import time
+import fcntl
+from pathlib import Path
+from contextlib import contextmanager
+from pve_backend import LOCAL_NODE
+
+PVE_CONFIG_ROOT = Path(os.environ.get("PVE_CONFIG_ROOT", "/etc/pve"))
+LOCK_FILE = Path(os.environ.get("KALI_VMID_LOCK", "/run/lock/kali_vm_ids.lock"))
+RESERVATION_TTL = 1800  # 保留紀錄有效秒數，超過即視為失效
+CLUSTER_LOCK_TIMEOUT = 60
+CLUSTER_LOCK_STALE = 120  # 與 pmxcfs 鎖定目錄的失效時間相同
+
+# 是否為叢集環境（存在 corosync.conf）
+def is_cluster(config_root: Path = None) -> bool:
+    return (Path(config_root or PVE_CONFIG_ROOT) / "corosync.conf").exists()
+
+# 叢集環境下保留紀錄放在 /etc/pve/priv 供所有節點共用，單機則與鎖定檔放在一起
+def _reservation_file() -> Path:
+    if is_cluster():
+        return PVE_CONFIG_ROOT / "priv" / "kali_vm_ids.json"
+    return LOCK_FILE.with_suffix(".json")
+
+# 取得所有已使用 VM/CT ID 的快照（僅列目錄，不呼叫 qm / pct）
+def snapshot_used_ids(config_root: Path = None) -> set:
+    root = Path(config_root or PVE_CONFIG_ROOT)
+    dirs = [root / "qemu-server", root / "lxc"]
+    # 叢集環境下 /etc/pve/nodes/<node>/ 底下含所有節點的設定
+    dirs += [node / kind for node in (root / "nodes").glob("*") for kind in ("qemu-server", "lxc")]
+    used = set()
+    for d in dirs:
+        try:
+            entries = os.listdir(d)
+        except OSError:
+            continue
+        for name in entries:
+            stem, _, ext = name.partition(".")
+            if ext == "conf" and stem.isdigit():
+                used.add(int(stem))
+    return used
+
+# 叢集鎖定：pmxcfs 上的 mkdir 為叢集層級的原子操作（與 Proxmox 自身 priv/lock 的做法相同）
+@contextmanager
+def _cluster_lock():
+    lock_dir = PVE_CONFIG_ROOT / "priv" / "lock" / "kali-vmid"
+    lock_dir.parent.mkdir(parents=True, exist_ok=True)
+    deadline = time.monotonic() + CLUSTER_LOCK_TIMEOUT
+    while True:
+        try:
+            lock_dir.mkdir()
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock_dir.stat().st_mtime > CLUSTER_LOCK_STALE:
+                    lock_dir.rmdir()
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"[ERROR] 無法取得叢集 VM ID 鎖定：{lock_dir}")
+            time.sleep(0.2)
+    try:
+        yield
+    finally:
+        try:
+            lock_dir.rmdir()
+        except OSError:
+            pass
+
+# 以 flock 鎖定本機程序，叢集環境再取得叢集鎖，確保同一時間只有一個程序在配置 ID
+@contextmanager
+def _locked():
+    LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with LOCK_FILE.open("a+") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        try:
+            if is_cluster():
+                with _cluster_lock():
+                    yield
+            else:
+                yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# 讀取仍有效的保留紀錄（程序已結束或逾時者自動清除；其他節點的程序只依逾時判斷）
+def _load_reservations(used: set) -> dict:
+    path = _reservation_file()
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {
+        vm_id: entry for vm_id, entry in data.items()
+        if int(vm_id) not in used
+        and now - entry.get("ts", 0) < RESERVATION_TTL
+        and (entry.get("node", LOCAL_NODE) != LOCAL_NODE or _pid_alive(entry.get("pid", 0)))
+    }
+
+def _save_reservations(reservations: dict):
+    path = _reservation_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(reservations))
+    tmp.replace(path)
+
+# 一次保留 count 個可用 ID；contiguous=True 時保證為連續區段
+def reserve_vm_ids(count: int, start: int = 100, contiguous: bool = False, config_root: Path = None) -> list:
+    if count < 1:
+        raise ValueError("[ERROR] 保留的 VM ID 數量必須大於等於 1")
+    with _locked():
+        used = snapshot_used_ids(config_root)
+        reservations = _load_reservations(used)
+        taken = used | {int(vm_id) for vm_id in reservations}
+
+        ids = []
+        candidate = start
+        while len(ids) < count:
+            if candidate in taken:
+                if contiguous:
+                    ids = []
+            else:
+                ids.append(candidate)
+            candidate += 1
+
+        now = time.time()
+        for vm_id in ids:
+            reservations[str(vm_id)] = {"pid": os.getpid(), "ts": now, "node": LOCAL_NODE}
+        _save_reservations(reservations)
+    return ids
+
+# 釋放保留（VM 建立完成後 conf 已存在，或部署失敗時呼叫）
+def release_vm_ids(ids):
+    with _locked():
+        reservations = _load_reservations(snapshot_used_ids())
+        for vm_id in ids:
+            reservations.pop(str(vm_id), None)
+        _save_reservations(reservations)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# VM 清單快取：直接解析 /etc/pve（含叢集各節點）的 qemu-server / lxc 設定檔為結構化紀錄，
+# 依檔案 mtime 與大小增量更新並保存於快取檔，部署、批次刪除與報表共用同一查詢介面，不需逐台呼叫 qm config
+
+import os
+import re
+import json
+import time
+import threading
+from pathlib import Path
+from urllib.parse import unquote
+from pve_storage import parse_size_bytes
+from vm_id_allocator import PVE_CONFIG_ROOT, LOCK_FILE, LOCAL_NODE
+
+CACHE_FILE = Path(os.environ.get("KALI_INVENTORY_CACHE", str(LOCK_FILE.with_name("kali_inventory.json"))))
+CACHE_VERSION = 1
+# pmxcfs 的 mtime 只有秒級精度：最近 RACY_SECONDS 秒內修改的檔案一律重新讀取，避免同一秒內的變更被快取遮蔽
+RACY_SECONDS = 2
+DISK_KEY = re.compile(r"^(scsi|sata|ide|virtio|efidisk|tpmstate|unused)\d+$|^rootfs$|^mp\d+$")
+NET_KEY = re.compile(r"^net\d+$")
+NIC_MODELS = ("virtio", "e1000", "e1000e", "rtl8139", "vmxnet3")
+
+# 解析設定檔內容：開頭 # 行為 description（URL 編碼），遇到快照區段 [name] 即停止
+def parse_conf(text):
+    config = {}
+    description = []
+    for line in text.splitlines():
+        if line.startswith("["):
+            break
+        if line.startswith("#"):
+            description.append(unquote(line[1:]))
+            continue
+        key, sep, value = line.partition(":")
+        if sep and key:
+            config[key.strip()] = value.strip()
+    if description:
+        config.setdefault("description", "\n".join(description))
+    return config
+
+# Proxmox 標籤字串（以 ; 分隔，舊版也可能用 , 或空白）轉為集合
+def parse_tags(text):
+    return {t for t in re.split(r"[;,\s]+", str(text or "")) if t}
+
+class Disk:
+    def __init__(self, key, value):
+        volume, *options = value.split(",")
+        opts = dict(o.split("=", 1) for o in options if "=" in o)
+        self.key = key
+        self.volume = volume
+        self.storage = volume.split(":", 1)[0] if ":" in volume else None
+        self.size_text = opts.get("size")
+        self.size = parse_size_bytes(self.size_text) if self.size_text else None
+        self.media = opts.get("media", "disk")
+        # linked clone 的磁碟卷形如 local-lvm:base-9000-disk-0/vm-101-disk-0
+        match = re.search(r"base-(\d+)-disk", volume)
+        self.base_template = int(match.group(1)) if match and "/" in volume else None
+
+class Net:
+    def __init__(self, key, value):
+        opts = {}
+        for part in value.split(","):
+            name, _, val = part.partition("=")
+            opts[name] = val
+        model = next((m for m in NIC_MODELS if m in opts), opts.get("model") or opts.get("type"))
+        self.key = key
+        self.model = model
+        self.mac = opts.get(model) or opts.get("hwaddr") or opts.get("macaddr")
+        self.bridge = opts.get("bridge")
+        self.tag = opts.get("tag")
+        self.ip = opts.get("ip")          # LXC 網卡可設定固定 IP
+
+class VmRecord:
+    def __init__(self, vm_id, kind, node, config):
+        self.vm_id = vm_id
+        self.kind = kind                  # "qemu" 或 "lxc"
+        self.node = node
+        self.config = config
+        self.name = config.get("name") or config.get("hostname") or ""
+        self.memory = int(config.get("memory") or 0)
+        self.balloon = int(config["balloon"]) if str(config.get("balloon", "")).isdigit() else None
+        self.cores = int(config.get("cores") or 1)
+        self.template = str(config.get("template", "0")) == "1"
+        self.description = config.get("description", "")
+        self.tags = parse_tags(config.get("tags"))
+        self.disks = [Disk(k, v) for k, v in config.items() if DISK_KEY.match(k) and "media=cdrom" not in v]
+        self.nets = [Net(k, v) for k, v in config.items() if NET_KEY.match(k)]
+
+    def disk(self, key=None):
+        if key is None:
+            return self.disks[0] if self.disks else None
+        return next((d for d in self.disks if d.key == key), None)
+
+    @property
+    def disk_bytes(self):
+        return sum(d.size or 0 for d in self.disks if d.media == "disk")
+
+class VmInventory:
+    def __init__(self, config_root=None, cache_file=None):
+        self.root = Path(config_root or PVE_CONFIG_ROOT)
+        self.cache_file = Path(cache_file or CACHE_FILE)
+        self._entries = {}                # {設定檔路徑: {"mtime_ns", "size", "node", "kind", "config"}}
+        self._records = {}
+        self._lock = threading.Lock()
+        self._load_cache()
+
+    def _load_cache(self):
+        try:
+            data = json.loads(self.cache_file.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") == CACHE_VERSION and data.get("root") == str(self.root):
+            self._entries = data.get("entries", {})
+
+    def _save_cache(self):
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_file.with_name(f".{self.cache_file.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"version": CACHE_VERSION, "root": str(self.root), "entries": self._entries}))
+            tmp.replace(self.cache_file)
+        except OSError:
+            pass
+
+    # 列出所有設定檔：nodes/<node>/{qemu-server,lxc}，單機未建立 nodes 目錄時退回 qemu-server / lxc
+    def _conf_files(self):
+        files = []
+        for node_dir in (self.root / "nodes").glob("*"):
+            for kind, sub in (("qemu", "qemu-server"), ("lxc", "lxc")):
+                files += [(p, node_dir.name, kind) for p in (node_dir / sub).glob("*.conf")]
+        if not files:
+            for kind, sub in (("qemu", "qemu-server"), ("lxc", "lxc")):
+                files += [(p, LOCAL_NODE, kind) for p in (self.root / sub).glob("*.conf")]
+        return [(p, node, kind) for p, node, kind in files if p.stem.isdigit()]
+
+    # 只重新解析 mtime 或大小有變動（或剛修改過）的設定檔，回傳自身以便串接查詢
+    def refresh(self):
+        with self._lock:
+            now = time.time()
+            entries, changed = {}, False
+            for path, node, kind in self._conf_files():
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                key = str(path)
+                cached = self._entries.get(key)
+                if cached and cached["mtime_ns"] == st.st_mtime_ns and cached["size"] == st.st_size \
+                        and now - st.st_mtime > RACY_SECONDS:
+                    entries[key] = cached
+                    continue
+                try:
+                    config = parse_conf(path.read_text())
+                except OSError:
+                    continue
+                entries[key] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "node": node, "kind": kind,
+                                "config": config}
+                changed = changed or cached is None or cached["config"] != config
+            changed = changed or entries.keys() != self._entries.keys()
+            # 先建好完整的對照表再一次替換，其他執行緒不加鎖讀取時不會看到空的或只填一半的清單
+            records = {}
+            for key, entry in entries.items():
+                vm_id = int(Path(key).stem)
+                records[vm_id] = VmRecord(vm_id, entry["kind"], entry["node"], entry["config"])
+            self._entries = entries
+            self._records = records
+            if changed:
+                self._save_cache()
+        return self
+
+    # 只重新讀取單一 VM 的設定檔（部署中剛 clone / 修改的 VM），不重新掃描整個目錄；回傳最新紀錄或 None
+    def reload(self, vm_id):
+        vm_id = int(vm_id)
+        candidates = [(node_dir / sub / f"{vm_id}.conf", node_dir.name, kind)
+                      for node_dir in (self.root / "nodes").glob("*")
+                      for kind, sub in (("qemu", "qemu-server"), ("lxc", "lxc"))]
+        if not candidates:
+            candidates = [(self.root / sub / f"{vm_id}.conf", LOCAL_NODE, kind)
+                          for kind, sub in (("qemu", "qemu-server"), ("lxc", "lxc"))]
+        with self._lock:
+            entries = {k: v for k, v in self._entries.items() if Path(k).stem != str(vm_id)}
+            records = dict(self._records)
+            records.pop(vm_id, None)
+            for path, node, kind in candidates:
+                try:
+                    st = path.stat()
+                    config = parse_conf(path.read_text())
+                except OSError:
+                    continue
+                entries[str(path)] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "node": node, "kind": kind,
+                                      "config": config}
+                records[vm_id] = VmRecord(vm_id, kind, node, config)
+                break
+            self._entries = entries
+            self._records = records
+        return records.get(vm_id)
+
+    def get(self, vm_id):
+        return self._records.get(int(vm_id))
+
+    def ids(self):
+        return set(self._records)
+
+    def __iter__(self):
+        return iter(sorted(self._records.values(), key=lambda r: r.vm_id))
+
+    # 依條件篩選紀錄（None 表示不限）
+    def query(self, kind=None, node=None, name_prefix=None, tag=None, template=None):
+        return [r for r in self
+                if (kind is None or r.kind == kind) and (node is None or r.node == node)
+                and (name_prefix is None or r.name.startswith(name_prefix))
+                and (tag is None or tag in r.tags) and (template is None or r.template == template)]
+
+    # {名稱: VM ID}，同名時保留 ID 最小者
+    def by_name(self, kind="qemu"):
+        names = {}
+        for record in self.query(kind=kind):
+            if record.name:
+                names.setdefault(record.name, record.vm_id)
+        return names
+
+    # 仍以 linked clone 方式引用此模板 base 磁碟的 VM
+    def linked_clones(self, template_id):
+        return [r for r in self if r.vm_id != template_id and any(d.base_template == template_id for d in r.disks)]
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+# 取得指定 /etc/pve 根目錄的共用清單；refresh=False 時沿用上次掃描結果（首次取得時仍會掃描），
+# 逐台查詢的呼叫端應於整批操作前掃描一次，單台 VM 改用 reload()，避免每台都重新 stat 所有設定檔
+def load_inventory(config_root=None, refresh=True):
+    root = str(config_root or PVE_CONFIG_ROOT)
+    with _inventories_lock:
+        inventory = _inventories.get(root)
+        if inventory is None:
+            inventory = _inventories[root] = VmInventory(root)
+            refresh = True
+    return inventory.refresh() if refresh else inventory
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 批次部署清單（manifest）：以 YAML / JSON 描述多組 VM 與個別覆寫設定，並依現有 VM 名稱只建立缺少的部分
+
+import json
+import argparse
+from pathlib import Path
+from vm_inventory import load_inventory
+
+# 可於 defaults / group / overrides 中設定的欄位（對應 CLI 參數名稱，resize 為 clone 後的磁碟調整）
+VM_KEYS = ("description", "min_mem", "max_mem", "cpu", "bridge", "vlan", "resize")
+GROUP_KEYS = ("name", "names", "count", "overrides") + VM_KEYS
+
+# 名稱規則：單一名稱時自動編號，多名稱時需與 count 相等
+def expand_names(names, count):
+    if len(names) == 1:
+        return [names[0]] + [f"{names[0]}-{i}" for i in range(1, count)]
+    if len(names) == count:
+        return list(names)
+    raise ValueError(f"[ERROR] VM 名稱數量（{len(names)}）與 count（{count}）不一致")
+
+# 讀取 manifest：.yaml / .yml 需 PyYAML，其餘以 JSON 解析
+def load_manifest(path):
+    path = Path(path)
+    text = path.read_text()
+    if path.suffix.lower() in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("[ERROR] 讀取 YAML manifest 需安裝 PyYAML（pip install pyyaml），或改用 JSON 格式")
+        manifest = yaml.safe_load(text)
+    else:
+        manifest = json.loads(text)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("groups"), list) or not manifest["groups"]:
+        raise ValueError(f"[ERROR] manifest {path} 必須包含非空的 groups 清單")
+    return manifest
+
+def _check_keys(where, data, allowed):
+    if not isinstance(data, dict):
+        raise ValueError(f"[ERROR] manifest {where} 必須是物件")
+    unknown = set(data) - set(allowed)
+    if unknown:
+        raise ValueError(f"[ERROR] manifest {where} 含未知欄位：{', '.join(sorted(unknown))}")
+
+def _apply(namespace, values):
+    for key in VM_KEYS:
+        if values.get(key) is not None:
+            setattr(namespace, key, str(values[key]) if key == "vlan" else values[key])
+
+# 展開 manifest 為 (VM 參數, 名稱, 組內序號) 清單；base_args 為 CLI 參數，validate 為逐台驗證函式
+def expand_manifest(manifest, base_args, validate=None):
+    _check_keys("頂層", manifest, ("defaults", "groups"))
+    defaults = manifest.get("defaults") or {}
+    _check_keys("defaults", defaults, VM_KEYS)
+
+    entries = []
+    seen = set()
+    for number, group in enumerate(manifest["groups"], 1):
+        where = f"groups[{number}]"
+        _check_keys(where, group, GROUP_KEYS)
+        count = group.get("count", 1)
+        names = group.get("names") or ([group["name"]] if group.get("name") else None)
+        if not names:
+            raise ValueError(f"[ERROR] manifest {where} 需指定 name 或 names")
+        if not isinstance(count, int):
+            raise ValueError(f"[ERROR] manifest {where} 的 count 必須是整數")
+        if count < 1:
+            raise ValueError(f"[ERROR] manifest {where} 的 count 必須大於等於 1")
+        overrides = group.get("overrides") or {}
+        _check_keys(f"{where}.overrides", overrides, expand_names(names, count))
+
+        for index, name in enumerate(expand_names(names, count)):
+            if name in seen:
+                raise ValueError(f"[ERROR] manifest 中 VM 名稱重複：{name}")
+            seen.add(name)
+            vm_args = argparse.Namespace(**vars(base_args))
+            vm_args.resize = None   # CLI --resize 只作用於模板，clone 的磁碟調整需於 manifest 指定
+            _apply(vm_args, defaults)
+            _apply(vm_args, group)
+            override = overrides.get(name) or {}
+            _check_keys(f"{where}.overrides.{name}", override, VM_KEYS)
+            _apply(vm_args, override)
+            vm_args.clone_resize, vm_args.resize = vm_args.resize, base_args.resize
+            vm_args.count = count
+            if validate:
+                try:
+                    validate(vm_args)
+                except ValueError as e:
+                    raise ValueError(f"{e}（manifest VM {name}）")
+            entries.append((vm_args, name, index))
+    return entries
+
+# 讀取現有 VM 名稱（含叢集其他節點），用於重跑 manifest 時略過已建立的 VM
+def existing_vm_names(config_root=None):
+    return load_inventory(config_root).by_name()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# 預熱 VM 池：預先 clone 並開機數台 Kali VM（IP 已知），請求時只需改名並套用描述 / VLAN 即可立即交付
+# 池內數量低於低水位時於背景補充至高水位，閒置過久或模板已更新的 VM 會被淘汰
+
+import sys
+import json
+import time
+import fcntl
+import argparse
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager, redirect_stdout
+from pve_backend import configure_backend, get_backend
+from vm_config_plan import ConfigPlan, read_current_config
+from vm_id_allocator import reserve_vm_ids, release_vm_ids, snapshot_used_ids
+from kali_release import KALI_BASE_URL, DEFAULT_TTL
+from template_registry import TEMPLATE_SLOTS
+
+POOL_NAME = ".warm_pool.json"       # 與 .kali_version 放在同一工作目錄
+POOL_PREFIX = "kali-pool"
+POOL_MARKER = "kali-warm-pool"      # 池中 VM 的描述，方便在 Proxmox 介面辨識
+DEFAULT_WORKDIR = "/var/lib/vz/template/iso/kali-images"
+DEFAULT_LOW = 2
+DEFAULT_HIGH = 5
+DEFAULT_IDLE_TTL = 24 * 3600
+# 建立池中 VM 的參數（對應 auto_build_kali_vm.py），refill / serve 時寫入池檔供背景補充沿用
+POOL_VM_DEFAULTS = {
+    "min_mem": 4096, "max_mem": 8192, "cpu": 4, "bridge": "vmbr0", "vlan": None, "storage": "local-lvm",
+    "resize": "+0G", "offline": False, "release_ttl": DEFAULT_TTL, "download_segments": 4,
+    "template_version": None, "template_slots": TEMPLATE_SLOTS, "stream_import": False, "full_clone": False,
+    "parallel": 4, "clone_concurrency": 2, "start_concurrency": 4, "ip_timeout": 120,
+}
+
+# 保留 MAC 與其他網卡參數，只替換 bridge 與 VLAN tag（vlan 為 None 時沿用原本的 tag）
+def retag_net(net0, bridge=None, vlan=None):
+    options = [p for p in str(net0 or "").split(",") if p]
+    current = dict(p.split("=", 1) for p in options if "=" in p)
+    keep = [p for p in options if not p.startswith(("bridge=", "tag="))]
+    keep.append(f"bridge={bridge or current.get('bridge', 'vmbr0')}")
+    tag = current.get("tag") if vlan is None else vlan
+    if tag:
+        keep.append(f"tag={tag}")
+    return ",".join(keep)
+
+def _net_matches(entry, bridge, vlan):
+    return (bridge is None or entry.get("bridge") == bridge) and (vlan is None or str(entry.get("vlan") or "") == str(vlan))
+
+# 停止並刪除 VM（淘汰或建立失敗時使用）
+def destroy_vm(vm_id, node=None):
+    backend = get_backend()
+    if node:
+        backend.assign_node(vm_id, node)
+    try:
+        backend.stop(vm_id)
+    except Exception as e:
+        print(f"[WARN] 停止 VM {vm_id} 失敗：{e}")
+    backend.destroy(vm_id)
+
+class WarmPool:
+    def __init__(self, workdir=DEFAULT_WORKDIR, low=DEFAULT_LOW, high=DEFAULT_HIGH, idle_ttl=DEFAULT_IDLE_TTL):
+        if low < 0 or high < max(1, low):
+            raise ValueError("[ERROR] 水位設定無效：需 0 <= low <= high 且 high >= 1")
+        self.workdir = Path(workdir)
+        self.path = self.workdir / POOL_NAME
+        self.low = low
+        self.high = high
+        self.idle_ttl = idle_ttl
+        self.entries = []
+        self.settings = {}
+
+    # 鎖定池檔（讀取 → 修改 → 寫回），避免多個請求取得同一台 VM
+    @contextmanager
+    def locked(self):
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        with self.path.with_suffix(".lock").open("a+") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                self.load()
+                yield self
+                self.save()
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    # 載入池檔並移除 VM 已不存在的紀錄
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        used = snapshot_used_ids()
+        self.entries = [e for e in data.get("entries", []) if e["vm_id"] in used]
+        self.settings = data.get("settings", {})
+        return self.entries
+
+    def save(self):
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"settings": self.settings, "entries": self.entries}, indent=2, ensure_ascii=False))
+        tmp.replace(self.path)
+
+    # 取出一台預熱 VM 並改名、套用描述與網路；優先選擇網路相同者（IP 不變），池為空時回傳 None
+    def claim(self, name, description=None, vlan=None, bridge=None):
+        with self.locked():
+            if not self.entries:
+                return None
+            entry = next((e for e in self.entries if _net_matches(e, bridge, vlan)), self.entries[0])
+            self.entries.remove(entry)
+
+        vm_id = entry["vm_id"]
+        backend = get_backend()
+        if entry.get("node"):
+            backend.assign_node(vm_id, entry["node"])
+        try:
+            current = read_current_config(vm_id)
+            changes = ConfigPlan(vm_id, current).want(
+                name=name, description=description or f"Kali VM {name}",
+                net0=retag_net(current.get("net0"), bridge, vlan)).apply(backend)
+        except Exception:
+            with self.locked():
+                self.entries.insert(0, entry)
+            raise
+        ip = entry.get("ip")
+        if "net0" in changes:
+            # 網路變更後 guest 需重新取得 DHCP，原 IP 不再可靠
+            print(f"[WARN] VM {vm_id} 網路已變更（bridge / VLAN），IP 需待 guest 重新取得", file=sys.stderr)
+            ip = None
+        print(f"[OK] 由預熱池取得 VM {vm_id}，已命名為 {name}", file=sys.stderr)
+        return {"vm_id": vm_id, "name": name, "ip": ip, "node": entry.get("node"),
+                "pooled_seconds": round(time.time() - entry["created"], 1)}
+
+    # 淘汰閒置超過 idle_ttl 或使用舊模板的 VM，回傳被淘汰的紀錄
+    def evict_idle(self, template_id=None):
+        now = time.time()
+        with self.locked():
+            evicted = [e for e in self.entries
+                       if now - e["created"] > self.idle_ttl or (template_id and e.get("template_id") != template_id)]
+            self.entries = [e for e in self.entries if e not in evicted]
+        for entry in evicted:
+            print(f"[INFO] 淘汰預熱 VM {entry['vm_id']}（閒置 {(now - entry['created']) / 3600:.1f} 小時）")
+            try:
+                destroy_vm(entry["vm_id"], entry.get("node"))
+            except Exception as e:
+                print(f"[WARN] 刪除預熱 VM {entry['vm_id']} 失敗：{e}")
+        return evicted
+
+    # 低於低水位時補充至高水位；同一時間只允許一個補充程序，回傳新增台數
+    def refill(self, args):
+        with self.path.with_suffix(".refill.lock").open("a+") as lf:
+            try:
+                fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print("[SKIP] 已有補充程序執行中")
+                return 0
+            with self.locked():
+                self.settings = {key: getattr(args, key) for key in POOL_VM_DEFAULTS}
+                ready = len(self.entries)
+            if ready >= self.low:
+                print(f"[SKIP] 預熱池尚有 {ready} 台（低水位 {self.low}），不需補充")
+                return 0
+            template_id, created = build_pool_vms(args, self.high - ready)
+            self.evict_idle(template_id)
+            with self.locked():
+                self.entries += created
+            print(f"[OK] 預熱池補充 {len(created)} 台，目前共 {ready + len(created)} 台")
+            return len(created)
+
+    # 刪除池中所有 VM
+    def drain(self):
+        with self.locked():
+            entries, self.entries = self.entries, []
+        for entry in entries:
+            destroy_vm(entry["vm_id"], entry.get("node"))
+        return entries
+
+# 以 deploy_vm 建立 count 台池 VM，回傳 (模板 ID, 成功的池紀錄)
+def build_pool_vms(args, count):
+    from auto_build_kali_vm import ensure_template, get_latest_kali_url, deploy_vms_parallel, StageLimits
+    from clone_planner import plan_clones
+    from host_capacity import AdmissionController
+
+    workdir = Path(args.workdir)
+    release = get_latest_kali_url(KALI_BASE_URL, workdir, args.release_ttl, args.offline)
+    template_id = ensure_template(args, release)
+    args.template_id = template_id
+    args.template_config = get_backend().get_config(template_id)
+    args.description = POOL_MARKER
+    vm_ids = reserve_vm_ids(count, 100)
+    try:
+        plans = plan_clones(template_id, vm_ids, args.full_clone, template_config=args.template_config)
+        jobs = [(args, f"{POOL_PREFIX}-{vm_id}", None, vm_id, plan) for vm_id, plan in zip(vm_ids, plans)]
+        limits = StageLimits(args.clone_concurrency, args.start_concurrency, AdmissionController())
+        results = deploy_vms_parallel(jobs, args.parallel, limits, args.ip_timeout)
+    finally:
+        release_vm_ids(vm_ids)
+
+    created = []
+    used = snapshot_used_ids()
+    for vm_id, result in zip(vm_ids, results):
+        if "error" in result or result.get("ip") in (None, "未知"):
+            print(f"[WARN] 預熱 VM {vm_id} 建立失敗或未取得 IP，將刪除：{result.get('error', '未取得 IP')}")
+            if vm_id in used:
+                try:
+                    destroy_vm(vm_id, result.get("node"))
+                except Exception as e:
+                    print(f"[WARN] 刪除 VM {vm_id} 失敗：{e}")
+            continue
+        created.append({"vm_id": vm_id, "name": result["name"], "ip": result["ip"], "node": result.get("node"),
+                        "template_id": template_id, "bridge": args.bridge, "vlan": args.vlan,
+                        "created": time.time()})
+    return template_id, created
+
+# 以獨立程序在背景補充，不阻塞交付請求（沿用目前的 Proxmox 後端）
+def spawn_background_refill(workdir, low, high, idle_ttl, backend=None):
+    subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "--workdir", str(workdir),
+                      "--low", str(low), "--high", str(high), "--idle-ttl", str(idle_ttl),
+                      "--backend", backend or get_backend().name, "refill", "--saved"],
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+def _pool_vm_args(args, saved=None):
+    values = dict(POOL_VM_DEFAULTS, **(saved or {}))
+    if not saved:
+        values.update({key: getattr(args, key) for key in POOL_VM_DEFAULTS if hasattr(args, key)})
+    return argparse.Namespace(workdir=args.workdir, **values)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kali 預熱 VM 池")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--low", type=int, default=DEFAULT_LOW, help="低水位：池內少於此數量時開始補充")
+    parser.add_argument("--high", type=int, default=DEFAULT_HIGH, help="高水位：補充至此數量")
+    parser.add_argument("--idle-ttl", type=int, default=DEFAULT_IDLE_TTL, help="池中 VM 閒置超過此秒數即淘汰重建")
+    parser.add_argument("--backend", choices=["cli", "api"], help="Proxmox 操作後端（預設讀取 PVE_BACKEND）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("status", help="列出池中 VM")
+    claim_parser = sub.add_parser("claim", help="取得一台預熱 VM（stdout 只輸出 JSON，訊息寫到 stderr）")
+    claim_parser.add_argument("--name", required=True)
+    claim_parser.add_argument("--description")
+    claim_parser.add_argument("--vlan", type=str)
+    claim_parser.add_argument("--bridge")
+    claim_parser.add_argument("--no-refill", action="store_true", help="取得後不觸發背景補充")
+    sub.add_parser("drain", help="刪除池中所有 VM")
+    for name in ("refill", "serve"):
+        p = sub.add_parser(name, help="補充至高水位" if name == "refill" else "常駐：定期淘汰與補充")
+        p.add_argument("--saved", action="store_true", help="使用池檔中保存的 VM 參數")
+        p.add_argument("--min-mem", type=int, default=POOL_VM_DEFAULTS["min_mem"])
+        p.add_argument("--max-mem", type=int, default=POOL_VM_DEFAULTS["max_mem"])
+        p.add_argument("--cpu", type=int, default=POOL_VM_DEFAULTS["cpu"])
+        p.add_argument("--bridge", default=POOL_VM_DEFAULTS["bridge"])
+        p.add_argument("--vlan", type=str)
+        p.add_argument("--storage", default=POOL_VM_DEFAULTS["storage"])
+        p.add_argument("--offline", action="store_true")
+        p.add_argument("--full-clone", action="store_true")
+        p.add_argument("--parallel", type=int, default=POOL_VM_DEFAULTS["parallel"])
+        p.add_argument("--ip-timeout", type=int, default=POOL_VM_DEFAULTS["ip_timeout"])
+        if name == "serve":
+            p.add_argument("--interval", type=int, default=30, help="檢查間隔秒數")
+    args = parser.parse_args()
+
+    if getattr(args, "vlan", None) and not args.vlan.isdigit():
+        raise ValueError("[ERROR] --vlan 必須是數字")
+    configure_backend(args.backend)
+    pool = WarmPool(args.workdir, args.low, args.high, args.idle_ttl)
+
+    if args.command == "status":
+        with pool.locked():
+            entries = list(pool.entries)
+        now = time.time()
+        print(f"[INFO] 預熱池 {len(entries)} 台（低水位 {pool.low} / 高水位 {pool.high}）")
+        for e in entries:
+            print(f"  - VM {e['vm_id']} {e['name']} IP {e['ip']} 節點 {e.get('node') or '本機'} "
+                  f"VLAN {e.get('vlan') or '-'} 閒置 {(now - e['created']) / 60:.0f} 分鐘")
+    elif args.command == "claim":
+        # stdout 只保留最後的 JSON，供 n8n 等呼叫端直接解析；設定套用過程的訊息一律導向 stderr
+        with redirect_stdout(sys.stderr):
+            result = pool.claim(args.name, args.description, args.vlan, args.bridge)
+        if not args.no_refill:
+            spawn_background_refill(args.workdir, args.low, args.high, args.idle_ttl, args.backend)
+        if result is None:
+            print("[ERROR] 預熱池目前沒有可用的 VM", file=sys.stderr)
+            raise SystemExit(2)
+        print(json.dumps(result, ensure_ascii=False))
+    elif args.command == "drain":
+        print(f"[OK] 已刪除 {len(pool.drain())} 台預熱 VM")
+    elif args.command == "refill":
+        if args.saved:
+            with pool.locked():
+                saved = pool.settings
+        pool.refill(_pool_vm_args(args, saved if args.saved else None))
+    else:
+        vm_args = _pool_vm_args(args, None)
+        print(f"[OK] 預熱池服務啟動（每 {args.interval} 秒檢查一次）")
+        try:
+            while True:
+                pool.evict_idle()
+                pool.refill(vm_args)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass